@@ -0,0 +1,88 @@
+"""
+Сборка альбомов (media_group) в одну доставку
+Telegram присылает альбом отдельными обновлениями с общим media_group_id.
+Части копятся, пока за ALBUM_WINDOW секунд не придет новая, затем весь
+альбом передается обработчику одним списком
+"""
+
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", 1.0))
+# Telegram не присылает в одном альбоме больше 10 частей
+ALBUM_MAX_PARTS = 10
+
+
+class _Album:
+    __slots__ = ("messages", "context", "timer")
+
+    def __init__(self, context: dict):
+        self.messages = []
+        self.context = context
+        self.timer = None
+
+
+class AlbumCollector:
+    """Части альбома по (chat_id, media_group_id); on_album(messages, **context) после тишины в window секунд"""
+
+    def __init__(self, on_album, window: float = ALBUM_WINDOW):
+        self.on_album = on_album
+        self.window = window
+        self._albums = {}
+        self._tasks = set()
+
+        # Метрики
+        self.albums = 0
+        self.parts = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._albums)
+
+    def add(self, message, **context):
+        """Добавление части; context берется из первой части альбома"""
+        key = (message.chat.id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = _Album(context)
+        album.messages.append(message)
+
+        if album.timer is not None:
+            album.timer.cancel()
+        if len(album.messages) >= ALBUM_MAX_PARTS:
+            self._flush(key)
+        else:
+            album.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+    def _flush(self, key):
+        album = self._albums.pop(key, None)
+        if album is None:
+            return
+        if album.timer is not None:
+            album.timer.cancel()
+
+        self.albums += 1
+        self.parts += len(album.messages)
+        messages = sorted(album.messages, key=lambda message: message.message_id)
+        task = asyncio.create_task(self._deliver(messages, album.context))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, messages: list, context: dict):
+        try:
+            await self.on_album(messages, **context)
+        except Exception as e:
+            logger.error(f"❌ Ошибка доставки альбома ({len(messages)} частей): {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "albums": self.albums, "parts": self.parts}
+
+    async def stop(self):
+        """Немедленная доставка собранных альбомов и ожидание отправки"""
+        for key in list(self._albums):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,37 +1,88 @@
+import time
 import asyncio
-import sqlite3
 import secrets
 import os
 import logging
+from html import escape
 from datetime import datetime
+from functools import lru_cache
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 
-# Настройка логирования для Render
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from logging_setup import setup_logging, sample_text
+from repository import create_repository, search_terms
+from fsm_storage import SQLiteFSMStorage
+from outbound import OutboundScheduler, bulk_priority
+from delivery import ContentKind, DELIVER_TEXT, HEADER_CALLBACK, detect_kind, album_media
+from albums import AlbumCollector
+from antiflood import AntiFloodMiddleware
+from dedup import DuplicateFilter, fingerprint, album_fingerprint
+from maintenance import Maintenance
+from logs_view import LOGS_PAGE_SIZE, LogsPage, parse_filters, page_filters, logs_keyboard, render_logs_page
+from stats_view import render_stats
+from export import EXPORT_MAX_BYTES, parse_export_args, export_messages
+from search import SEARCH_PAGE_SIZE, SearchPage, SearchBackfill, search_keyboard, render_search_page
+from metrics import registry, timed, setup_metrics, HANDLER_LATENCY, DB_LATENCY, DEDUP_DROPPED
+
+# Настройка логирования для Render (запись через очередь в фоновом потоке)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Получаем переменные окружения
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = os.getenv("ADMIN_ID")
+# Адрес Bot API (по умолчанию api.telegram.org; для нагрузочных тестов - fake_telegram.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Хранилище: SQLite (одно подключение на весь процесс) или память - см. STORAGE_BACKEND
+db = create_repository()
+
+# Состояния FSM хранятся в той же БД и переживают перезапуск
+fsm_storage = SQLiteFSMStorage(db)
+
+# Фоновое обслуживание истории: срок хранения и incremental_vacuum
+maintenance = Maintenance(db)
+
+# Фоновая индексация старой истории для /search
+search_backfill = SearchBackfill(db)
+
+# Планировщик исходящих запросов (лимиты Telegram)
+outbound = OutboundScheduler()
 
 # Проверка обязательных переменных
 if not BOT_TOKEN:
     logger.error("❌ BOT_TOKEN не установлен!")
     # Не создаем бота, но создаем диспетчер для импорта
     bot = None
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=fsm_storage)
 else:
-    storage = MemoryStorage()
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=storage)
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        logger.info(f"🔧 Bot API: {TELEGRAM_API_URL}")
+        bot = Bot(token=BOT_TOKEN, session=session)
+    else:
+        bot = Bot(token=BOT_TOKEN)
+    outbound.setup(bot)
+    dp = Dispatcher(storage=fsm_storage)
+
+# Метрики: обновления по типам, ошибки и глубина очередей
+setup_metrics(dp)
+registry.gauge("write_queue_depth", "Строки в очереди отложенной записи", lambda: db.write_queue_depth)
+registry.gauge("outbound_queue_depth", "Запросы, ожидающие лимита Telegram", lambda: outbound.queue_depth)
+registry.gauge("outbound_wait_seconds_avg", "Среднее ожидание лимита Telegram",
+               lambda: outbound.stats()["avg_wait"])
+registry.gauge("fsm_states", "Состояния FSM",
+               lambda: fsm_storage.stats_by_location(), ("location",))
+registry.gauge("link_cache_entries", "Записи кэша ссылок", lambda: db.link_cache_entries)
+registry.gauge("albums_pending", "Альбомы, ожидающие остальных частей", lambda: albums.pending)
+registry.gauge("flood_buckets", "Бакеты антифлуда", lambda: {
+    ("sender",): len(antiflood.senders), ("pair",): len(antiflood.pairs)}, ("scope",))
+registry.gauge("dedup_entries", "Отпечатки содержимого для схлопывания повторов", lambda: len(duplicates))
 
 
 # Состояния FSM для отправки анонимных сообщений
@@ -39,75 +90,130 @@ class SendAnonMessage(StatesGroup):
     waiting_for_anything = State()
 
 
+# Антифлуд: лишние сообщения и нажатия отбрасываются до обработчиков
+antiflood = AntiFloodMiddleware(pair_state=SendAnonMessage.waiting_for_anything.state, admin_id=ADMIN_ID)
+dp.message.outer_middleware(antiflood)
+dp.callback_query.outer_middleware(antiflood)
+
+
+# Данные бота: get_me() вызывается при запуске и периодически, а не на каждое нажатие
+class BotIdentity:
+    """Кэш username бота с фоновым обновлением"""
+
+    def __init__(self, fallback_username: str = "anon_message_bot",
+                 refresh_interval: float = float(os.getenv("BOT_IDENTITY_REFRESH", 3600))):
+        self.fallback_username = fallback_username
+        self.refresh_interval = refresh_interval
+        self.info = None
+        self._task = None
+
+    @property
+    def username(self) -> str:
+        return self.info.username if self.info else self.fallback_username
+
+    async def refresh(self, bot: Bot):
+        """Запрос get_me() и обновление кэша"""
+        self.info = await bot.get_me()
+        return self.info
+
+    async def get_username(self, bot: Bot) -> str:
+        """Username бота; если при запуске не удалось его получить - пробуем еще раз"""
+        if self.info is None:
+            try:
+                await self.refresh(bot)
+            except Exception as e:
+                logger.error(f"❌ Ошибка получения информации о боте: {e}")
+        return self.username
+
+    async def _refresh_loop(self, bot: Bot):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh(bot)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось обновить информацию о боте: {e}")
+
+    def start_refresh(self, bot: Bot):
+        """Запуск фонового обновления"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+bot_identity = BotIdentity()
+
+
+# Тексты со ссылкой пользователя (кэшируются по username бота и коду ссылки)
+@lru_cache(maxsize=10000)
+def render_link_message(kind: str, bot_username: str, link_code: str) -> str:
+    """HTML сообщения со ссылкой для кнопок get_link / my_link"""
+    link_url = f"https://t.me/{bot_username}?start={link_code}"
+
+    if kind == "get_link":
+        return (
+            f"🔗 <b>Твоя анонимная ссылка:</b>\n\n"
+            f"<code>{link_url}</code>\n\n"
+            f"📢 <b>Что можно отправлять по этой ссылке:</b>\n"
+            f"• Текст 📝\n"
+            f"• Фото 📸\n"
+            f"• Видео 🎬\n"
+            f"• Голосовые 🎤\n"
+            f"• Музыку 🎵\n"
+            f"• Документы 📎\n"
+            f"• Стикеры ✨\n"
+            f"• Видео-заметки 📹\n\n"
+            f"⚠️ <b>Все сообщения будут анонимными!</b>\n\n"
+            f"🔗 <b>Скопируй и отправь друзьям:</b>\n"
+            f"<code>{link_url}</code>"
+        )
+
+    return (
+        f"🔗 <b>Твоя ссылка:</b>\n\n"
+        f"<code>{link_url}</code>\n\n"
+        f"Отправь эту ссылку друзьям, чтобы получать анонимные сообщения."
+    )
+
+
 # Функция для логирования
 def log_anon_message(sender_id: int, sender_username: str, content_type: str,
                      content_info: str, recipient_id: int, link_code: str):
-    """Логирует информацию об отправителе и сообщении"""
+    """Логирует информацию об отправителе и сообщении (одна структурированная запись)"""
     try:
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        username_display = f"@{sender_username}" if sender_username else f"ID:{sender_id}"
-
-        logger.info("=" * 50)
-        logger.info(f"📨 АНОНИМНОЕ СООБЩЕНИЕ [{timestamp}]")
-        logger.info(f"📤 ОТПРАВИТЕЛЬ: {username_display} (ID: {sender_id})")
-        logger.info(f"📥 ПОЛУЧАТЕЛЬ: ID: {recipient_id}")
-        logger.info(f"🔗 ССЫЛКА: {link_code}")
-        logger.info(f"📄 ТИП: {content_type}")
-
-        if content_type == "text":
-            logger.info(f"💬 ТЕКСТ: {content_info}")
+        event = {
+            "event": "anon_message",
+            "time": datetime.now().strftime("%H:%M:%S"),
+            "sender": f"@{sender_username}" if sender_username else f"ID:{sender_id}",
+            "sender_id": sender_id,
+            "recipient_id": recipient_id,
+            "link_code": link_code,
+            "type": content_type,
+        }
+
+        if content_type in ("text", "ТЕКСТ"):
+            event.update(sample_text(content_info))
         else:
-            logger.info(f"📁 ИНФО: {content_info}")
+            event["info"] = content_info
 
-        logger.info("=" * 50)
+        logger.info("📨 АНОНИМНОЕ СООБЩЕНИЕ", extra={"event": event})
     except Exception as e:
         logger.error(f"Ошибка при логировании: {e}")
 
 
 # Инициализация БД
-def init_db():
+async def init_db():
     """Инициализация базы данных"""
     try:
-        db_path = os.getenv("DB_PATH", "anon_bot.db")
-
-        # На Render используем абсолютный путь и создаем директорию
-        if 'RENDER' in os.environ or 'PORT' in os.environ:
-            db_path = os.path.join(os.getcwd(), db_path)
-            db_dir = os.path.dirname(db_path)
-            if db_dir and not os.path.exists(db_dir):
-                os.makedirs(db_dir, exist_ok=True)
-            logger.info(f"🗃️ Работаем на сервере, путь к БД: {db_path}")
-
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-
-        # Таблица пользователей
-        c.execute('''CREATE TABLE IF NOT EXISTS users
-                     (user_id INTEGER PRIMARY KEY,
-                      username TEXT,
-                      full_name TEXT,
-                      created_at TEXT)''')
-
-        # Таблица анонимных ссылок
-        c.execute('''CREATE TABLE IF NOT EXISTS anon_links
-                     (link_code TEXT PRIMARY KEY,
-                      user_id INTEGER,
-                      created_at TEXT,
-                      is_active INTEGER DEFAULT 1,
-                      FOREIGN KEY(user_id) REFERENCES users(user_id))''')
-
-        # Таблица сообщений (для истории)
-        c.execute('''CREATE TABLE IF NOT EXISTS messages
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      link_code TEXT,
-                      sender_id INTEGER,
-                      sender_username TEXT,
-                      content_type TEXT,
-                      content_info TEXT,
-                      timestamp TEXT)''')
-
-        conn.commit()
-        conn.close()
+        await db.init()
+        maintenance.start()
+        search_backfill.start()
         logger.info("✅ База данных инициализирована")
         return True
     except Exception as e:
@@ -115,55 +221,49 @@ def init_db():
         return False
 
 
-# Сохранение пользователя
-def save_user(user: types.User):
-    """Сохранение пользователя в БД"""
-    try:
-        db_path = os.getenv("DB_PATH", "anon_bot.db")
-        if 'RENDER' in os.environ or 'PORT' in os.environ:
-            db_path = os.path.join(os.getcwd(), db_path)
+# Долгие команды админа (выгрузка) идут отдельной задачей: обновление сразу
+# считается обработанным и не держит очередь обработки (окно polling, пул вебхука)
+admin_jobs = set()
 
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
 
-        c.execute('''INSERT OR REPLACE INTO users 
-                     (user_id, username, full_name, created_at) 
-                     VALUES (?, ?, ?, ?)''',
-                  (user.id, user.username or '', user.full_name,
-                   datetime.now().isoformat()))
+def start_admin_job(coro):
+    task = asyncio.create_task(coro)
+    admin_jobs.add(task)
+    task.add_done_callback(admin_jobs.discard)
+
+
+# Закрытие БД
+async def close_db():
+    """Запись очереди отложенной записи и закрытие БД"""
+    # Незаконченные выгрузки отменяются: админ повторит команду после перезапуска
+    for task in list(admin_jobs):
+        task.cancel()
+    if admin_jobs:
+        await asyncio.gather(*admin_jobs, return_exceptions=True)
+    try:
+        await maintenance.stop()
+        await search_backfill.stop()
+        await db.close()
+    except Exception as e:
+        logger.error(f"❌ Ошибка закрытия БД: {e}")
+
 
-        conn.commit()
-        conn.close()
+# Сохранение пользователя
+@timed(DB_LATENCY)
+async def save_user(user: types.User):
+    """Сохранение пользователя в БД"""
+    try:
+        await db.save_user(user.id, user.username, user.full_name)
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения пользователя: {e}")
 
 
 # Создание анонимной ссылки
-def create_anon_link(user_id: int) -> str:
+@timed(DB_LATENCY)
+async def create_anon_link(user_id: int) -> str:
     """Создание анонимной ссылки для пользователя"""
     try:
-        db_path = os.getenv("DB_PATH", "anon_bot.db")
-        if 'RENDER' in os.environ or 'PORT' in os.environ:
-            db_path = os.path.join(os.getcwd(), db_path)
-
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-
-        c.execute("SELECT link_code FROM anon_links WHERE user_id = ? AND is_active = 1", (user_id,))
-        existing = c.fetchone()
-
-        if existing:
-            conn.close()
-            return existing[0]
-
-        link_code = secrets.token_urlsafe(12)
-
-        c.execute("INSERT INTO anon_links (link_code, user_id, created_at) VALUES (?, ?, ?)",
-                  (link_code, user_id, datetime.now().isoformat()))
-
-        conn.commit()
-        conn.close()
-        return link_code
+        return await db.create_anon_link(user_id)
     except Exception as e:
         logger.error(f"❌ Ошибка создания ссылки: {e}")
         # Возвращаем временную ссылку в случае ошибки
@@ -171,22 +271,15 @@ def create_anon_link(user_id: int) -> str:
 
 
 # Получение владельца ссылки
-def get_link_owner(link_code: str):
+@timed(DB_LATENCY)
+async def get_link_owner(link_code: str):
     """Получение ID владельца ссылки"""
     if not link_code:
         return None
 
     try:
-        db_path = os.getenv("DB_PATH", "anon_bot.db")
-        if 'RENDER' in os.environ or 'PORT' in os.environ:
-            db_path = os.path.join(os.getcwd(), db_path)
-
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-
         # Проверяем как обычную ссылку
-        c.execute("SELECT user_id FROM anon_links WHERE link_code = ? AND is_active = 1", (link_code,))
-        result = c.fetchone()
+        result = await db.get_link_owner(link_code)
 
         # Если не нашли, проверяем как временную ссылку
         if not result and link_code.startswith("temp_"):
@@ -194,352 +287,158 @@ def get_link_owner(link_code: str):
             parts = link_code.split("_")
             if len(parts) >= 2:
                 try:
-                    user_id = int(parts[1])
-                    conn.close()
-                    return user_id
+                    return int(parts[1])
                 except ValueError:
                     pass
 
-        conn.close()
-        return result[0] if result else None
+        return result
     except Exception as e:
         logger.error(f"❌ Ошибка получения владельца ссылки: {e}")
         return None
 
 
 # Сохранение сообщения в историю
-def save_message_history(link_code: str, sender: types.User, content_type: str, content_info: str):
+@timed(DB_LATENCY)
+async def save_message_history(link_code: str, sender: types.User, content_type: str, content_info: str):
     """Сохранение сообщения в историю"""
     try:
-        db_path = os.getenv("DB_PATH", "anon_bot.db")
-        if 'RENDER' in os.environ or 'PORT' in os.environ:
-            db_path = os.path.join(os.getcwd(), db_path)
-
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-
-        c.execute('''INSERT INTO messages 
-                     (link_code, sender_id, sender_username, content_type, content_info, timestamp) 
-                     VALUES (?, ?, ?, ?, ?, ?)''',
-                  (link_code, sender.id, sender.username or '', content_type, content_info,
-                   datetime.now().isoformat()))
-
-        conn.commit()
-        conn.close()
+        await db.save_message_history(link_code, sender.id, sender.username, content_type, content_info)
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения истории: {e}")
 
 
 # Получение истории сообщений
-def get_message_history(user_id: int):
+@timed(DB_LATENCY)
+async def get_message_history(user_id: int):
     """Получение истории сообщений пользователя"""
     try:
-        db_path = os.getenv("DB_PATH", "anon_bot.db")
-        if 'RENDER' in os.environ or 'PORT' in os.environ:
-            db_path = os.path.join(os.getcwd(), db_path)
-
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-
-        c.execute("SELECT link_code FROM anon_links WHERE user_id = ? AND is_active = 1", (user_id,))
-        link_result = c.fetchone()
-
-        if not link_result:
-            conn.close()
-            return []
-
-        link_code = link_result[0]
-
-        c.execute('''SELECT sender_username, content_type, content_info, timestamp 
-                     FROM messages 
-                     WHERE link_code = ? 
-                     ORDER BY timestamp DESC LIMIT 50''', (link_code,))
-        messages = c.fetchall()
-
-        conn.close()
-        return messages
+        return await db.get_message_history(user_id)
     except Exception as e:
         logger.error(f"❌ Ошибка получения истории: {e}")
         return []
 
 
-# Обработчик текстовых сообщений
-async def handle_text_message(message: types.Message, recipient_id: int, link_code: str):
-    """Обработка текстовых сообщений"""
+# Уведомление получателя о скрытых повторах (вызывается DuplicateFilter)
+async def notify_repeats(recipient_id: int, count: int, preview: str):
+    """Одно сообщение «×N» вместо копий спама"""
     if bot is None:
-        await message.answer("❌ Бот не инициализирован")
         return
-
-    try:
-        save_message_history(link_code, message.from_user, "text", message.text)
-        log_anon_message(
-            message.from_user.id,
-            message.from_user.username,
-            "ТЕКСТ",
-            message.text[:200],
-            recipient_id,
-            link_code
-        )
-
+    with bulk_priority():
         await bot.send_message(
             recipient_id,
-            f"📨 <b>Новое анонимное сообщение!</b>\n"
-            f"🕒 <i>{datetime.now().strftime('%H:%M')}</i>\n\n"
-            f"{message.text}\n\n"
-            f"<i>💬 Ответить нельзя</i>",
-            parse_mode="HTML"
-        )
-        await message.answer("✅ Текст отправлен анонимно!")
-    except Exception as e:
-        logger.error(f"❌ Ошибка отправки текста: {e}")
-        await message.answer("❌ Не удалось отправить сообщение. Возможно, пользователь заблокировал бота.")
-
-
-# Обработчик фото
-async def handle_photo_message(message: types.Message, recipient_id: int, link_code: str):
-    """Обработка фото"""
-    if bot is None:
-        await message.answer("❌ Бот не инициализирован")
-        return
-
-    try:
-        photo_info = f"Фото ({message.photo[-1].file_size // 1024} KB)"
-        save_message_history(link_code, message.from_user, "photo", photo_info)
-        log_anon_message(
-            message.from_user.id,
-            message.from_user.username,
-            "ФОТО",
-            photo_info,
-            recipient_id,
-            link_code
-        )
-
-        caption = message.caption or "📷 Анонимное фото"
-        await bot.send_photo(
-            recipient_id,
-            photo=message.photo[-1].file_id,
-            caption=f"📸 <b>Анонимное фото!</b>\n"
-                    f"🕒 <i>{datetime.now().strftime('%H:%M')}</i>\n\n"
-                    f"{caption}\n\n"
-                    f"<i>💬 Ответить нельзя</i>",
+            f"🔁 <b>×{count}</b> - повтор уже полученного сообщения скрыт\n<i>{escape(preview)}</i>",
             parse_mode="HTML"
         )
-        await message.answer("✅ Фото отправлено анонимно!")
-    except Exception as e:
-        logger.error(f"❌ Ошибка отправки фото: {e}")
-        await message.answer("❌ Не удалось отправить фото.")
+    logger.info(f"🔁 Скрыто повторов: {count} (получатель ID: {recipient_id})")
 
 
-# Обработчик видео
-async def handle_video_message(message: types.Message, recipient_id: int, link_code: str):
-    """Обработка видео"""
-    if bot is None:
-        await message.answer("❌ Бот не инициализирован")
-        return
-
-    try:
-        video_info = f"Видео ({message.video.file_size // 1024} KB, {message.video.duration} сек)"
-        save_message_history(link_code, message.from_user, "video", video_info)
-        log_anon_message(
-            message.from_user.id,
-            message.from_user.username,
-            "ВИДЕО",
-            video_info,
-            recipient_id,
-            link_code
-        )
+# Повторы одного содержимого от одного отправителя одному получателю схлопываются
+duplicates = DuplicateFilter(notify_repeats)
 
-        caption = message.caption or "🎥 Анонимное видео"
-        await bot.send_video(
-            recipient_id,
-            video=message.video.file_id,
-            caption=f"🎬 <b>Анонимное видео!</b>\n"
-                    f"🕒 <i>{datetime.now().strftime('%H:%M')}</i>\n\n"
-                    f"{caption}\n\n"
-                    f"<i>💬 Ответить нельзя</i>",
-            parse_mode="HTML"
-        )
-        await message.answer("✅ Видео отправлено анонимно!")
-    except Exception as e:
-        logger.error(f"❌ Ошибка отправки видео: {e}")
-        await message.answer("❌ Не удалось отправить видео.")
+# Длина фрагмента содержимого в уведомлении о повторах
+REPEAT_PREVIEW_LENGTH = 60
 
 
-# Обработчик голосовых сообщений
-async def handle_voice_message(message: types.Message, recipient_id: int, link_code: str):
-    """Обработка голосовых сообщений"""
-    if bot is None:
-        await message.answer("❌ Бот не инициализирован")
-        return
+async def drop_duplicate(message: types.Message, recipient_id: int, content_type: str,
+                         content_fingerprint: str, preview: str) -> bool:
+    """True - отправитель повторяет недавнее содержимое: без записи в историю и доставки
 
-    try:
-        voice_info = f"Голосовое ({message.voice.duration} сек)"
-        save_message_history(link_code, message.from_user, "voice", voice_info)
-        log_anon_message(
-            message.from_user.id,
-            message.from_user.username,
-            "ГОЛОС",
-            voice_info,
-            recipient_id,
-            link_code
-        )
+    Отпечаток сохраняется сразу, при неудачной доставке его снимает duplicates.forget
+    """
+    if len(preview) > REPEAT_PREVIEW_LENGTH:
+        preview = preview[:REPEAT_PREVIEW_LENGTH] + "…"
+    repeats = duplicates.check(recipient_id, message.from_user.id, content_fingerprint, preview=preview)
+    if not repeats:
+        return False
 
-        await bot.send_voice(
-            recipient_id,
-            voice=message.voice.file_id,
-            caption=f"🎤 <b>Анонимное голосовое сообщение!</b>\n"
-                    f"🕒 <i>{datetime.now().strftime('%H:%M')}</i>\n"
-                    f"<i>💬 Ответить нельзя</i>",
-            parse_mode="HTML"
-        )
-        await message.answer("✅ Голосовое отправлено анонимно!")
-    except Exception as e:
-        logger.error(f"❌ Ошибка отправки голосового: {e}")
-        await message.answer("❌ Не удалось отправить голосовое сообщение.")
+    DEDUP_DROPPED.inc(content_type)
+    # Отправителю отвечаем только на первый повтор: дальше спам не стоит запросов к Bot API
+    if repeats == 1:
+        await message.answer("⚠️ Ты уже отправлял это недавно - повтор не пересылается.")
+    return True
 
 
-# Обработчик аудио (музыки)
-async def handle_audio_message(message: types.Message, recipient_id: int, link_code: str):
-    """Обработка аудио"""
+# Доставка анонимного сообщения (любой тип из delivery.CONTENT_KINDS)
+async def deliver_message(message: types.Message, kind: ContentKind, recipient_id: int, link_code: str):
+    """Сохранение в историю и доставка получателю одним запросом к Bot API"""
     if bot is None:
         await message.answer("❌ Бот не инициализирован")
         return
 
+    started = time.perf_counter()
     try:
-        audio_info = f"Аудио: {message.audio.title or 'Без названия'} - {message.audio.performer or 'Неизвестно'}"
-        save_message_history(link_code, message.from_user, "audio", audio_info)
+        content_info = kind.info(message)
+        await save_message_history(link_code, message.from_user, kind.name, content_info)
         log_anon_message(
             message.from_user.id,
             message.from_user.username,
-            "АУДИО",
-            audio_info,
+            kind.label,
+            content_info,
             recipient_id,
             link_code
         )
 
-        caption = f"🎵 <b>Анонимная музыка!</b>\n"
-        if message.audio.title:
-            caption += f"Название: {message.audio.title}\n"
-        if message.audio.performer:
-            caption += f"Исполнитель: {message.audio.performer}\n"
-        caption += f"🕒 <i>{datetime.now().strftime('%H:%M')}</i>\n\n"
-        caption += f"<i>💬 Ответить нельзя</i>"
-
-        await bot.send_audio(
-            recipient_id,
-            audio=message.audio.file_id,
-            caption=caption,
-            parse_mode="HTML"
-        )
-        await message.answer("✅ Аудио отправлено анонимно!")
+        with bulk_priority():
+            if kind.mode == DELIVER_TEXT:
+                await bot.send_message(recipient_id, **kind.delivery_kwargs(message))
+            else:
+                await bot.copy_message(recipient_id, **kind.delivery_kwargs(message))
+        await message.answer(kind.confirm)
     except Exception as e:
-        logger.error(f"❌ Ошибка отправки аудио: {e}")
-        await message.answer("❌ Не удалось отправить аудио.")
-
+        logger.error(f"❌ Ошибка отправки ({kind.name}): {e}")
+        # Не доставлено - повторная отправка того же не должна считаться дублем
+        duplicates.forget(recipient_id, message.from_user.id, fingerprint(message, kind))
+        await message.answer(kind.error)
+    finally:
+        HANDLER_LATENCY.observe(time.perf_counter() - started, kind.name)
 
-# Обработчик документов
-async def handle_document_message(message: types.Message, recipient_id: int, link_code: str):
-    """Обработка документов"""
-    if bot is None:
-        await message.answer("❌ Бот не инициализирован")
-        return
 
+# Доставка альбома целиком (вызывается AlbumCollector после сборки всех частей)
+async def deliver_album(messages: list, state: FSMContext, recipient_id: int, link_code: str):
+    """Одна пачка записей в историю и один send_media_group получателю"""
+    first = messages[0]
+    started = time.perf_counter()
+    content_fingerprint = None
     try:
-        doc_info = f"Документ: {message.document.file_name} ({message.document.file_size // 1024} KB)"
-        save_message_history(link_code, message.from_user, "document", doc_info)
-        log_anon_message(
-            message.from_user.id,
-            message.from_user.username,
-            "ДОКУМЕНТ",
-            doc_info,
-            recipient_id,
-            link_code
-        )
-
-        await bot.send_document(
-            recipient_id,
-            document=message.document.file_id,
-            caption=f"📎 <b>Анонимный документ!</b>\n"
-                    f"🕒 <i>{datetime.now().strftime('%H:%M')}</i>\n"
-                    f"Файл: {message.document.file_name}\n\n"
-                    f"<i>💬 Ответить нельзя</i>",
-            parse_mode="HTML"
-        )
-        await message.answer("✅ Документ отправлен анонимно!")
-    except Exception as e:
-        logger.error(f"❌ Ошибка отправки документа: {e}")
-        await message.answer("❌ Не удалось отправить документ.")
-
-
-# Обработчик стикеров
-async def handle_sticker_message(message: types.Message, recipient_id: int, link_code: str):
-    """Обработка стикеров"""
-    if bot is None:
-        await message.answer("❌ Бот не инициализирован")
-        return
+        items, parts = [], []
+        for message in messages:
+            kind = detect_kind(message)
+            if kind is not None:
+                items.append((kind.name, kind.info(message)))
+                parts.append(fingerprint(message, kind))
+        content_info = f"Альбом: {len(messages)} шт. ({', '.join(name for name, info in items)})"
+
+        if await drop_duplicate(first, recipient_id, "album", album_fingerprint(parts), content_info):
+            return
+        # Отпечаток записан: при ошибке доставки его нужно снять
+        content_fingerprint = album_fingerprint(parts)
 
-    try:
-        sticker_info = f"Стикер из набора"
-        save_message_history(link_code, message.from_user, "sticker", sticker_info)
+        await db.save_message_history_many(link_code, first.from_user.id, first.from_user.username, items)
         log_anon_message(
-            message.from_user.id,
-            message.from_user.username,
-            "СТИКЕР",
-            sticker_info,
+            first.from_user.id,
+            first.from_user.username,
+            "АЛЬБОМ",
+            content_info,
             recipient_id,
             link_code
         )
 
-        await bot.send_sticker(
-            recipient_id,
-            sticker=message.sticker.file_id
-        )
-        await bot.send_message(
-            recipient_id,
-            f"✨ <b>Анонимный стикер!</b>\n"
-            f"🕒 <i>{datetime.now().strftime('%H:%M')}</i>\n\n"
-            f"<i>💬 Ответить нельзя</i>",
-            parse_mode="HTML"
-        )
-        await message.answer("✅ Стикер отправлен анонимно!")
+        with bulk_priority():
+            await bot.send_media_group(recipient_id, media=album_media(messages))
+        await first.answer(f"✅ Альбом ({len(messages)} шт.) отправлен анонимно!")
     except Exception as e:
-        logger.error(f"❌ Ошибка отправки стикера: {e}")
-        await message.answer("❌ Не удалось отправить стикер.")
-
-
-# Обработчик видео-сообщений (видео-заметки)
-async def handle_video_note_message(message: types.Message, recipient_id: int, link_code: str):
-    """Обработка видео-заметок"""
-    if bot is None:
-        await message.answer("❌ Бот не инициализирован")
-        return
+        logger.error(f"❌ Ошибка отправки альбома: {e}")
+        if content_fingerprint is not None:
+            duplicates.forget(recipient_id, first.from_user.id, content_fingerprint)
+        await first.answer("❌ Не удалось отправить альбом.")
+    finally:
+        HANDLER_LATENCY.observe(time.perf_counter() - started, "album")
+        # Состояние очищается после доставки всего альбома, а не первой части
+        await state.clear()
 
-    try:
-        save_message_history(link_code, message.from_user, "video_note", "Видео-заметка")
-        log_anon_message(
-            message.from_user.id,
-            message.from_user.username,
-            "ВИДЕО-ЗАМЕТКА",
-            f"{message.video_note.duration} сек",
-            recipient_id,
-            link_code
-        )
 
-        await bot.send_video_note(
-            recipient_id,
-            video_note=message.video_note.file_id
-        )
-        await bot.send_message(
-            recipient_id,
-            f"📹 <b>Анонимная видео-заметка!</b>\n"
-            f"🕒 <i>{datetime.now().strftime('%H:%M')}</i>\n\n"
-            f"<i>💬 Ответить нельзя</i>",
-            parse_mode="HTML"
-        )
-        await message.answer("✅ Видео-заметка отправлена анонимно!")
-    except Exception as e:
-        logger.error(f"❌ Ошибка отправки видео-заметки: {e}")
-        await message.answer("❌ Не удалось отправить видео-заметку.")
+# Части альбомов собираются в одну доставку
+albums = AlbumCollector(deliver_album)
 
 
 # Команда /start
@@ -548,14 +447,14 @@ async def start_command(message: types.Message, state: FSMContext):
     await state.clear()
 
     user = message.from_user
-    save_user(user)
+    await save_user(user)
     logger.info(f"👤 Пользователь: @{user.username or 'без username'} (ID: {user.id})")
 
     parts = message.text.split()
 
     if len(parts) > 1:
         link_code = parts[1]
-        recipient_id = get_link_owner(link_code)
+        recipient_id = await get_link_owner(link_code)
 
         if recipient_id:
             if recipient_id == user.id:
@@ -631,32 +530,18 @@ async def process_any_message(message: types.Message, state: FSMContext):
         logger.error("❌ Не найдены link_code или recipient_id в состоянии FSM")
         return
 
-    try:
-        # Определяем тип сообщения и обрабатываем
-        if message.text:
-            await handle_text_message(message, recipient_id, link_code)
-
-        elif message.photo:
-            await handle_photo_message(message, recipient_id, link_code)
-
-        elif message.video:
-            await handle_video_message(message, recipient_id, link_code)
-
-        elif message.voice:
-            await handle_voice_message(message, recipient_id, link_code)
-
-        elif message.audio:
-            await handle_audio_message(message, recipient_id, link_code)
-
-        elif message.document:
-            await handle_document_message(message, recipient_id, link_code)
-
-        elif message.sticker:
-            await handle_sticker_message(message, recipient_id, link_code)
-
-        elif message.video_note:
-            await handle_video_note_message(message, recipient_id, link_code)
+    # Часть альбома: ждем остальные, состояние очистит deliver_album
+    if message.media_group_id and bot is not None:
+        albums.add(message, state=state, recipient_id=recipient_id, link_code=link_code)
+        return
 
+    try:
+        # Определяем тип сообщения по таблице и доставляем
+        kind = detect_kind(message)
+        if kind is not None:
+            if not await drop_duplicate(message, recipient_id, kind.name, fingerprint(message, kind),
+                                        kind.info(message) or ""):
+                await deliver_message(message, kind, recipient_id, link_code)
         else:
             await message.answer("❌ Этот тип сообщения пока не поддерживается.")
             logger.warning(f"⚠️ Неподдерживаемый тип сообщения от пользователя ID: {message.from_user.id}")
@@ -669,6 +554,58 @@ async def process_any_message(message: types.Message, state: FSMContext):
     await state.clear()
 
 
+# Листание /logs (регистрируется раньше общего обработчика кнопок)
+@dp.callback_query(LogsPage.filter())
+async def logs_page_callback(callback: types.CallbackQuery, callback_data: LogsPage):
+    admin_id = os.getenv("ADMIN_ID")
+    if not admin_id or str(callback.from_user.id) != admin_id.strip():
+        await callback.answer("❌ Нет доступа")
+        return
+
+    try:
+        filters = page_filters(callback_data)
+        direction = "older" if callback_data.d == "o" else "newer"
+        logs, has_more = await db.get_logs_page(filters, callback_data.i, direction, LOGS_PAGE_SIZE)
+
+        if not logs:
+            await callback.answer("📭 Дальше сообщений нет")
+            return
+
+        # Пришли с соседней страницы - в обратную сторону листать есть куда
+        has_older = has_more if direction == "older" else True
+        has_newer = has_more if direction == "newer" else True
+        await callback.message.edit_text(render_logs_page(logs, filters), parse_mode="HTML",
+                                         reply_markup=logs_keyboard(logs, filters, has_older, has_newer))
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"❌ Ошибка листания логов: {e}")
+        await callback.answer("Произошла ошибка, попробуй еще раз")
+
+
+# Листание результатов /search (только для админа)
+@dp.callback_query(SearchPage.filter())
+async def search_page_callback(callback: types.CallbackQuery, callback_data: SearchPage):
+    admin_id = os.getenv("ADMIN_ID")
+    if not admin_id or str(callback.from_user.id) != admin_id.strip():
+        await callback.answer("❌ Нет доступа")
+        return
+
+    try:
+        rows, has_more = await db.search_messages(callback_data.q, SEARCH_PAGE_SIZE, callback_data.o)
+        if not rows:
+            await callback.answer("📭 Дальше результатов нет")
+            return
+
+        progress = await db.fts_backfill_progress()
+        await callback.message.edit_text(render_search_page(rows, callback_data.q, callback_data.o, progress),
+                                         parse_mode="HTML",
+                                         reply_markup=search_keyboard(callback_data.q, callback_data.o, has_more))
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"❌ Ошибка листания поиска: {e}")
+        await callback.answer("Произошла ошибка, попробуй еще раз")
+
+
 # Обработка кнопок
 @dp.callback_query()
 async def handle_callbacks(callback: types.CallbackQuery, state: FSMContext):
@@ -676,62 +613,37 @@ async def handle_callbacks(callback: types.CallbackQuery, state: FSMContext):
 
     try:
         if callback.data == "get_link":
-            link_code = create_anon_link(user_id)
-            try:
-                bot_info = await bot.get_me()
-                username = bot_info.username
-            except Exception as e:
-                logger.error(f"❌ Ошибка получения информации о боте: {e}")
-                username = "anon_message_bot"
-
-            link_url = f"https://t.me/{username}?start={link_code}"
+            link_code = await create_anon_link(user_id)
+            username = await bot_identity.get_username(callback.bot)
 
             logger.info(f"🔗 Пользователь ID: {user_id} получил ссылку: {link_code}")
 
             # УБИРАЕМ КНОПКУ "МОИ СООБЩЕНИЯ" и "НОВАЯ ССЫЛКА"
             await callback.message.edit_text(
-                f"🔗 <b>Твоя анонимная ссылка:</b>\n\n"
-                f"<code>{link_url}</code>\n\n"
-                f"📢 <b>Что можно отправлять по этой ссылке:</b>\n"
-                f"• Текст 📝\n"
-                f"• Фото 📸\n"
-                f"• Видео 🎬\n"
-                f"• Голосовые 🎤\n"
-                f"• Музыку 🎵\n"
-                f"• Документы 📎\n"
-                f"• Стикеры ✨\n"
-                f"• Видео-заметки 📹\n\n"
-                f"⚠️ <b>Все сообщения будут анонимными!</b>\n\n"
-                f"🔗 <b>Скопируй и отправь друзьям:</b>\n"
-                f"<code>{link_url}</code>",
+                render_link_message("get_link", username, link_code),
                 parse_mode="HTML"
                 # УБИРАЕМ ВСЕ КНОПКИ
             )
             await callback.answer()
 
         elif callback.data == "my_link":
-            link_code = create_anon_link(user_id)
-            try:
-                bot_info = await bot.get_me()
-                username = bot_info.username
-            except Exception as e:
-                logger.error(f"❌ Ошибка получения информации о боте: {e}")
-                username = "anon_message_bot"
-
-            link_url = f"https://t.me/{username}?start={link_code}"
+            link_code = await create_anon_link(user_id)
+            username = await bot_identity.get_username(callback.bot)
 
             logger.info(f"🔗 Пользователь ID: {user_id} запросил свою ссылку: {link_code}")
 
             # УБИРАЕМ КНОПКУ "МОИ СООБЩЕНИЯ"
             await callback.message.edit_text(
-                f"🔗 <b>Твоя ссылка:</b>\n\n"
-                f"<code>{link_url}</code>\n\n"
-                f"Отправь эту ссылку друзьям, чтобы получать анонимные сообщения.",
+                render_link_message("my_link", username, link_code),
                 parse_mode="HTML"
                 # УБИРАЕМ ВСЕ КНОПКИ
             )
             await callback.answer()
 
+        elif callback.data == HEADER_CALLBACK:
+            # Кнопка-заголовок под анонимным стикером или видео-заметкой
+            await callback.answer("💬 Ответить нельзя")
+
         # УДАЛЯЕМ ВСЕ ОСТАЛЬНЫЕ ОБРАБОТЧИКИ КНОПОК:
         # - "new_link"
         # - "check_messages"
@@ -742,80 +654,139 @@ async def handle_callbacks(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("Произошла ошибка, попробуй еще раз")
 
 
-# Команда для админа - просмотр всех логов
-@dp.message(Command("logs"))
-async def show_logs(message: types.Message):
+async def check_admin(message: types.Message, command_name: str) -> bool:
+    """Проверка, что команду вызвал админ из ADMIN_ID (с ответом пользователю, если нет)"""
     user_id = message.from_user.id
     ADMIN_ID = os.getenv("ADMIN_ID")
 
     if not ADMIN_ID or not ADMIN_ID.strip():
         await message.answer("❌ ADMIN_ID не настроен в переменных окружения.")
         logger.warning("⚠️ ADMIN_ID не настроен")
-        return
+        return False
 
     try:
         admin_id_int = int(ADMIN_ID)
     except ValueError:
         await message.answer("❌ ADMIN_ID должен быть числом.")
         logger.warning(f"⚠️ Неверный формат ADMIN_ID: {ADMIN_ID}")
-        return
+        return False
 
     if user_id != admin_id_int:
         await message.answer("❌ У тебя нет доступа к этой команде.")
-        logger.warning(f"⚠️ Пользователь ID: {user_id} попытался получить доступ к /logs")
-        return
+        logger.warning(f"⚠️ Пользователь ID: {user_id} попытался получить доступ к /{command_name}")
+        return False
 
-    logger.info(f"👑 Админ ID: {user_id} запросил логи")
+    return True
 
-    db_path = os.getenv("DB_PATH", "anon_bot.db")
-    if 'RENDER' in os.environ or 'PORT' in os.environ:
-        db_path = os.path.join(os.getcwd(), db_path)
 
-    conn = None
+# Команда для админа - просмотр всех логов
+@dp.message(Command("logs"))
+async def show_logs(message: types.Message, command: CommandObject):
+    user_id = message.from_user.id
+    if not await check_admin(message, "logs"):
+        return
+
     try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
+        filters = parse_filters(command.args)
+    except ValueError as e:
+        await message.answer(f"❌ Неизвестный фильтр: {e}\n"
+                             f"Пример: /logs type=photo sender=123456 link=код_ссылки")
+        return
 
-        c.execute('''SELECT sender_username, sender_id, content_type, content_info, link_code, timestamp 
-                     FROM messages 
-                     ORDER BY timestamp DESC LIMIT 20''')
-        logs = c.fetchall()
+    logger.info(f"👑 Админ ID: {user_id} запросил логи {filters or ''}")
+
+    try:
+        logs, has_older = await db.get_logs_page(filters, limit=LOGS_PAGE_SIZE)
 
         if not logs:
             await message.answer("📭 Логов пока нет.")
             return
 
-        response = "📋 <b>Последние анонимные сообщения:</b>\n\n"
+        await message.answer(render_logs_page(logs, filters), parse_mode="HTML",
+                             reply_markup=logs_keyboard(logs, filters, has_older, has_newer=False))
+        logger.info(f"📊 Админу отправлено {len(logs)} логов")
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения логов: {e}")
+        await message.answer(f"❌ Ошибка получения логов: {str(e)}")
 
-        for username, sender_id, content_type, content_info, link_code, timestamp in logs:
-            try:
-                time = datetime.fromisoformat(timestamp).strftime("%H:%M:%S")
-            except:
-                time = timestamp
 
-            username_display = f"@{username}" if username else f"ID:{sender_id}"
+# Команда для админа - статистика по сводным таблицам
+@dp.message(Command("stats"))
+async def show_stats(message: types.Message):
+    if not await check_admin(message, "stats"):
+        return
+
+    try:
+        stats = await db.get_stats()
+        await message.answer(render_stats(stats), parse_mode="HTML")
+        logger.info(f"👑 Админ ID: {message.from_user.id} запросил статистику")
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статистики: {e}")
+        await message.answer(f"❌ Ошибка получения статистики: {str(e)}")
 
-            response += f"🕒 <b>{time}</b>\n"
-            response += f"👤 <b>{username_display}</b>\n"
-            response += f"📁 <b>{content_type.upper()}</b>\n"
 
-            if content_type == "text":
-                response += f"💬 {content_info[:50]}"
-                if len(content_info) > 50:
-                    response += "..."
-            else:
-                response += f"📄 {content_info}"
+# Команда для админа - полнотекстовый поиск по истории
+@dp.message(Command("search"))
+async def search_history(message: types.Message, command: CommandObject):
+    if not await check_admin(message, "search"):
+        return
 
-            response += f"\n🔗 {link_code[:8]}...\n"
-            response += "─" * 30 + "\n\n"
+    query = (command.args or "").strip()
+    try:
+        search_terms(query)
+    except ValueError:
+        await message.answer("🔎 Пример: /search привет или /search прив* (по началу слова)")
+        return
 
-        response += f"📊 Всего сообщений в БД: {len(logs)} показано"
+    logger.info(f"👑 Админ ID: {message.from_user.id} ищет: {query}")
 
-        await message.answer(response, parse_mode="HTML")
-        logger.info(f"📊 Админу отправлено {len(logs)} логов")
+    try:
+        rows, has_more = await db.search_messages(query, SEARCH_PAGE_SIZE, 0)
+        progress = await db.fts_backfill_progress()
+        await message.answer(render_search_page(rows, query, 0, progress), parse_mode="HTML",
+                             reply_markup=search_keyboard(query, 0, has_more))
     except Exception as e:
-        logger.error(f"❌ Ошибка получения логов: {e}")
-        await message.answer(f"❌ Ошибка получения логов: {str(e)}")
+        logger.error(f"❌ Ошибка поиска: {e}")
+        await message.answer(f"❌ Ошибка поиска: {str(e)}")
+
+
+# Команда для админа - выгрузка истории файлом
+@dp.message(Command("export"))
+async def export_history(message: types.Message, command: CommandObject):
+    if not await check_admin(message, "export"):
+        return
+
+    try:
+        fmt, filters, since, until = parse_export_args(command.args)
+    except ValueError as e:
+        await message.answer(f"❌ Неверный аргумент: {e}\n"
+                             f"Пример: /export csv from=2026-01-01 to=2026-01-31 link=код_ссылки")
+        return
+
+    logger.info(f"👑 Админ ID: {message.from_user.id} запросил выгрузку {fmt} {command.args or ''}")
+    await message.answer("⏳ Готовлю выгрузку...")
+    start_admin_job(send_export(message, fmt, filters, since, until))
+
+
+async def send_export(message: types.Message, fmt: str, filters: dict, since: str, until: str):
+    """Выгрузка и отправка файла админу (отдельной задачей, см. admin_jobs)"""
+    path = None
+    try:
+        started = time.perf_counter()
+        path, filename, count = await export_messages(db, fmt, filters, since, until)
+        size = os.path.getsize(path)
+        if size > EXPORT_MAX_BYTES:
+            await message.answer(f"❌ Файл выгрузки слишком большой ({size // 1024 // 1024} MB). "
+                                 f"Сузь период через from= и to=")
+            return
+
+        await message.answer_document(FSInputFile(path, filename=filename),
+                                      caption=f"📦 Сообщений: {count}, {size // 1024} KB")
+        logger.info(f"📦 Выгрузка: {count} сообщений, {size // 1024} KB "
+                    f"({time.perf_counter() - started:.2f} сек)")
+    except Exception as e:
+        logger.error(f"❌ Ошибка выгрузки: {e}")
+        await message.answer(f"❌ Ошибка выгрузки: {str(e)}")
     finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        if path:
+            os.remove(path)
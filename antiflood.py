@@ -0,0 +1,157 @@
+"""
+Антифлуд для входящих обновлений
+Outer-middleware на dp.message и dp.callback_query: бакет токенов на
+отправителя и на пару (отправитель, получатель). Лишние обновления
+отбрасываются до фильтров и обработчиков - без записи в БД, логов
+и запросов к Telegram. Отправитель получает одно предупреждение за эпизод
+"""
+
+import os
+import math
+import time
+import logging
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+from cache import TTLCache, MISSING
+from metrics import FLOOD_THROTTLED
+from outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Скорость (в секунду) и запас бакетов; 0 - без ограничения
+FLOOD_SENDER_RATE = float(os.getenv("FLOOD_SENDER_RATE", 1))
+FLOOD_SENDER_BURST = float(os.getenv("FLOOD_SENDER_BURST", 15))
+FLOOD_PAIR_RATE = float(os.getenv("FLOOD_PAIR_RATE", 0.5))
+FLOOD_PAIR_BURST = float(os.getenv("FLOOD_PAIR_BURST", 10))
+# Предел числа бакетов и период удаления простаивающих (полных) бакетов
+FLOOD_MAX_BUCKETS = int(os.getenv("FLOOD_MAX_BUCKETS", 100000))
+FLOOD_SWEEP_INTERVAL = float(os.getenv("FLOOD_SWEEP_INTERVAL", 60))
+# Не чаще одного предупреждения отправителю за этот интервал
+FLOOD_NOTICE_INTERVAL = float(os.getenv("FLOOD_NOTICE_INTERVAL", 30))
+
+
+class FloodLimiter:
+    """Бакеты токенов по ключу; простаивающие удаляются, число бакетов ограничено (LRU)"""
+
+    def __init__(self, rate: float, burst: float, max_buckets: int = FLOOD_MAX_BUCKETS):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+
+        # Метрики
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def check(self, key, now: float) -> float:
+        """0 - обновление разрешено (токен списан), иначе сколько секунд ждать"""
+        if self.rate <= 0:
+            return 0.0
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._buckets.move_to_end(key)
+
+        delay = bucket.delay(now)
+        if delay == 0:
+            bucket.take(now)
+        return delay
+
+    def sweep(self, now: float) -> int:
+        """Удаление бакетов, которые успели заполниться (ключ снова как новый)"""
+        idle = [key for key, bucket in self._buckets.items() if bucket.is_idle(now)]
+        for key in idle:
+            del self._buckets[key]
+        return len(idle)
+
+
+class AntiFloodMiddleware(BaseMiddleware):
+    """Ограничение частоты сообщений и нажатий от одного пользователя
+
+    pair_state - состояние FSM, в котором сообщение уходит получателю:
+    в нем дополнительно проверяется бакет пары (отправитель, recipient_id)
+    """
+
+    def __init__(self, pair_state: str = None, admin_id: str = None,
+                 senders: FloodLimiter = None, pairs: FloodLimiter = None,
+                 sweep_interval: float = FLOOD_SWEEP_INTERVAL):
+        self.pair_state = pair_state
+        self.admin_id = admin_id
+        self.senders = senders or FloodLimiter(FLOOD_SENDER_RATE, FLOOD_SENDER_BURST)
+        self.pairs = pairs or FloodLimiter(FLOOD_PAIR_RATE, FLOOD_PAIR_BURST)
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+        # Альбом - одно действие: токен списывает только первая часть
+        self._albums = TTLCache(FLOOD_MAX_BUCKETS, ttl=60)
+        self._notified = TTLCache(FLOOD_MAX_BUCKETS, ttl=FLOOD_NOTICE_INTERVAL)
+
+    def _sweep(self, now: float):
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            self.senders.sweep(now)
+            self.pairs.sweep(now)
+
+    async def _recipient(self, event, data):
+        if self.pair_state is None or not isinstance(event, Message) or data.get("raw_state") != self.pair_state:
+            return None
+        state = data.get("state")
+        return (await state.get_data()).get("recipient_id") if state is not None else None
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or (self.admin_id and str(user.id) == self.admin_id.strip()):
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._sweep(now)
+
+        album_key = None
+        if isinstance(event, Message) and event.media_group_id:
+            album_key = (user.id, event.media_group_id)
+            if self._albums.get(album_key) is not MISSING:
+                return await handler(event, data)
+
+        delay = self.senders.check(user.id, now)
+        scope = "sender"
+        if delay == 0:
+            recipient_id = await self._recipient(event, data)
+            if recipient_id is not None:
+                delay = self.pairs.check((user.id, recipient_id), now)
+                scope = "pair"
+
+        if delay > 0:
+            FLOOD_THROTTLED.inc(scope)
+            await self._notify(event, user.id, delay)
+            return None
+
+        if album_key is not None:
+            self._albums.set(album_key, True)
+        return await handler(event, data)
+
+    async def _notify(self, event, user_id: int, delay: float):
+        """Одно предупреждение за FLOOD_NOTICE_INTERVAL, остальные отбрасываются молча"""
+        if self._notified.get(user_id) is not MISSING:
+            return
+        self._notified.set(user_id, True)
+        logger.warning(f"🚫 Антифлуд: пользователь ID: {user_id} превысил лимит")
+
+        text = f"⏳ Слишком много сообщений. Подожди {math.ceil(delay)} сек."
+        try:
+            # Message.answer - сообщение в чат, CallbackQuery.answer - всплывающее уведомление
+            await event.answer(text)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось отправить предупреждение антифлуда: {e}")
+
+    def stats(self) -> dict:
+        return {"sender_buckets": len(self.senders), "pair_buckets": len(self.pairs),
+                "evicted": self.senders.evicted + self.pairs.evicted}
@@ -0,0 +1,130 @@
+"""
+Общие части бенчмарков: фабрика синтетических обновлений и сессия-заглушка
+"""
+
+import random
+import asyncio
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe
+from aiogram.types import (
+    Update, Message, Chat, User, CallbackQuery, MessageId,
+    PhotoSize, Video, Voice, Document, Sticker, VideoNote,
+)
+
+BOT_ID = 123456
+CONTENT_KINDS = ("text", "photo", "video", "voice", "document", "sticker", "video_note")
+
+
+class MockSession(BaseSession):
+    """Сессия-заглушка: отвечает на любой метод без сети и считает вызовы"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = {}
+        self.calls_by_chat = {}
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            self.calls_by_chat[chat_id] = self.calls_by_chat.get(chat_id, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if isinstance(method, GetMe):
+            return User(id=BOT_ID, is_bot=True, first_name="Bench", username="bench_bot")
+
+        returning = str(method.__returning__)
+        chat = Chat(id=chat_id if isinstance(chat_id, int) else 1, type="private")
+        message = Message(message_id=1, date=datetime.now(), chat=chat)
+        if "MessageId" in returning:
+            return MessageId(message_id=1)
+        if "List" in returning:
+            return [message]
+        if "Message" in returning:
+            return message
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):  # pragma: no cover
+        yield b""
+
+
+class UpdateFactory:
+    """Построение реалистичных объектов Update"""
+
+    def __init__(self):
+        self.update_id = 0
+
+    def _next(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    def message(self, user_id: int, **content) -> Update:
+        update_id = self._next()
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="Sender", username=f"sender{user_id}"),
+            **content,
+        ))
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = self._next()
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id),
+            from_user=User(id=user_id, is_bot=False, first_name="Owner"),
+            chat_instance="bench",
+            data=data,
+            message=Message(message_id=update_id, date=datetime.now(),
+                            chat=Chat(id=user_id, type="private"), text="menu"),
+        ))
+
+    def content(self, user_id: int, kind: str) -> Update:
+        file_id = f"{kind}-{random.randrange(10 ** 6)}"
+        unique = f"u{file_id}"
+        if kind == "text":
+            # Номер делает текст уникальным: одинаковые тексты схлопывает dedup.py
+            return self.message(user_id, text=f"{file_id} " + "Привет! " * random.randint(1, 20))
+        if kind == "photo":
+            return self.message(user_id, caption="фото", photo=[
+                PhotoSize(file_id=file_id, file_unique_id=unique, width=1280, height=960, file_size=180_000)])
+        if kind == "video":
+            return self.message(user_id, video=Video(file_id=file_id, file_unique_id=unique, width=640,
+                                                     height=480, duration=12, file_size=2_400_000))
+        if kind == "voice":
+            return self.message(user_id, voice=Voice(file_id=file_id, file_unique_id=unique, duration=7))
+        if kind == "document":
+            return self.message(user_id, document=Document(file_id=file_id, file_unique_id=unique,
+                                                           file_name="report.pdf", file_size=350_000))
+        if kind == "sticker":
+            return self.message(user_id, sticker=Sticker(file_id=file_id, file_unique_id=unique, type="regular",
+                                                         width=512, height=512, is_animated=False,
+                                                         is_video=False))
+        if kind == "video_note":
+            return self.message(user_id, video_note=VideoNote(file_id=file_id, file_unique_id=unique,
+                                                              length=240, duration=9))
+        raise ValueError(kind)
+
+
+def parse_mix(mix: str) -> dict:
+    """Доли типов содержимого: "text=70,photo=30" -> {"text": 70.0, "photo": 30.0}"""
+    weights = {}
+    for part in mix.split(","):
+        kind, weight = part.split("=")
+        weights[kind.strip()] = float(weight)
+    return weights
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк пропускной способности бота
+Синтетические обновления (/start по ссылке, текст, фото, видео, голосовые,
+документы, стикеры, видео-заметки, нажатия кнопок) подаются в anon_bot.dp
+через feed_update. Сеть не используется: сессия бота подменена заглушкой,
+БД - временный файл SQLite или хранилище в памяти (--backend memory)
+
+Запуск: python bench_dispatcher.py --senders 500 --concurrency 1,8,32
+        python bench_dispatcher.py --backend memory
+        python bench_dispatcher.py --mix text=70,photo=20,callback=10 --baseline bench_results/old.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "text=40,photo=15,video=5,voice=10,document=5,sticker=10,video_note=5,callback=10"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк диспетчера на синтетических обновлениях")
+    parser.add_argument("--senders", type=int, default=300, help="отправителей (сценариев) на прогон")
+    parser.add_argument("--concurrency", default="1,8,32", help="уровни параллельности через запятую")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="доли типов содержимого")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, сек")
+    parser.add_argument("--with-limits", action="store_true", help="не отключать лимиты исходящих запросов и антифлуд")
+    parser.add_argument("--backend", default="sqlite", choices=("sqlite", "memory"), help="хранилище (STORAGE_BACKEND)")
+    parser.add_argument("--output", default=None, help="файл для результатов (JSON)")
+    parser.add_argument("--baseline", default=None, help="предыдущие результаты для сравнения")
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# Окружение задается до импорта бота
+_tmp = tempfile.mkdtemp(prefix="anon_bot_bench_")
+os.environ["BOT_TOKEN"] = "123456:BENCHMARKBENCHMARKBENCHMARKBENCHMAR"
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+os.environ["STORAGE_BACKEND"] = args.backend
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+if not args.with_limits:
+    for name in ("OUTBOUND_GLOBAL_RATE", "OUTBOUND_CHAT_RATE", "OUTBOUND_CHAT_BURST",
+                 "FLOOD_SENDER_RATE", "FLOOD_SENDER_BURST", "FLOOD_PAIR_RATE", "FLOOD_PAIR_BURST"):
+        os.environ[name] = "1000000"
+
+from aiogram import Bot
+from aiogram.types import Update
+
+import anon_bot
+from bench_common import MockSession, UpdateFactory, parse_mix, percentile
+from metrics import DB_LATENCY
+from workers import KeyedWorkerPool
+
+
+async def run_level(bot: Bot, session: MockSession, factory: UpdateFactory, link_codes: list,
+                    owners: list, mix: dict, senders: int, concurrency: int) -> dict:
+    """Один прогон: senders сценариев при заданной параллельности"""
+    kinds = random.choices(list(mix), weights=list(mix.values()), k=senders)
+    latencies = []
+    deliveries = 0
+
+    async def feed(update: Update):
+        started = time.perf_counter()
+        await anon_bot.dp.feed_update(bot, update)
+        latencies.append(time.perf_counter() - started)
+
+    pool = KeyedWorkerPool(concurrency=concurrency, max_pending=10 ** 9)
+    session.calls.clear()
+    session.calls_by_chat.clear()
+    db_before = DB_LATENCY.total()[0]
+    started = time.perf_counter()
+
+    for index, kind in enumerate(kinds):
+        if kind == "callback":
+            # Кнопки нажимают другие пользователи, чтобы не смешивать их с доставкой владельцам ссылок
+            user_id = random.choice(owners) + 10 ** 5
+            pool.submit(user_id, lambda u=factory.callback(user_id, random.choice(["get_link", "my_link"])): feed(u))
+            continue
+
+        # Сценарий отправителя: переход по ссылке, затем сообщение (строго по порядку)
+        sender_id = 10 ** 6 + index
+        link_code = random.choice(link_codes)
+        pool.submit(sender_id, lambda u=factory.message(sender_id, text=f"/start {link_code}"): feed(u))
+        pool.submit(sender_id, lambda u=factory.content(sender_id, kind): feed(u))
+        deliveries += 1
+
+    await pool.drain()
+    await anon_bot.db.flush()
+    elapsed = time.perf_counter() - started
+    db_time = DB_LATENCY.total()[0] - db_before
+    api_calls = sum(session.calls.values())
+
+    return {
+        "concurrency": concurrency,
+        "updates": len(latencies),
+        "seconds": elapsed,
+        "updates_per_sec": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "db_time_share": db_time / sum(latencies) if latencies else 0.0,
+        "api_calls": api_calls,
+        "api_calls_per_delivery": (sum(n for name, n in session.calls.items() if name != "AnswerCallbackQuery")
+                                   / deliveries) if deliveries else 0.0,
+        # Запросы в чаты получателей (доставка) на одно анонимное сообщение
+        "recipient_calls_per_delivery": (sum(session.calls_by_chat.get(owner, 0) for owner in owners)
+                                         / deliveries) if deliveries else 0.0,
+        "api_calls_by_method": dict(session.calls),
+        "failed": pool.failed,
+    }
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {row["concurrency"]: row for row in json.load(f)["results"]}
+
+    print("\nСравнение с", baseline_path)
+    for row in results:
+        old = baseline.get(row["concurrency"])
+        if old is None:
+            continue
+        change = (row["updates_per_sec"] / old["updates_per_sec"] - 1) * 100
+        print(f"  c={row['concurrency']:<4} {old['updates_per_sec']:>9.0f} -> {row['updates_per_sec']:>9.0f} "
+              f"обн/сек ({change:+.1f}%), p99 {old['p99_ms']:.2f} -> {row['p99_ms']:.2f} мс")
+
+
+async def main():
+    mix = parse_mix(args.mix)
+    session = MockSession(latency=args.api_latency)
+    bot = Bot(os.environ["BOT_TOKEN"], session=session)
+    anon_bot.outbound.setup(bot)
+    anon_bot.bot = bot
+
+    await anon_bot.init_db()
+    await anon_bot.bot_identity.refresh(bot)
+
+    # Владельцы ссылок
+    owners = list(range(1, 51))
+    link_codes = [await anon_bot.create_anon_link(owner) for owner in owners]
+    factory = UpdateFactory()
+
+    results = []
+    print(f"{'c':>4} {'обн/сек':>10} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'доля БД':>8} {'API/сообщ':>10} {'получателю':>10}")
+    for concurrency in (int(level) for level in args.concurrency.split(",")):
+        row = await run_level(bot, session, factory, link_codes, owners, mix, args.senders, concurrency)
+        results.append(row)
+        print(f"{concurrency:>4} {row['updates_per_sec']:>10.0f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {row['db_time_share']:>8.1%} {row['api_calls_per_delivery']:>10.2f} "
+              f"{row['recipient_calls_per_delivery']:>10.2f}")
+
+    await anon_bot.outbound.stop()
+    await anon_bot.fsm_storage.close()
+    await anon_bot.close_db()
+
+    output = args.output or os.path.join("bench_results", f"dispatcher-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"created_at": datetime.now().isoformat(), "mix": mix, "senders": args.senders,
+                   "backend": args.backend, "api_latency": args.api_latency, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
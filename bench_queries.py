@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк запросов на синтетической БД до и после индексов (миграции 2 и 4)
+Запросы те же, что выполняют create_anon_link, get_message_history и /logs
+(первая страница, листание по ключу (timestamp, id) с фильтрами и OFFSET для сравнения)
+
+Запуск: python bench_queries.py --rows 2000000 --links 50000
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from storage import Storage
+
+SENDERS = 100_000
+CONTENT_TYPES = ["text", "photo", "video", "voice", "audio", "document", "sticker", "video_note"]
+
+QUERIES = {
+    "create_anon_link": ("SELECT link_code FROM anon_links WHERE user_id = ? AND is_active = 1", "user"),
+    "get_message_history": ('''SELECT sender_username, content_type, content_info, timestamp
+                               FROM messages
+                               WHERE link_code = ?
+                               ORDER BY timestamp DESC LIMIT 50''', "link"),
+    "/logs": ('''SELECT sender_username, sender_id, content_type, content_info, link_code, timestamp
+                 FROM messages
+                 ORDER BY timestamp DESC LIMIT 20''', None),
+    "/logs старее (keyset)": ('''SELECT id, sender_username, sender_id, content_type, content_info, link_code, timestamp
+                               FROM messages
+                               WHERE (timestamp, id) < (?, ?)
+                               ORDER BY timestamp DESC, id DESC LIMIT 21''', "cursor"),
+    "/logs type=... (keyset)": ('''SELECT id, sender_username, sender_id, content_type, content_info, link_code, timestamp
+                                 FROM messages
+                                 WHERE content_type = ? AND (timestamp, id) < (?, ?)
+                                 ORDER BY timestamp DESC, id DESC LIMIT 21''', "type_cursor"),
+    "/logs sender=... (keyset)": ('''SELECT id, sender_username, sender_id, content_type, content_info, link_code, timestamp
+                                   FROM messages
+                                   WHERE sender_id = ? AND (timestamp, id) < (?, ?)
+                                   ORDER BY timestamp DESC, id DESC LIMIT 21''', "sender_cursor"),
+    "/logs OFFSET (для сравнения)": ('''SELECT sender_username, sender_id, content_type, content_info, link_code, timestamp
+                                      FROM messages
+                                      ORDER BY timestamp DESC LIMIT 20 OFFSET ?''', "offset"),
+}
+
+
+# Заполнение БД: ссылки и сообщения со случайным распределением по ссылкам
+def populate(db_path: str, rows: int, links: int):
+    conn = sqlite3.connect(db_path)
+    started = datetime.now() - timedelta(days=365)
+
+    conn.executemany("INSERT INTO anon_links (link_code, user_id, created_at) VALUES (?, ?, ?)",
+                     ((f"link{i:08d}", i, started.isoformat()) for i in range(links)))
+
+    def messages():
+        for i in range(rows):
+            yield (f"link{random.randrange(links):08d}", random.randrange(SENDERS), "user",
+                   random.choice(CONTENT_TYPES), "синтетическое сообщение",
+                   (started + timedelta(seconds=i * 31536000 / rows)).isoformat())
+
+    conn.executemany('''INSERT INTO messages
+                        (link_code, sender_id, sender_username, content_type, content_info, timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?)''', messages())
+    conn.commit()
+    conn.close()
+
+
+def query_args(conn, param: str, rows: int, links: int) -> tuple:
+    """Случайные параметры запроса (подбираются вне замера времени)"""
+    if param == "user":
+        return (random.randrange(links),)
+    if param == "link":
+        return (f"link{random.randrange(links):08d}",)
+    if param == "offset":
+        return (random.randrange(rows // 2),)
+    if param and param.endswith("cursor"):
+        cursor = conn.execute("SELECT timestamp, id FROM messages WHERE id = ?",
+                              (random.randrange(1, rows + 1),)).fetchone()
+        if param == "type_cursor":
+            return (random.choice(CONTENT_TYPES), *cursor)
+        if param == "sender_cursor":
+            return (random.randrange(SENDERS), *cursor)
+        return tuple(cursor)
+    return ()
+
+
+def measure(db_path: str, rows: int, links: int, repeat: int) -> dict:
+    conn = sqlite3.connect(db_path)
+    results = {}
+
+    for name, (sql, param) in QUERIES.items():
+        plan = " | ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}",
+                                                            (0,) * sql.count("?")))
+        arguments = [query_args(conn, param, rows, links) for _ in range(repeat)]
+        started = time.perf_counter()
+        for args in arguments:
+            conn.execute(sql, args).fetchall()
+        results[name] = ((time.perf_counter() - started) / repeat * 1000, plan)
+
+    conn.close()
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов к истории")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--links", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+
+        # Схема без индексов
+        storage = Storage(db_path)
+        await storage.migrate(target=1)
+        await storage.close()
+
+        started = time.perf_counter()
+        populate(db_path, args.rows, args.links)
+        print(f"БД заполнена: {args.rows} сообщений, {args.links} ссылок "
+              f"({time.perf_counter() - started:.1f} сек)\n")
+
+        before = measure(db_path, args.rows, args.links, args.repeat)
+
+        storage = Storage(db_path)
+        started = time.perf_counter()
+        version = await storage.migrate()
+        await storage.close()
+        print(f"Миграции до версии {version}: {time.perf_counter() - started:.1f} сек\n")
+
+        after = measure(db_path, args.rows, args.links, args.repeat)
+
+    for name in QUERIES:
+        before_ms, before_plan = before[name]
+        after_ms, after_plan = after[name]
+        print(f"{name}")
+        print(f"  до:    {before_ms:>10.3f} мс  ({before_plan})")
+        print(f"  после: {after_ms:>10.3f} мс  ({after_plan})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
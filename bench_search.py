@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк полнотекстового поиска (/search) на синтетической истории
+БД заполняется до миграции 6, затем замеряется фоновая индексация
+(SearchBackfill) и время запросов для редких, частых слов и префиксов
+
+Запуск: python bench_search.py --rows 1000000
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import itertools
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from storage import Storage
+from search import SearchBackfill
+
+VOCABULARY = 50_000
+
+
+def populate(db_path: str, rows: int):
+    """Тексты из словаря с распределением Ципфа: несколько слов встречаются почти везде"""
+    conn = sqlite3.connect(db_path)
+    started = datetime.now() - timedelta(days=365)
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, VOCABULARY + 1)))
+    vocabulary = [f"слово{word}" for word in range(VOCABULARY)]
+
+    def messages():
+        for i in range(rows):
+            words = random.choices(vocabulary, cum_weights=cum_weights, k=random.randint(3, 15))
+            yield (f"link{i % 1000:08d}", i % 100_000, "user", "text",
+                   " ".join(words),
+                   (started + timedelta(seconds=i * 31536000 / rows)).isoformat())
+
+    conn.executemany('''INSERT INTO messages
+                        (link_code, sender_id, sender_username, content_type, content_info, timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?)''', messages())
+    conn.commit()
+    conn.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк полнотекстового поиска")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        storage = Storage(db_path)
+        await storage.migrate(target=5)
+        await storage.close()
+
+        started = time.perf_counter()
+        populate(db_path, args.rows)
+        print(f"БД заполнена: {args.rows} сообщений ({time.perf_counter() - started:.1f} сек)")
+
+        storage = Storage(db_path)
+        await storage.init()
+        backfill = SearchBackfill(storage, pause=0)
+        started = time.perf_counter()
+        await backfill.run()
+        elapsed = time.perf_counter() - started
+        print(f"Индексация: {backfill.indexed} сообщений за {elapsed:.1f} сек "
+              f"({backfill.indexed / elapsed:.0f} строк/сек)\n")
+
+        queries = {
+            "частое слово": "слово0",
+            "два частых слова": "слово0 слово1",
+            "среднее слово": "слово500",
+            "редкое слово": "слово40000",
+            "префикс": "слово12*",
+        }
+        for name, text in queries.items():
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                rows, _ = await storage.search_messages(text, 10, 0)
+            ms = (time.perf_counter() - started) / args.repeat * 1000
+            print(f"{name:<18} {text:<16} {ms:>8.2f} мс  (найдено на странице: {len(rows)})")
+
+        await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
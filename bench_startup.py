@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Время холодного запуска webhook.py (как после сна сервиса на бесплатном плане Render)
+Каждый прогон запускает отдельный процесс с новой БД против заглушки Bot API
+с задержкой --api-latency и замеряет снаружи:
+
+- listen - первый ответ /health (порт открыт);
+- first_reply - ответ бота на /start, отправленный сразу после открытия порта;
+- configured - заглушка получила команды, вебхук, getMe и уведомление админу;
+- health_max - самый долгий ответ /health во время запуска.
+
+Фазы изнутри процесса берутся из /metrics (startup_phase_seconds, startup_seconds)
+
+Запуск: python bench_startup.py --runs 5 --api-latency 0.1
+        python bench_startup.py --baseline bench_results/startup-old.json
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegramAPI
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ADMIN_ID = 1
+USER_ID = 777
+STARTUP_METHODS = ("setMyCommands", "getWebhookInfo", "getMe")
+METRICS = ("listen", "first_reply", "configured", "health_max")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Время холодного запуска webhook.py")
+    parser.add_argument("--runs", type=int, default=5, help="прогонов (результат - медиана)")
+    parser.add_argument("--mode", default="fast_ack", choices=("simple", "fast_ack"), help="режим вебхука")
+    parser.add_argument("--api-latency", type=float, default=0.1, help="задержка Bot API, сек")
+    parser.add_argument("--timeout", type=float, default=60.0, help="предел одного прогона, сек")
+    parser.add_argument("--output", default=None, help="файл для результатов (JSON)")
+    parser.add_argument("--baseline", default=None, help="предыдущие результаты для сравнения")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_update() -> dict:
+    """Обновление /start без aiogram: процесс бенчмарка не тратит время на его импорт"""
+    return {"update_id": 1, "message": {
+        "message_id": 1, "date": int(time.time()), "text": "/start",
+        "chat": {"id": USER_ID, "type": "private"},
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "Cold"},
+    }}
+
+
+def parse_startup_metrics(text: str) -> dict:
+    """Строки startup_*{phase|milestone="..."} из /metrics -> {"phase:import": 3.1, ...}"""
+    phases = {}
+    for line in text.splitlines():
+        for name, label in (("startup_phase_seconds", "phase"), ("startup_seconds", "milestone")):
+            prefix = f'{name}{{{label}="'
+            start = line.find(prefix)
+            if start >= 0:
+                key, value = line[start + len(prefix):].split('"} ')
+                phases[f"{label}:{key}"] = float(value)
+    return phases
+
+
+class ApiWatcher:
+    """Моменты первых успешных вызовов заглушки"""
+
+    def __init__(self):
+        self.seen = {}
+
+    def reset(self):
+        self.seen = {}
+
+    def __call__(self, method: str, params: dict):
+        key = method
+        if method == "sendMessage":
+            key = f"sendMessage:{params.get('chat_id')}"
+        self.seen.setdefault(key, time.perf_counter())
+
+    def configured_at(self):
+        keys = STARTUP_METHODS + (f"sendMessage:{ADMIN_ID}",)
+        return max(self.seen[key] for key in keys) if all(key in self.seen for key in keys) else None
+
+
+async def wait_for(predicate, timeout: float, interval: float = 0.005):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        result = predicate()
+        if result:
+            return result
+        await asyncio.sleep(interval)
+    raise TimeoutError
+
+
+async def run_once(args, api_port: int, watcher: ApiWatcher) -> dict:
+    bot_port = free_port()
+    tmp = tempfile.mkdtemp(prefix="anon_bot_startup_")
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "123456:BENCHMARKBENCHMARKBENCHMARKBENCHMAR",
+        "DB_PATH": os.path.join(tmp, "cold.db"),
+        "PORT": str(bot_port),
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}",
+        "RENDER_EXTERNAL_HOSTNAME": f"127.0.0.1:{bot_port}",
+        "ADMIN_ID": str(ADMIN_ID),
+        "WEBHOOK_MODE": args.mode,
+        "LOG_LEVEL": "WARNING",
+    }
+    base = f"http://127.0.0.1:{bot_port}"
+    watcher.reset()
+
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "webhook.py"), env=env,
+                                                   stdout=asyncio.subprocess.DEVNULL)
+    result = {}
+    try:
+        async with aiohttp.ClientSession() as http:
+            # Порт открыт - первый ответ /health
+            while "listen" not in result:
+                try:
+                    async with http.get(f"{base}/health") as response:
+                        if response.status == 200:
+                            result["listen"] = time.perf_counter() - started
+                except aiohttp.ClientConnectionError:
+                    await asyncio.sleep(0.005)
+                if time.perf_counter() - started > args.timeout:
+                    raise TimeoutError("порт не открылся")
+
+            # Пользователь пишет сразу после открытия порта; /health опрашивается параллельно
+            health_latencies = []
+            replied = asyncio.Event()
+
+            async def poll_health():
+                while not replied.is_set():
+                    request_started = time.perf_counter()
+                    async with http.get(f"{base}/health") as response:
+                        await response.read()
+                    health_latencies.append(time.perf_counter() - request_started)
+                    await asyncio.sleep(0.02)
+
+            poller = asyncio.create_task(poll_health())
+            async with http.post(f"{base}/webhook", json=start_update()) as response:
+                await response.read()
+            reply_at = await wait_for(lambda: watcher.seen.get(f"sendMessage:{USER_ID}"), args.timeout)
+            result["first_reply"] = reply_at - started
+            replied.set()
+            await poller
+            result["health_max"] = max(health_latencies, default=0.0)
+
+            configured_at = await wait_for(watcher.configured_at, args.timeout)
+            result["configured"] = configured_at - started
+
+            async with http.get(f"{base}/metrics") as response:
+                result["phases"] = parse_startup_metrics(await response.text()) if response.status == 200 else {}
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), 30)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+    return result
+
+
+def compare(result: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        old = json.load(f)["result"]
+
+    print("\nСравнение с", baseline_path)
+    for key in METRICS:
+        change = (result[key] / old[key] - 1) * 100 if old.get(key) else 0.0
+        print(f"  {key:<12} {old.get(key, 0.0):>8.3f} -> {result[key]:>8.3f} сек ({change:+.1f}%)")
+
+
+async def main():
+    args = parse_args()
+
+    # Заглушка Bot API в этом процессе
+    api = FakeTelegramAPI(latency=args.api_latency)
+    watcher = ApiWatcher()
+    api.listeners.append(watcher)
+    api_port = free_port()
+    api_runner = web.AppRunner(api.create_app())
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", api_port).start()
+
+    runs = []
+    try:
+        for number in range(args.runs):
+            run = await run_once(args, api_port, watcher)
+            runs.append(run)
+            print(f"Прогон {number + 1}: " + ", ".join(f"{key} {run[key]:.3f}" for key in METRICS) + " сек")
+    finally:
+        await api_runner.cleanup()
+
+    result = {key: statistics.median(run[key] for run in runs) for key in METRICS}
+    phase_names = sorted({name for run in runs for name in run["phases"]})
+    result["phases"] = {name: statistics.median(run["phases"].get(name, 0.0) for run in runs)
+                        for name in phase_names}
+
+    print(f"\nМедиана {args.runs} прогонов (режим {args.mode}, задержка Bot API {args.api_latency} сек):")
+    for key in METRICS:
+        print(f"  {key:<12} {result[key]:>8.3f} сек")
+    if result["phases"]:
+        print("Фазы внутри процесса:")
+        for name, seconds in result["phases"].items():
+            print(f"  {name:<24} {seconds:>8.3f} сек")
+
+    output = args.output or os.path.join("bench_results", f"startup-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"created_at": datetime.now().isoformat(), "mode": args.mode, "runs": args.runs,
+                   "api_latency": args.api_latency, "result": result, "all_runs": runs},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {output}")
+
+    if args.baseline:
+        compare(result, args.baseline)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хранилища: обновления в секунду
+"до" - новое подключение sqlite3 на каждый вызов прямо в event loop
+"после" - хранилище Storage с постоянным подключением, потоком БД
+и групповым коммитом истории/пользователей
+
+Запуск: python bench_storage.py --updates 2000 --concurrency 50
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from storage import Storage
+
+
+# Старая схема работы: connect/commit/close на каждый вызов
+def legacy_save_user(db_path, user_id):
+    conn = sqlite3.connect(db_path)
+    conn.execute('''INSERT OR REPLACE INTO users (user_id, username, full_name, created_at)
+                    VALUES (?, ?, ?, ?)''', (user_id, "user", "User", datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+
+def legacy_get_link_owner(db_path, link_code):
+    conn = sqlite3.connect(db_path)
+    result = conn.execute("SELECT user_id FROM anon_links WHERE link_code = ? AND is_active = 1",
+                          (link_code,)).fetchone()
+    conn.close()
+    return result[0] if result else None
+
+
+def legacy_save_message_history(db_path, link_code, sender_id):
+    conn = sqlite3.connect(db_path)
+    conn.execute('''INSERT INTO messages
+                    (link_code, sender_id, sender_username, content_type, content_info, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?)''',
+                 (link_code, sender_id, "user", "text", "привет", datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+
+# Одно "обновление": /start пользователя, переход по ссылке и сообщение
+async def legacy_update(db_path, user_id, link_code):
+    legacy_save_user(db_path, user_id)
+    legacy_get_link_owner(db_path, link_code)
+    legacy_save_message_history(db_path, link_code, user_id)
+
+
+async def engine_update(storage, user_id, link_code):
+    await storage.save_user(user_id, "user", "User")
+    await storage.get_link_owner(link_code)
+    await storage.save_message_history(link_code, user_id, "user", "text", "привет")
+
+
+async def run(label, make_update, updates, concurrency, finish=None):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await make_update(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(updates)))
+    # Отложенные записи тоже входят в замер
+    if finish is not None:
+        await finish()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {updates / elapsed:>10.0f} обновлений/сек ({elapsed:.2f} сек)")
+    return updates / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилища")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # До: новое подключение на каждый вызов
+        legacy_path = os.path.join(tmp, "legacy.db")
+        storage = Storage(legacy_path)
+        await storage.init()
+        link_code = await storage.create_anon_link(1)
+        await storage.close()
+        # Старая БД работала в журнале по умолчанию
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+        before = await run("до (connect на вызов)",
+                           lambda i: legacy_update(legacy_path, i, link_code),
+                           args.updates, args.concurrency)
+
+        # После: постоянное подключение, WAL, поток БД
+        storage = Storage(os.path.join(tmp, "engine.db"))
+        await storage.init()
+        link_code = await storage.create_anon_link(1)
+        after = await run("после (Storage)",
+                          lambda i: engine_update(storage, i, link_code),
+                          args.updates, args.concurrency, finish=storage.flush)
+        print(f"Пачек записано: {storage.writer.batches_written}, строк: {storage.writer.rows_written}")
+        await storage.close()
+
+    print(f"Ускорение: x{after / before:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест вебхука против локальной заглушки Bot API
+Поднимает fake_telegram.py и настоящее приложение webhook.py (create_app)
+в одном процессе, бот ходит в заглушку через TELEGRAM_API_URL. Отправители
+шлют POST /webhook: /start по ссылке, после ответа бота - сообщение. Доставка
+считается завершенной, когда заглушка получила подтверждение отправителю
+
+Запуск: python bench_webhook.py --mode fast_ack --senders 500 --concurrency 64
+        python bench_webhook.py --mode simple --api-latency 0.05 --retry-after-rate 0.02
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "text=45,photo=15,video=5,voice=10,document=5,sticker=15,video_note=5"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест вебхука с заглушкой Bot API")
+    parser.add_argument("--mode", default="fast_ack", choices=("simple", "fast_ack"), help="режим вебхука")
+    parser.add_argument("--senders", type=int, default=300, help="отправителей (сценариев)")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных отправителей")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="доли типов содержимого")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="средняя задержка Bot API, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки Bot API, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--with-limits", action="store_true", help="не отключать лимиты исходящих запросов и антифлуд")
+    parser.add_argument("--timeout", type=float, default=30.0, help="ожидание доставки одного сообщения, сек")
+    parser.add_argument("--output", default=None, help="файл для результатов (JSON)")
+    parser.add_argument("--baseline", default=None, help="предыдущие результаты для сравнения")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+args = parse_args()
+API_PORT = free_port()
+BOT_PORT = free_port()
+
+# Окружение задается до импорта бота
+_tmp = tempfile.mkdtemp(prefix="anon_bot_bench_")
+os.environ["BOT_TOKEN"] = "123456:BENCHMARKBENCHMARKBENCHMARKBENCHMAR"
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{API_PORT}"
+os.environ["RENDER_EXTERNAL_HOSTNAME"] = f"127.0.0.1:{BOT_PORT}"
+os.environ.pop("ADMIN_ID", None)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+if not args.with_limits:
+    for name in ("OUTBOUND_GLOBAL_RATE", "OUTBOUND_CHAT_RATE", "OUTBOUND_CHAT_BURST",
+                 "FLOOD_SENDER_RATE", "FLOOD_SENDER_BURST", "FLOOD_PAIR_RATE", "FLOOD_PAIR_BURST"):
+        os.environ[name] = "1000000"
+
+import aiohttp
+from aiohttp import web
+
+import anon_bot
+import webhook
+from bench_common import UpdateFactory, parse_mix, percentile
+from fake_telegram import FakeTelegramAPI
+
+
+class DeliveryTracker:
+    """Ожидание sendMessage в чат отправителя: первое - ответ на /start, второе - подтверждение доставки"""
+
+    def __init__(self):
+        self.messages = {}
+        self.waiters = {}
+
+    def expect(self, chat_id: int) -> list:
+        """[ответ на /start, подтверждение доставки]"""
+        loop = asyncio.get_running_loop()
+        futures = self.waiters[chat_id] = [loop.create_future(), loop.create_future()]
+        return futures
+
+    def __call__(self, method: str, params: dict):
+        if method != "sendMessage":
+            return
+        chat_id = int(params.get("chat_id") or 0)
+        count = self.messages[chat_id] = self.messages.get(chat_id, 0) + 1
+        futures = self.waiters.get(chat_id)
+        if futures is not None and count <= len(futures) and not futures[count - 1].done():
+            futures[count - 1].set_result(time.perf_counter())
+
+
+async def run_sender(http: aiohttp.ClientSession, tracker: DeliveryTracker, factory: UpdateFactory,
+                     sender_id: int, link_code: str, kind: str, http_latencies: list, delivery_latencies: list):
+    """Сценарий отправителя: /start по ссылке, ответ бота, затем сообщение"""
+    url = f"http://127.0.0.1:{BOT_PORT}{webhook.WEBHOOK_PATH}"
+    greeted, delivered = tracker.expect(sender_id)
+
+    for update in (factory.message(sender_id, text=f"/start {link_code}"), factory.content(sender_id, kind)):
+        started = time.perf_counter()
+        async with http.post(url, data=update.model_dump_json(exclude_none=True, by_alias=True),
+                             headers={"Content-Type": "application/json"}) as response:
+            await response.read()
+            if response.status != 200:
+                return response.status
+        http_latencies.append(time.perf_counter() - started)
+
+        if not greeted.done():
+            # 200 не значит, что /start обработан: в обоих режимах обработка идет в фоне,
+            # и сообщение до ответа на /start пришло бы раньше, чем установлено состояние
+            try:
+                await asyncio.wait_for(asyncio.shield(greeted), args.timeout)
+            except asyncio.TimeoutError:
+                return "timeout /start"
+
+    try:
+        finished = await asyncio.wait_for(delivered, args.timeout)
+    except asyncio.TimeoutError:
+        return "timeout"
+    delivery_latencies.append(finished - started)
+    return 200
+
+
+async def run_load(tracker: DeliveryTracker, link_codes: list, mix: dict) -> dict:
+    factory = UpdateFactory()
+    kinds = random.choices(list(mix), weights=list(mix.values()), k=args.senders)
+    http_latencies = []
+    delivery_latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(index: int, kind: str):
+        async with semaphore:
+            return await run_sender(http, tracker, factory, 10 ** 6 + index, random.choice(link_codes), kind,
+                                    http_latencies, delivery_latencies)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(limited(index, kind) for index, kind in enumerate(kinds)))
+        elapsed = time.perf_counter() - started
+
+    failures = {}
+    for outcome in outcomes:
+        if outcome != 200:
+            failures[str(outcome)] = failures.get(str(outcome), 0) + 1
+
+    return {
+        "updates": len(http_latencies),
+        "delivered": len(delivery_latencies),
+        "seconds": elapsed,
+        "updates_per_sec": len(http_latencies) / elapsed,
+        "deliveries_per_sec": len(delivery_latencies) / elapsed,
+        "http_p50_ms": percentile(http_latencies, 50) * 1000,
+        "http_p99_ms": percentile(http_latencies, 99) * 1000,
+        "delivery_p50_ms": percentile(delivery_latencies, 50) * 1000,
+        "delivery_p95_ms": percentile(delivery_latencies, 95) * 1000,
+        "delivery_p99_ms": percentile(delivery_latencies, 99) * 1000,
+        "delivery_mean_ms": statistics.fmean(delivery_latencies) * 1000 if delivery_latencies else 0.0,
+        "failures": failures,
+    }
+
+
+def compare(result: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        old = json.load(f)["result"]
+
+    print("\nСравнение с", baseline_path)
+    for key in ("deliveries_per_sec", "http_p99_ms", "delivery_p50_ms", "delivery_p99_ms"):
+        change = (result[key] / old[key] - 1) * 100 if old[key] else 0.0
+        print(f"  {key:<20} {old[key]:>10.2f} -> {result[key]:>10.2f} ({change:+.1f}%)")
+
+
+async def main():
+    mix = parse_mix(args.mix)
+
+    # Заглушка Bot API
+    api = FakeTelegramAPI(args.api_latency, args.jitter, args.error_rate, args.retry_after_rate)
+    tracker = DeliveryTracker()
+    api.listeners.append(tracker)
+    api_runner = web.AppRunner(api.create_app())
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", API_PORT).start()
+
+    # Настоящее приложение вебхука
+    app = webhook.create_app(args.mode)
+    bot_runner = web.AppRunner(app)
+    await bot_runner.setup()
+    await web.TCPSite(bot_runner, "127.0.0.1", BOT_PORT).start()
+    # Запросы к Bot API при запуске идут в фоне - дожидаемся, чтобы не смешать их с нагрузкой
+    await app[webhook.BOT_STARTUP].configured.wait()
+
+    try:
+        owners = list(range(1, 51))
+        link_codes = [await anon_bot.create_anon_link(owner) for owner in owners]
+        startup_calls = sum(api.calls.values())
+
+        result = await run_load(tracker, link_codes, mix)
+        result["api_calls_by_method"] = dict(api.calls)
+        result["api_calls_per_delivery"] = ((sum(api.calls.values()) - startup_calls) / result["delivered"]
+                                            if result["delivered"] else 0.0)
+        result["api_errors_injected"] = dict(api.errors)
+    finally:
+        await bot_runner.cleanup()
+        await api_runner.cleanup()
+
+    print(f"Режим: {args.mode}, отправителей: {args.senders}, параллельно: {args.concurrency}")
+    print(f"  обновлений/сек   {result['updates_per_sec']:>10.0f}")
+    print(f"  доставок/сек     {result['deliveries_per_sec']:>10.0f} ({result['delivered']} из {args.senders})")
+    print(f"  HTTP p50/p99     {result['http_p50_ms']:>10.2f} / {result['http_p99_ms']:.2f} мс")
+    print(f"  доставка p50/p95/p99 {result['delivery_p50_ms']:.2f} / {result['delivery_p95_ms']:.2f} / "
+          f"{result['delivery_p99_ms']:.2f} мс")
+    print(f"  запросов к API на доставку {result['api_calls_per_delivery']:.2f}")
+    if result["failures"]:
+        print(f"  ошибки: {result['failures']}")
+    if result["api_errors_injected"]:
+        print(f"  внесенные ошибки API: {result['api_errors_injected']}")
+
+    output = args.output or os.path.join("bench_results", f"webhook-{args.mode}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"created_at": datetime.now().isoformat(), "mode": args.mode, "mix": mix,
+                   "senders": args.senders, "concurrency": args.concurrency,
+                   "api_latency": args.api_latency, "error_rate": args.error_rate,
+                   "retry_after_rate": args.retry_after_rate, "result": result},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {output}")
+
+    if args.baseline:
+        compare(result, args.baseline)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Простой in-process кэш с ограничением размера (LRU) и временем жизни (TTL)
+Используется только из event loop, поэтому без блокировок
+"""
+
+import time
+from collections import OrderedDict
+
+# Маркер отсутствия значения (None - допустимое закэшированное значение)
+MISSING = object()
+
+
+class TTLCache:
+    """LRU-кэш с TTL, отдельным TTL для отрицательных ответов и счетчиками"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300, negative_ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        """Значение по ключу или default, если его нет или оно устарело"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        """Сохранение значения; None кэшируется на negative_ttl"""
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """Удаление ключа из кэша"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,144 @@
+"""
+Схлопывание повторов анонимного спама
+Для каждой пары отправитель-получатель запоминаются отпечатки содержимого
+за окно DEDUP_WINDOW: хэш нормализованного текста или file_unique_id медиа
+вместе с подписью. Повтор не пишется в историю и не доставляется - вместо
+копий получатель через DEDUP_NOTICE_DELAY секунд получает одно уведомление «×N».
+Одинаковые сообщения разных отправителей не схлопываются: это разные люди
+"""
+
+import os
+import asyncio
+import logging
+from hashlib import blake2b
+
+from aiogram.types import Message
+
+from cache import TTLCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+# Окно (сек) отсчитывается от последнего повтора: пока спам идет, он схлопывается
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", 600))
+# Предел числа записей (получатель, отправитель, отпечаток) в памяти (LRU)
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", 100000))
+# Повторы копятся столько секунд и приходят получателю одним уведомлением
+DEDUP_NOTICE_DELAY = float(os.getenv("DEDUP_NOTICE_DELAY", 10))
+
+
+def _text_hash(text: str) -> str:
+    """Хэш текста без учета регистра и пробелов"""
+    normalized = " ".join(text.casefold().split())
+    return blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+
+def fingerprint(message: Message, kind) -> str:
+    """Отпечаток содержимого: текст - по хэшу, медиа - по file_unique_id и подписи"""
+    if kind.name == "text":
+        return "text:" + _text_hash(message.text)
+
+    media = getattr(message, kind.name)
+    if isinstance(media, list):
+        # Фото - список размеров одного снимка
+        media = media[-1]
+    # Один и тот же файл с другой подписью - другое сообщение
+    caption = _text_hash(message.caption) if message.caption else ""
+    return f"{kind.name}:{media.file_unique_id}:{caption}"
+
+
+def album_fingerprint(fingerprints: list) -> str:
+    """Отпечаток альбома: тот же набор частей в любом порядке"""
+    return "album:" + blake2b("\n".join(sorted(fingerprints)).encode(), digest_size=16).hexdigest()
+
+
+class _Seen:
+    __slots__ = ("repeats", "pending", "context", "timer")
+
+    def __init__(self):
+        self.repeats = 0      # повторов за окно
+        self.pending = 0      # повторов, о которых получатель еще не знает
+        self.context = None
+        self.timer = None
+
+
+class DuplicateFilter:
+    """Отпечатки по (получатель, отправитель, отпечаток)
+
+    О скрытых повторах сообщает on_repeats(recipient_id, count, **context) через DEDUP_NOTICE_DELAY
+    """
+
+    def __init__(self, on_repeats, window: float = DEDUP_WINDOW, max_entries: int = DEDUP_MAX_ENTRIES,
+                 notice_delay: float = DEDUP_NOTICE_DELAY):
+        self.on_repeats = on_repeats
+        self.notice_delay = notice_delay
+        self._seen = TTLCache(max_entries, ttl=window)
+        self._pending = {}
+        self._tasks = set()
+
+        # Метрики
+        self.dropped = 0
+        self.notices = 0
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def check(self, recipient_id: int, sender_id: int, fingerprint: str, **context) -> int:
+        """0 - отправитель еще не присылал это получателю (доставлять), иначе номер повтора за окно
+
+        context первого повтора передается в on_repeats вместе с числом повторов
+        """
+        key = (recipient_id, sender_id, fingerprint)
+        seen = self._seen.get(key)
+        if seen is MISSING:
+            self._seen.set(key, _Seen())
+            return 0
+
+        # Повторная запись продлевает окно
+        self._seen.set(key, seen)
+        seen.repeats += 1
+        seen.pending += 1
+        self.dropped += 1
+        if seen.timer is None:
+            seen.context = context
+            seen.timer = asyncio.get_running_loop().call_later(self.notice_delay, self._flush, key)
+            self._pending[key] = seen
+        return seen.repeats
+
+    def forget(self, recipient_id: int, sender_id: int, fingerprint: str):
+        """Отпечаток недоставленного содержимого: повтор не должен считаться дублем"""
+        key = (recipient_id, sender_id, fingerprint)
+        self._seen.invalidate(key)
+        seen = self._pending.pop(key, None)
+        if seen is not None and seen.timer is not None:
+            seen.timer.cancel()
+
+    def _flush(self, key):
+        seen = self._pending.pop(key, None)
+        if seen is None:
+            return
+        if seen.timer is not None:
+            seen.timer.cancel()
+            seen.timer = None
+
+        count, seen.pending = seen.pending, 0
+        self.notices += 1
+        task = asyncio.create_task(self._notify(key[0], count, seen.context))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _notify(self, recipient_id: int, count: int, context: dict):
+        try:
+            await self.on_repeats(recipient_id, count, **context)
+        except Exception as e:
+            logger.error(f"❌ Ошибка уведомления о повторах (×{count}): {e}")
+
+    def stats(self) -> dict:
+        return {"entries": len(self._seen), "pending": len(self._pending),
+                "dropped": self.dropped, "notices": self.notices}
+
+    async def stop(self):
+        """Немедленная отправка накопленных уведомлений и ожидание отправки"""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
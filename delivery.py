@@ -0,0 +1,179 @@
+"""
+Таблица типов содержимого для доставки анонимных сообщений
+Каждая запись описывает, как распознать тип, что сохранить в историю
+и как доставить получателю ровно одним запросом к Bot API:
+
+- DELIVER_TEXT - send_message с заголовком и текстом
+- DELIVER_CAPTION - copy_message с подписью-заголовком
+- DELIVER_BUTTON - copy_message, заголовок в inline-кнопке
+  (стикеры и видео-заметки не поддерживают подписи)
+
+Новый тип содержимого - новая запись в CONTENT_KINDS
+"""
+
+from datetime import datetime
+
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, Message,
+    InputMediaPhoto, InputMediaVideo, InputMediaAudio, InputMediaDocument,
+)
+
+DELIVER_TEXT = "text"
+DELIVER_CAPTION = "caption"
+DELIVER_BUTTON = "button"
+
+# callback_data кнопки-заголовка: нажатие просто подтверждается
+HEADER_CALLBACK = "anon_header"
+
+FOOTER = "<i>💬 Ответить нельзя</i>"
+
+
+class ContentKind:
+    """Тип содержимого: распознавание, описание для истории и заголовок для получателя"""
+
+    def __init__(self, name: str, label: str, mode: str, header: str, info, confirm: str, error: str,
+                 fields=None):
+        self.name = name          # атрибут Message и content_type в истории
+        self.label = label        # тип в логе
+        self.mode = mode
+        self.header = header      # шаблон заголовка: {time} и поля из fields(message)
+        self.info = info          # описание для истории и лога
+        self.confirm = confirm    # ответ отправителю
+        self.error = error
+        self.fields = fields
+
+    def matches(self, message: Message) -> bool:
+        return bool(getattr(message, self.name, None))
+
+    def render_header(self, message: Message, now: datetime = None) -> str:
+        fields = self.fields(message) if self.fields else {}
+        return self.header.format(time=(now or datetime.now()).strftime('%H:%M'), **fields)
+
+    def delivery_kwargs(self, message: Message, now: datetime = None) -> dict:
+        """Аргументы единственного запроса доставки (без chat_id)"""
+        header = self.render_header(message, now)
+        if self.mode == DELIVER_TEXT:
+            return {"text": header, "parse_mode": "HTML"}
+
+        copy = {"from_chat_id": message.chat.id, "message_id": message.message_id}
+        if self.mode == DELIVER_CAPTION:
+            return {**copy, "caption": header, "parse_mode": "HTML"}
+        return {**copy, "reply_markup": InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=header, callback_data=HEADER_CALLBACK)]
+        ])}
+
+
+def _size_kb(media) -> int:
+    return (media.file_size or 0) // 1024
+
+
+def _audio_fields(message: Message) -> dict:
+    lines = ""
+    if message.audio.title:
+        lines += f"Название: {message.audio.title}\n"
+    if message.audio.performer:
+        lines += f"Исполнитель: {message.audio.performer}\n"
+    return {"lines": lines}
+
+
+# Порядок важен: проверяется сверху вниз, как прежняя цепочка if/elif
+CONTENT_KINDS = [
+    ContentKind(
+        "text", "ТЕКСТ", DELIVER_TEXT,
+        "📨 <b>Новое анонимное сообщение!</b>\n🕒 <i>{time}</i>\n\n{text}\n\n" + FOOTER,
+        lambda m: m.text,
+        "✅ Текст отправлен анонимно!",
+        "❌ Не удалось отправить сообщение. Возможно, пользователь заблокировал бота.",
+        fields=lambda m: {"text": m.text},
+    ),
+    ContentKind(
+        "photo", "ФОТО", DELIVER_CAPTION,
+        "📸 <b>Анонимное фото!</b>\n🕒 <i>{time}</i>\n\n{caption}\n\n" + FOOTER,
+        lambda m: f"Фото ({_size_kb(m.photo[-1])} KB)",
+        "✅ Фото отправлено анонимно!",
+        "❌ Не удалось отправить фото.",
+        fields=lambda m: {"caption": m.caption or "📷 Анонимное фото"},
+    ),
+    ContentKind(
+        "video", "ВИДЕО", DELIVER_CAPTION,
+        "🎬 <b>Анонимное видео!</b>\n🕒 <i>{time}</i>\n\n{caption}\n\n" + FOOTER,
+        lambda m: f"Видео ({_size_kb(m.video)} KB, {m.video.duration} сек)",
+        "✅ Видео отправлено анонимно!",
+        "❌ Не удалось отправить видео.",
+        fields=lambda m: {"caption": m.caption or "🎥 Анонимное видео"},
+    ),
+    ContentKind(
+        "voice", "ГОЛОС", DELIVER_CAPTION,
+        "🎤 <b>Анонимное голосовое сообщение!</b>\n🕒 <i>{time}</i>\n" + FOOTER,
+        lambda m: f"Голосовое ({m.voice.duration} сек)",
+        "✅ Голосовое отправлено анонимно!",
+        "❌ Не удалось отправить голосовое сообщение.",
+    ),
+    ContentKind(
+        "audio", "АУДИО", DELIVER_CAPTION,
+        "🎵 <b>Анонимная музыка!</b>\n{lines}🕒 <i>{time}</i>\n\n" + FOOTER,
+        lambda m: f"Аудио: {m.audio.title or 'Без названия'} - {m.audio.performer or 'Неизвестно'}",
+        "✅ Аудио отправлено анонимно!",
+        "❌ Не удалось отправить аудио.",
+        fields=_audio_fields,
+    ),
+    ContentKind(
+        "document", "ДОКУМЕНТ", DELIVER_CAPTION,
+        "📎 <b>Анонимный документ!</b>\n🕒 <i>{time}</i>\nФайл: {file_name}\n\n" + FOOTER,
+        lambda m: f"Документ: {m.document.file_name} ({_size_kb(m.document)} KB)",
+        "✅ Документ отправлен анонимно!",
+        "❌ Не удалось отправить документ.",
+        fields=lambda m: {"file_name": m.document.file_name},
+    ),
+    ContentKind(
+        "sticker", "СТИКЕР", DELIVER_BUTTON,
+        "✨ Анонимный стикер! 🕒 {time} · Ответить нельзя",
+        lambda m: "Стикер из набора",
+        "✅ Стикер отправлен анонимно!",
+        "❌ Не удалось отправить стикер.",
+    ),
+    ContentKind(
+        "video_note", "ВИДЕО-ЗАМЕТКА", DELIVER_BUTTON,
+        "📹 Анонимная видео-заметка! 🕒 {time} · Ответить нельзя",
+        lambda m: f"Видео-заметка ({m.video_note.duration} сек)",
+        "✅ Видео-заметка отправлена анонимно!",
+        "❌ Не удалось отправить видео-заметку.",
+    ),
+]
+
+
+def detect_kind(message: Message):
+    """Первый подходящий тип содержимого или None"""
+    for kind in CONTENT_KINDS:
+        if kind.matches(message):
+            return kind
+    return None
+
+
+# Типы, которые могут входить в альбом (send_media_group)
+ALBUM_MEDIA = {
+    "photo": (InputMediaPhoto, lambda m: m.photo[-1].file_id),
+    "video": (InputMediaVideo, lambda m: m.video.file_id),
+    "audio": (InputMediaAudio, lambda m: m.audio.file_id),
+    "document": (InputMediaDocument, lambda m: m.document.file_id),
+}
+
+ALBUM_HEADER = "🖼 <b>Анонимный альбом!</b> ({count})\n🕒 <i>{time}</i>\n\n{caption}" + FOOTER
+
+
+def album_media(messages: list, now: datetime = None) -> list:
+    """InputMedia для send_media_group; заголовок - подпись первой части"""
+    caption = next((m.caption for m in messages if m.caption), None)
+    header = ALBUM_HEADER.format(count=len(messages), time=(now or datetime.now()).strftime('%H:%M'),
+                                 caption=f"{caption}\n\n" if caption else "")
+    media = []
+    for message in messages:
+        kind = detect_kind(message)
+        if kind is None or kind.name not in ALBUM_MEDIA:
+            continue
+        media_type, file_id = ALBUM_MEDIA[kind.name]
+        if media:
+            media.append(media_type(media=file_id(message)))
+        else:
+            media.append(media_type(media=file_id(message), caption=header, parse_mode="HTML"))
+    return media
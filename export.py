@@ -0,0 +1,86 @@
+"""
+Выгрузка истории сообщений для админа в gzip (NDJSON или CSV)
+Строки читаются пачками через Repository.iter_messages и сразу пишутся
+во временный файл в отдельном потоке: память не растет с размером
+таблицы, а event loop продолжает обрабатывать обновления
+"""
+
+import os
+import csv
+import gzip
+import json
+import asyncio
+import logging
+import tempfile
+from datetime import date, datetime, timedelta
+
+from logs_view import parse_filters
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))
+# Bot API не принимает документы больше 50 MB
+EXPORT_MAX_BYTES = int(os.getenv("EXPORT_MAX_BYTES", 50 * 1024 * 1024))
+EXPORT_FORMATS = ("ndjson", "csv")
+# 6 почти не уступает 9 по размеру, но заметно быстрее
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", 6))
+
+EXPORT_COLUMNS = ("id", "timestamp", "link_code", "sender_id", "sender_username", "content_type", "content_info")
+
+
+def parse_export_args(args: str):
+    """(формат, фильтры, since, until) из аргументов: /export csv from=2026-01-01 to=2026-01-31 link=код
+
+    Даты включительные; ValueError с неверным аргументом
+    """
+    fmt, since, until, rest = EXPORT_FORMATS[0], None, None, []
+    for token in (args or "").split():
+        name, _, value = token.partition("=")
+        if token in EXPORT_FORMATS:
+            fmt = token
+        elif name in ("from", "to"):
+            try:
+                day = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(token)
+            if name == "from":
+                since = day.isoformat()
+            else:
+                until = (day + timedelta(days=1)).isoformat()
+        else:
+            rest.append(token)
+    return fmt, parse_filters(" ".join(rest)), since, until
+
+
+def write_export(chunks, fmt: str, path: str) -> int:
+    """Запись пачек строк в gzip-файл; возвращает число строк"""
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=EXPORT_GZIP_LEVEL) as output:
+        writer = csv.writer(output) if fmt == "csv" else None
+        if writer:
+            writer.writerow(EXPORT_COLUMNS)
+        for rows in chunks:
+            if writer:
+                writer.writerows(rows)
+            else:
+                output.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n"
+                                  for row in rows)
+            count += len(rows)
+    return count
+
+
+async def export_messages(db, fmt: str, filters: dict = None, since: str = None, until: str = None):
+    """Выгрузка во временный файл: (путь, имя для отправки, строк). Файл удаляет вызывающий"""
+    # Сообщения из очереди отложенной записи тоже должны попасть в выгрузку
+    await db.flush()
+
+    filename = f"messages_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}.gz"
+    fd, path = tempfile.mkstemp(prefix="anon_export_", suffix=".gz")
+    os.close(fd)
+    try:
+        chunks = db.iter_messages(filters, since, until, EXPORT_CHUNK_SIZE)
+        count = await asyncio.to_thread(write_export, chunks, fmt, path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, filename, count
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка Telegram Bot API для нагрузочного тестирования
+Отвечает на getMe, setWebhook, deleteWebhook, setMyCommands, sendMessage,
+send* для медиа и т.п. с настраиваемой задержкой, долей ошибок и 429 RetryAfter
+
+Запуск: python fake_telegram.py --port 8081 --latency 0.05 --error-rate 0.01 --retry-after-rate 0.02
+Бот подключается через TELEGRAM_API_URL=http://127.0.0.1:8081
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Fake", "username": "fake_anon_bot"}
+
+MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendVoice", "sendAudio", "sendDocument",
+    "sendSticker", "sendVideoNote", "sendAnimation", "editMessageText",
+}
+
+
+class FakeTelegramAPI:
+    """Состояние и настройки заглушки"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 retry_after_rate: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.calls_by_chat = Counter()
+        self.errors = Counter()
+        self.webhook_url = ""
+        self.webhook_settings = {}
+        self.pending_updates = []
+        self.listeners = []
+        self._message_id = 0
+
+    def _message(self, params: dict) -> dict:
+        self._message_id += 1
+        chat_id = int(params.get("chat_id") or 0)
+        message = {"message_id": self._message_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}}
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    def result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "setWebhook":
+            self.webhook_url = params.get("url", "")
+            allowed_updates = params.get("allowed_updates")
+            self.webhook_settings = {
+                "max_connections": int(params.get("max_connections") or 40),
+                "allowed_updates": json.loads(allowed_updates) if isinstance(allowed_updates, str) else allowed_updates,
+            }
+            if params.get("drop_pending_updates") in ("true", "True", True):
+                self.pending_updates.clear()
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = ""
+            if params.get("drop_pending_updates") in ("true", "True", True):
+                self.pending_updates.clear()
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url, "has_custom_certificate": False,
+                    "pending_update_count": len(self.pending_updates), **self.webhook_settings}
+        if method == "getUpdates":
+            updates, self.pending_updates = self.pending_updates, []
+            return updates
+        if method in MESSAGE_METHODS:
+            return self._message(params)
+        if method == "copyMessage":
+            self._message_id += 1
+            return {"message_id": self._message_id}
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media") or "[]")
+            return [self._message(params) for _ in media]
+        return True
+
+    def error(self, method: str):
+        """Случайная ошибка: 429 RetryAfter или 500"""
+        roll = random.random()
+        if roll < self.retry_after_rate:
+            self.errors["retry_after"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        if roll < self.retry_after_rate + self.error_rate:
+            self.errors["server_error"] += 1
+            return web.json_response({"ok": False, "error_code": 500,
+                                      "description": "Internal Server Error"}, status=500)
+        return None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        self.calls[method] += 1
+        if "chat_id" in params:
+            self.calls_by_chat[str(params["chat_id"])] += 1
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+        error = self.error(method)
+        if error is not None:
+            return error
+
+        result = self.result(method, params)
+        # Слушатели видят только успешные вызовы (нагрузочный тест ждет по ним доставку)
+        for listener in self.listeners:
+            listener(method, params)
+        return web.json_response({"ok": True, "result": result})
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "errors": dict(self.errors), "total": sum(self.calls.values())}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="средняя задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, сек")
+    args = parser.parse_args()
+
+    api = FakeTelegramAPI(args.latency, args.jitter, args.error_rate, args.retry_after_rate, args.retry_after)
+    web.run_app(api.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Хранилище FSM aiogram поверх SQLite-файла бота
+В памяти держатся только недавно использованные записи, состояния
+без активности дольше TTL удаляются фоновой задачей
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+from repository import Repository
+
+logger = logging.getLogger(__name__)
+
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", 24 * 3600))
+FSM_HOT_SIZE = int(os.getenv("FSM_HOT_SIZE", 5000))
+FSM_SWEEP_INTERVAL = float(os.getenv("FSM_SWEEP_INTERVAL", 600))
+
+
+class SQLiteFSMStorage(BaseStorage):
+    """FSM-хранилище: SQLite + LRU горячих записей + TTL"""
+
+    def __init__(self, db: Repository, ttl: float = FSM_STATE_TTL, hot_size: int = FSM_HOT_SIZE,
+                 sweep_interval: float = FSM_SWEEP_INTERVAL):
+        self.db = db
+        self.ttl = ttl
+        self.hot_size = hot_size
+        self.sweep_interval = sweep_interval
+        # key -> [state, data, updated_at, размер данных в байтах]
+        self._hot = OrderedDict()
+        self._sweeper = None
+        self.expired = 0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return (f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:"
+                f"{key.business_connection_id or ''}:{key.destiny}")
+
+    def _start_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def _entry(self, key: str) -> list:
+        self._start_sweeper()
+        now = time.time()
+
+        entry = self._hot.get(key)
+        if entry is not None:
+            self._hot.move_to_end(key)
+        else:
+            row = await self.db.fsm_load(key)
+            if row is None:
+                # Пустые записи в память не попадают
+                return [None, {}, now, 0]
+            state, data, updated_at = row
+            entry = [state, json.loads(data) if data else {}, updated_at, len(data or "")]
+            self._remember(key, entry)
+
+        # Просроченное состояние считается пустым (строку в БД удалит sweep)
+        if entry[2] < now - self.ttl:
+            self._hot.pop(key, None)
+            return [None, {}, now, 0]
+        return entry
+
+    def _remember(self, key: str, entry: list):
+        self._hot[key] = entry
+        self._hot.move_to_end(key)
+        # Вытеснение безопасно: все записи уже сохранены в БД
+        while len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+
+    async def _save(self, key: str, entry: list):
+        state, data = entry[0], entry[1]
+        entry[2] = time.time()
+
+        if state is None and not data:
+            # Пустое состояние не храним вовсе
+            self._hot.pop(key, None)
+            await self.db.fsm_delete(key)
+            return
+
+        data_json = json.dumps(data, ensure_ascii=False)
+        entry[3] = len(data_json)
+        self._remember(key, entry)
+        await self.db.fsm_save(key, state, data_json, entry[2])
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        storage_key = self._key(key)
+        entry = await self._entry(storage_key)
+        entry[0] = state.state if isinstance(state, State) else state
+        await self._save(storage_key, entry)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._entry(self._key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        storage_key = self._key(key)
+        entry = await self._entry(storage_key)
+        entry[1] = data.copy()
+        await self._save(storage_key, entry)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return (await self._entry(self._key(key)))[1].copy()
+
+    async def sweep(self) -> int:
+        """Удаление состояний без активности дольше TTL (в памяти и в БД)"""
+        before = time.time() - self.ttl
+        for key in [k for k, entry in self._hot.items() if entry[2] < before]:
+            del self._hot[key]
+
+        removed = await self.db.fsm_expire(before)
+        self.expired += removed
+        if removed:
+            logger.info(f"🧹 Удалено устаревших состояний FSM: {removed}")
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки состояний FSM: {e}")
+
+    async def stats(self) -> dict:
+        """Количество записей и примерный объем памяти горячего кэша"""
+        memory = sum(sys.getsizeof(key) + entry[3] for key, entry in self._hot.items())
+        return {
+            "hot_entries": len(self._hot),
+            "stored_entries": await self.db.fsm_count(),
+            "hot_memory_bytes": memory,
+            "expired": self.expired,
+        }
+
+    async def stats_by_location(self) -> dict:
+        """Количество состояний в памяти и в БД (для метрик)"""
+        return {"memory": len(self._hot), "db": await self.db.fsm_count()}
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
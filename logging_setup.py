@@ -0,0 +1,92 @@
+"""
+Настройка логирования: запись через очередь в фоновом потоке
+Event loop только кладет запись в очередь, форматирование и вывод в поток
+выполняет QueueListener. События (extra={"event": {...}}) пишутся одной
+JSON-записью
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# text - привычный формат строк, json - каждая запись JSON-объектом
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Доля событий, в которые попадает текст сообщения, и его максимальная длина
+LOG_TEXT_SAMPLE_RATE = float(os.getenv("LOG_TEXT_SAMPLE_RATE", 1.0))
+LOG_TEXT_MAX_LENGTH = int(os.getenv("LOG_TEXT_MAX_LENGTH", 200))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class EventFormatter(logging.Formatter):
+    """Текстовый формат; поля события дописываются одной JSON-строкой"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        event = getattr(record, "event", None)
+        if event is not None:
+            line += " " + json.dumps(event, ensure_ascii=False, default=str)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Каждая запись - один JSON-объект"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event is not None:
+            payload.update(event)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def sample_text(text: str) -> dict:
+    """Поля с текстом сообщения с учетом выборки и ограничения длины"""
+    if text is None:
+        return {}
+    if LOG_TEXT_SAMPLE_RATE < 1 and random.random() >= LOG_TEXT_SAMPLE_RATE:
+        return {"text_length": len(text)}
+    return {"text": text[:LOG_TEXT_MAX_LENGTH]}
+
+
+def setup_logging():
+    """Перенастройка корневого логгера на запись через очередь (повторный вызов безопасен)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else EventFormatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Вывод оставшихся записей и остановка фонового потока"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,99 @@
+"""
+Страницы /logs для админа: фильтры, разметка и кнопки навигации
+Курсор страницы - id крайнего сообщения, выборка идет по индексу
+(timestamp, id), поэтому любая страница стоит одного поиска по индексу
+"""
+
+import os
+from html import escape
+from typing import Optional
+from datetime import datetime
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+LOGS_PAGE_SIZE = int(os.getenv("LOGS_PAGE_SIZE", 20))
+
+# Имена фильтров в команде: /logs type=photo sender=123 link=abcdef
+FILTER_NAMES = {"type": "content_type", "sender": "sender_id", "link": "link_code"}
+
+
+class LogsPage(CallbackData, prefix="logs"):
+    """Кнопка навигации; поля короткие - callback_data ограничена 64 байтами"""
+    d: str        # o - старее, n - новее
+    i: int        # id курсора
+    c: Optional[str] = None   # content_type
+    s: Optional[int] = None   # sender_id
+    l: Optional[str] = None   # link_code
+
+
+def parse_filters(args: str) -> dict:
+    """Фильтры из аргументов команды; ValueError при неизвестном имени или значении"""
+    filters = {}
+    for token in (args or "").split():
+        name, _, value = token.partition("=")
+        if name not in FILTER_NAMES or not value:
+            raise ValueError(token)
+        column = FILTER_NAMES[name]
+        if column == "sender_id":
+            if not value.isdigit():
+                raise ValueError(token)
+            value = int(value)
+        filters[column] = value
+    return filters
+
+
+def page_filters(page: LogsPage) -> dict:
+    filters = {"content_type": page.c, "sender_id": page.s, "link_code": page.l}
+    return {name: value for name, value in filters.items() if value is not None}
+
+
+def logs_keyboard(rows: list, filters: dict, has_older: bool, has_newer: bool):
+    """Кнопки «Старее»/«Новее» (None, если листать некуда)"""
+    fields = {"c": filters.get("content_type"), "s": filters.get("sender_id"), "l": filters.get("link_code")}
+    buttons = []
+    try:
+        if has_newer:
+            buttons.append(InlineKeyboardButton(text="⬅️ Новее",
+                                                callback_data=LogsPage(d="n", i=rows[0][0], **fields).pack()))
+        if has_older:
+            buttons.append(InlineKeyboardButton(text="Старее ➡️",
+                                                callback_data=LogsPage(d="o", i=rows[-1][0], **fields).pack()))
+    except ValueError:
+        # Фильтры не помещаются в 64 байта callback_data - страница без навигации
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+def render_logs_page(rows: list, filters: dict) -> str:
+    """HTML-текст страницы; rows - (id, username, sender_id, content_type, content_info, link_code, timestamp)"""
+    response = "📋 <b>Анонимные сообщения:</b>\n"
+    if filters:
+        response += "🔎 " + ", ".join(f"{name}={escape(str(value))}" for name, value in filters.items()) + "\n"
+    response += "\n"
+
+    for message_id, username, sender_id, content_type, content_info, link_code, timestamp in rows:
+        try:
+            time = datetime.fromisoformat(timestamp).strftime("%d.%m %H:%M:%S")
+        except (TypeError, ValueError):
+            time = timestamp
+
+        username_display = f"@{escape(username)}" if username else f"ID:{sender_id}"
+        content_info = content_info or ""
+
+        response += f"🕒 <b>{time}</b> #{message_id}\n"
+        response += f"👤 <b>{username_display}</b> (ID: {sender_id})\n"
+        response += f"📁 <b>{escape(content_type.upper())}</b>\n"
+
+        if content_type == "text":
+            response += f"💬 {escape(content_info[:50])}"
+            if len(content_info) > 50:
+                response += "..."
+        else:
+            response += f"📄 {escape(content_info)}"
+
+        response += f"\n🔗 <code>{escape(link_code or '')}</code>\n"
+        response += "─" * 30 + "\n\n"
+
+    response += f"📊 Показано: {len(rows)}"
+    return response
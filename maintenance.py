@@ -0,0 +1,208 @@
+"""
+Обслуживание БД в фоне: срок хранения истории, сжатие старых текстов
+и incremental_vacuum
+Удаление идет небольшими пачками, между ними поток БД свободен для
+очереди отложенной записи и запросов обработчиков
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from metrics import MESSAGES_PRUNED, DB_BYTES_RECLAIMED
+
+logger = logging.getLogger(__name__)
+
+# Удаление и обрезка истории необратимы и затрагивают /logs, /search и /export,
+# поэтому по умолчанию выключены и включаются явно
+# Срок хранения истории в днях (0 - хранить всегда) и переопределения по типам: "sticker=30,text=180"
+MESSAGES_RETENTION_DAYS = float(os.getenv("MESSAGES_RETENTION_DAYS", 0))
+MESSAGES_RETENTION_BY_TYPE = os.getenv("MESSAGES_RETENTION_BY_TYPE", "")
+# Тексты старше MESSAGES_COMPACT_DAYS обрезаются до MESSAGES_COMPACT_LENGTH символов (0 - не обрезать)
+MESSAGES_COMPACT_DAYS = float(os.getenv("MESSAGES_COMPACT_DAYS", 0))
+MESSAGES_COMPACT_LENGTH = int(os.getenv("MESSAGES_COMPACT_LENGTH", 200))
+
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", 3600))
+MAINTENANCE_START_DELAY = float(os.getenv("MAINTENANCE_START_DELAY", 60))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", 500))
+MAINTENANCE_BATCH_PAUSE = float(os.getenv("MAINTENANCE_BATCH_PAUSE", 0.05))
+# Страниц за один шаг incremental_vacuum
+VACUUM_STEP_PAGES = int(os.getenv("VACUUM_STEP_PAGES", 256))
+# Разовый перевод существующей БД в auto_vacuum=INCREMENTAL полным VACUUM: он
+# блокирует поток БД на все время перезаписи, поэтому только по явному согласию
+VACUUM_CONVERT = os.getenv("VACUUM_CONVERT", "").lower() in ("1", "true", "yes")
+# Свободного места на диске для перевода должно быть не меньше размера БД × VACUUM_CONVERT_SPACE
+VACUUM_CONVERT_SPACE = float(os.getenv("VACUUM_CONVERT_SPACE", 2))
+
+
+def parse_retention(default_days: float, overrides: str) -> dict:
+    """Сроки хранения: {content_type: дни}, ключ None - для остальных типов"""
+    retention = {None: default_days}
+    for part in filter(None, (item.strip() for item in overrides.split(","))):
+        content_type, days = part.split("=")
+        retention[content_type.strip()] = float(days)
+    return retention
+
+
+class Maintenance:
+    """Периодическое обслуживание таблицы messages"""
+
+    def __init__(self, db, retention: dict = None, interval: float = MAINTENANCE_INTERVAL,
+                 batch_size: int = MAINTENANCE_BATCH_SIZE, batch_pause: float = MAINTENANCE_BATCH_PAUSE):
+        self.db = db
+        self.retention = retention or parse_retention(MESSAGES_RETENTION_DAYS, MESSAGES_RETENTION_BY_TYPE)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self._task = None
+        self.last_report = None
+        self._vacuum_hint_shown = False
+        # id, до которого тексты уже проверены сжатием: следующие проходы начинают с него
+        self._compacted_id = 0
+
+    async def _batched(self, operation, *args) -> int:
+        """Повтор операции пачками, пока она что-то меняет"""
+        total = 0
+        while True:
+            changed = await operation(*args, self.batch_size)
+            total += changed
+            if changed < self.batch_size:
+                return total
+            await asyncio.sleep(self.batch_pause)
+
+    async def prune(self, now: datetime = None) -> dict:
+        """Удаление сообщений старше срока хранения: {content_type: строк}"""
+        now = now or datetime.now()
+        pruned = {}
+
+        # Типы с собственным сроком, затем общий срок для всех остальных
+        overrides = tuple(content_type for content_type in self.retention if content_type)
+        for content_type in overrides:
+            days = self.retention[content_type]
+            if days > 0:
+                before = (now - timedelta(days=days)).isoformat()
+                pruned[content_type] = await self._batched(self.db.prune_messages, content_type, (), before)
+
+        default_days = self.retention.get(None, 0)
+        if default_days > 0:
+            before = (now - timedelta(days=default_days)).isoformat()
+            pruned["other"] = await self._batched(self.db.prune_messages, None, overrides, before)
+
+        for content_type, count in pruned.items():
+            if count:
+                MESSAGES_PRUNED.inc(content_type, value=count)
+        return {content_type: count for content_type, count in pruned.items() if count}
+
+    async def compact(self, now: datetime = None) -> int:
+        """Обрезка длинных старых текстов пачками по id, без повторного просмотра проверенных"""
+        if MESSAGES_COMPACT_DAYS <= 0 or MESSAGES_COMPACT_LENGTH <= 0:
+            return 0
+        before = ((now or datetime.now()) - timedelta(days=MESSAGES_COMPACT_DAYS)).isoformat()
+        total = 0
+        while True:
+            last_id, changed = await self.db.compact_messages(self._compacted_id, before,
+                                                              MESSAGES_COMPACT_LENGTH, self.batch_size)
+            total += changed
+            if last_id == self._compacted_id:
+                return total
+            self._compacted_id = last_id
+            await asyncio.sleep(self.batch_pause)
+
+    async def vacuum(self) -> int:
+        """incremental_vacuum шагами по VACUUM_STEP_PAGES страниц; возвращает освобожденные байты"""
+        before = await self.db.space_stats()
+        free_pages = before["free_bytes"] // before["page_size"]
+        while free_pages > 0:
+            remaining = await self.db.incremental_vacuum(VACUUM_STEP_PAGES)
+            if remaining >= free_pages:
+                break
+            free_pages = remaining
+            await asyncio.sleep(self.batch_pause)
+
+        after = await self.db.space_stats()
+        reclaimed = max(0, before["size_bytes"] - after["size_bytes"])
+        if reclaimed:
+            DB_BYTES_RECLAIMED.inc(value=reclaimed)
+        return reclaimed
+
+    async def convert_vacuum_mode(self) -> bool:
+        """Перевод старой БД в auto_vacuum=INCREMENTAL (только при VACUUM_CONVERT и хватающем месте)"""
+        stats = await self.db.space_stats()
+        # 2 - INCREMENTAL; у хранилища в памяти режима нет
+        if stats.get("auto_vacuum", 2) == 2:
+            return False
+
+        if not VACUUM_CONVERT:
+            if not self._vacuum_hint_shown:
+                self._vacuum_hint_shown = True
+                logger.info("💡 БД без auto_vacuum=INCREMENTAL: место от удаленных сообщений не возвращается "
+                            "диску. Для разового перевода (полный VACUUM, запись стоит до его конца) "
+                            "задайте VACUUM_CONVERT=1")
+            return False
+
+        needed = int(stats["size_bytes"] * VACUUM_CONVERT_SPACE)
+        if stats["disk_free_bytes"] < needed:
+            logger.warning(f"⚠️ Перевод БД в auto_vacuum=INCREMENTAL пропущен: свободно "
+                           f"{stats['disk_free_bytes'] // 1024} KB, нужно {needed // 1024} KB")
+            return False
+
+        logger.info(f"🗃️ Полный VACUUM для перевода в auto_vacuum=INCREMENTAL "
+                    f"({stats['size_bytes'] // 1024} KB), запись в БД ждет его окончания...")
+        started = time.perf_counter()
+        converted = await self.db.enable_incremental_vacuum()
+        if converted:
+            logger.info(f"🗃️ БД переведена в режим auto_vacuum=INCREMENTAL "
+                        f"({time.perf_counter() - started:.2f} сек)")
+        return converted
+
+    async def run_once(self) -> dict:
+        """Один проход обслуживания; отчет пишется в лог и в last_report"""
+        started = time.perf_counter()
+        await self.convert_vacuum_mode()
+
+        pruned = await self.prune()
+        compacted = await self.compact()
+        # Отметки «активен за день» нужны только для текущих суток
+        await self.db.prune_daily_users((datetime.now() - timedelta(days=1)).date().isoformat())
+        reclaimed = await self.vacuum()
+        stats = await self.db.space_stats()
+
+        self.last_report = {
+            "pruned": pruned,
+            "pruned_total": sum(pruned.values()),
+            "compacted": compacted,
+            "bytes_reclaimed": reclaimed,
+            "size_bytes": stats["size_bytes"],
+            "seconds": time.perf_counter() - started,
+        }
+        details = ", ".join(f"{content_type}: {count}" for content_type, count in pruned.items())
+        logger.info(f"🧹 Обслуживание БД: удалено {self.last_report['pruned_total']} сообщений"
+                    f"{f' ({details})' if details else ''}, "
+                    f"сжато {compacted}, освобождено {reclaimed // 1024} KB, "
+                    f"размер {stats['size_bytes'] // 1024} KB ({self.last_report['seconds']:.2f} сек)")
+        return self.last_report
+
+    async def _loop(self):
+        await asyncio.sleep(MAINTENANCE_START_DELAY)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обслуживания БД: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запуск фонового обслуживания"""
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
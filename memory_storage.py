@@ -0,0 +1,262 @@
+"""
+Хранилище бота в памяти процесса (STORAGE_BACKEND=memory)
+Та же семантика, что у storage.Storage (проверяется storage_contract.py),
+но без файла, очереди записи и потока БД: для тестов и бенчмарков.
+Выборки - перебором, поиск - по словам без ранжирования (новые сверху)
+"""
+
+import secrets
+import logging
+from collections import Counter
+from itertools import islice, takewhile
+from datetime import datetime, timedelta
+
+from repository import Repository, LOG_FILTER_COLUMNS, SEARCH_MARK_START, SEARCH_MARK_END, WORD_PATTERN, search_terms
+
+logger = logging.getLogger(__name__)
+
+# Порядок полей строки истории - как колонки таблицы messages
+ID, LINK_CODE, SENDER_ID, SENDER_USERNAME, CONTENT_TYPE, CONTENT_INFO, TIMESTAMP = range(7)
+COLUMN_INDEX = {"link_code": LINK_CODE, "sender_id": SENDER_ID, "content_type": CONTENT_TYPE}
+
+# Длина фрагмента в результатах поиска
+SNIPPET_LENGTH = 120
+
+
+def _matches(row: tuple, filters: dict) -> bool:
+    return all(row[COLUMN_INDEX[LOG_FILTER_COLUMNS[name]]] == value for name, value in filters.items())
+
+
+def _order_key(row: tuple):
+    return row[TIMESTAMP], row[ID]
+
+
+class MemoryStorage(Repository):
+    """Хранилище на словарях; данные пропадают при перезапуске"""
+
+    def __init__(self):
+        self.users = {}          # user_id -> (username, full_name, created_at)
+        self.links = {}          # link_code -> [user_id, created_at, is_active]
+        self.active_links = {}   # user_id -> активный link_code
+        self.messages = {}       # id -> строка истории (в порядке id)
+        self.fsm_states = {}     # key -> (state, data, updated_at)
+        self._next_id = 1
+
+        # Сводная статистика, как в таблицах stats_* (за все время)
+        self._users_total = 0
+        self._messages_total = 0
+        self._types = Counter()
+        self._links = Counter()
+        self._link_last_at = {}
+        self._hourly = Counter()
+        self._daily = Counter()
+        self._daily_users = {}   # day -> {user_id}, старые дни удаляет prune_daily_users
+        self._daily_active = Counter()
+
+    async def init(self):
+        logger.info("🗃️ Хранилище в памяти (данные не сохраняются между запусками)")
+
+    async def close(self):
+        pass
+
+    def _mark_active(self, day: str, user_id: int):
+        users = self._daily_users.setdefault(day, set())
+        if user_id not in users:
+            users.add(user_id)
+            self._daily_active[day] += 1
+
+    # Пользователи и ссылки
+    async def save_user(self, user_id: int, username: str, full_name: str):
+        created_at = datetime.now().isoformat()
+        if user_id not in self.users:
+            self._users_total += 1
+        self.users[user_id] = (username or '', full_name, created_at)
+        self._mark_active(created_at[:10], user_id)
+
+    def _new_link(self, user_id: int) -> str:
+        link_code = secrets.token_urlsafe(12)
+        self.links[link_code] = [user_id, datetime.now().isoformat(), True]
+        self.active_links[user_id] = link_code
+        return link_code
+
+    async def create_anon_link(self, user_id: int) -> str:
+        return self.active_links.get(user_id) or self._new_link(user_id)
+
+    async def get_link_owner(self, link_code: str):
+        link = self.links.get(link_code)
+        return link[0] if link and link[2] else None
+
+    async def deactivate_link(self, link_code: str):
+        link = self.links.get(link_code)
+        if link is not None:
+            link[2] = False
+            if self.active_links.get(link[0]) == link_code:
+                del self.active_links[link[0]]
+
+    async def rotate_link(self, user_id: int) -> str:
+        old_code = self.active_links.pop(user_id, None)
+        if old_code is not None:
+            self.links[old_code][2] = False
+        return self._new_link(user_id)
+
+    # История и логи
+    def _append(self, link_code: str, sender_id: int, sender_username: str, content_type: str,
+                content_info: str, timestamp: str):
+        row = (self._next_id, link_code, sender_id, sender_username or '', content_type, content_info, timestamp)
+        self.messages[self._next_id] = row
+        self._next_id += 1
+
+        self._messages_total += 1
+        self._types[content_type] += 1
+        self._links[link_code] += 1
+        self._link_last_at[link_code] = max(self._link_last_at.get(link_code, timestamp), timestamp)
+        self._hourly[timestamp[:13]] += 1
+        self._daily[timestamp[:10]] += 1
+        self._mark_active(timestamp[:10], sender_id)
+
+    async def save_message_history(self, link_code: str, sender_id: int, sender_username: str,
+                                   content_type: str, content_info: str):
+        self._append(link_code, sender_id, sender_username, content_type, content_info,
+                     datetime.now().isoformat())
+
+    async def save_message_history_many(self, link_code: str, sender_id: int, sender_username: str,
+                                        items: list):
+        timestamp = datetime.now().isoformat()
+        for content_type, content_info in items:
+            self._append(link_code, sender_id, sender_username, content_type, content_info, timestamp)
+
+    async def get_message_history(self, user_id: int):
+        link_code = self.active_links.get(user_id)
+        if link_code is None:
+            return []
+        rows = sorted((row for row in self.messages.values() if row[LINK_CODE] == link_code),
+                      key=lambda row: row[TIMESTAMP], reverse=True)[:50]
+        return [(row[SENDER_USERNAME], row[CONTENT_TYPE], row[CONTENT_INFO], row[TIMESTAMP]) for row in rows]
+
+    async def get_logs_page(self, filters: dict = None, cursor_id: int = None, direction: str = "older",
+                            limit: int = 20):
+        filters = filters or {}
+        older = direction == "older"
+        rows = [row for row in self.messages.values() if _matches(row, filters)]
+
+        if cursor_id is not None:
+            cursor = self.messages.get(cursor_id)
+            if cursor is not None:
+                key = _order_key(cursor)
+                rows = [row for row in rows if (_order_key(row) < key if older else _order_key(row) > key)]
+            else:
+                # Строка курсора удалена - как в SQLite, сравнение по id
+                rows = [row for row in rows if (row[ID] < cursor_id if older else row[ID] > cursor_id)]
+
+        rows.sort(key=_order_key, reverse=older)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not older:
+            rows.reverse()
+        return [(row[ID], row[SENDER_USERNAME], row[SENDER_ID], row[CONTENT_TYPE], row[CONTENT_INFO],
+                 row[LINK_CODE], row[TIMESTAMP]) for row in rows], has_more
+
+    def iter_messages(self, filters: dict = None, since: str = None, until: str = None,
+                      chunk_size: int = 1000):
+        # Снимок берется сразу, в потоке event loop: генератор читает его из другого потока
+        rows = sorted((row for row in self.messages.values()
+                       if _matches(row, filters or {})
+                       and (since is None or row[TIMESTAMP] >= since)
+                       and (until is None or row[TIMESTAMP] < until)), key=_order_key)
+        return self._chunks(rows, chunk_size)
+
+    @staticmethod
+    def _chunks(rows: list, chunk_size: int):
+        for start in range(0, len(rows), chunk_size):
+            yield [(row[ID], row[TIMESTAMP], row[LINK_CODE], row[SENDER_ID], row[SENDER_USERNAME],
+                    row[CONTENT_TYPE], row[CONTENT_INFO]) for row in rows[start:start + chunk_size]]
+
+    async def get_stats(self, days: int = 7, top_links: int = 5) -> dict:
+        now = datetime.now()
+        today = now.date().isoformat()
+        since_hour = (now - timedelta(hours=23)).isoformat()[:13]
+        daily_days = sorted((day for day in set(self._daily) | set(self._daily_active) if day <= today),
+                            reverse=True)[:days]
+        return {
+            "users": self._users_total,
+            "messages": self._messages_total,
+            "types": self._types.most_common(),
+            "daily": [(day, self._daily[day], self._daily_active[day]) for day in daily_days],
+            "last_24h": sum(count for hour, count in self._hourly.items() if hour >= since_hour),
+            "top_links": [(link_code, count, self._link_last_at[link_code])
+                          for link_code, count in self._links.most_common(top_links)],
+        }
+
+    async def search_messages(self, text: str, limit: int = 10, offset: int = 0):
+        # Слова запроса разбиваются так же, как текст (как токенизатор FTS5 разбирает фразу в кавычках)
+        terms = [(token, prefix) for word, prefix in search_terms(text)
+                 for token in WORD_PATTERN.findall(word.lower())]
+
+        def term_matches(token: str) -> bool:
+            return any(token.startswith(word) if prefix else token == word for word, prefix in terms)
+
+        found = []
+        for row in sorted(self.messages.values(), key=_order_key, reverse=True):
+            tokens = WORD_PATTERN.findall((row[CONTENT_INFO] or "").lower())
+            if all(any(token.startswith(word) if prefix else token == word for token in tokens)
+                   for word, prefix in terms):
+                found.append(row)
+            if len(found) > offset + limit:
+                break
+
+        page = []
+        for row in found[offset:offset + limit]:
+            content = row[CONTENT_INFO] or ""
+            first = next((match.start() for match in WORD_PATTERN.finditer(content)
+                          if term_matches(match.group().lower())), 0)
+            start = max(0, first - SNIPPET_LENGTH // 3)
+            window = content[start:start + SNIPPET_LENGTH]
+            snippet = WORD_PATTERN.sub(
+                lambda match: (SEARCH_MARK_START + match.group() + SEARCH_MARK_END
+                               if term_matches(match.group().lower()) else match.group()), window)
+            snippet = ("…" if start else "") + snippet + ("…" if start + SNIPPET_LENGTH < len(content) else "")
+            page.append((row[ID], row[SENDER_USERNAME], row[SENDER_ID], row[CONTENT_TYPE], snippet,
+                         row[LINK_CODE], row[TIMESTAMP]))
+        return page, len(found) > offset + limit
+
+    # Состояния FSM
+    async def fsm_load(self, key: str):
+        return self.fsm_states.get(key)
+
+    async def fsm_save(self, key: str, state, data: str, updated_at: float):
+        self.fsm_states[key] = (state, data, updated_at)
+
+    async def fsm_delete(self, key: str):
+        self.fsm_states.pop(key, None)
+
+    async def fsm_expire(self, before: float) -> int:
+        expired = [key for key, (_, _, updated_at) in self.fsm_states.items() if updated_at < before]
+        for key in expired:
+            del self.fsm_states[key]
+        return len(expired)
+
+    async def fsm_count(self) -> int:
+        return len(self.fsm_states)
+
+    # Обслуживание истории
+    async def prune_messages(self, content_type, exclude: tuple, before: str, limit: int) -> int:
+        expired = [row[ID] for row in self.messages.values()
+                   if row[TIMESTAMP] < before
+                   and (row[CONTENT_TYPE] == content_type if content_type is not None
+                        else row[CONTENT_TYPE] not in exclude)][:limit]
+        for message_id in expired:
+            del self.messages[message_id]
+        return len(expired)
+
+    async def compact_messages(self, after_id: int, before: str, max_length: int, limit: int) -> tuple:
+        window = list(islice((row for row in self.messages.values() if row[ID] > after_id), limit))
+        old_rows = list(takewhile(lambda row: row[TIMESTAMP] < before, window))
+        long_rows = [row for row in old_rows
+                     if row[CONTENT_TYPE] == "text" and len(row[CONTENT_INFO] or "") > max_length]
+        for row in long_rows:
+            self.messages[row[ID]] = row[:CONTENT_INFO] + (row[CONTENT_INFO][:max_length],) + row[CONTENT_INFO + 1:]
+        return (old_rows[-1][ID] if old_rows else after_id), len(long_rows)
+
+    async def prune_daily_users(self, before_day: str) -> int:
+        old_days = [day for day in self._daily_users if day < before_day]
+        return sum(len(self._daily_users.pop(day)) for day in old_days)
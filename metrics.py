@@ -0,0 +1,250 @@
+"""
+Метрики в формате Prometheus (text exposition) без внешних зависимостей
+Запись - несколько операций со словарем и bisect, поэтому метрики
+можно держать включенными в продакшене
+"""
+
+import time
+import asyncio
+import inspect
+import logging
+from bisect import bisect_left
+from functools import wraps
+
+from aiogram import BaseMiddleware
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Счетчик с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, *labels, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram:
+    """Гистограмма длительностей с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._children = {}
+
+    def labels(self, *labels) -> _HistogramChild:
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = _HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value: float, *labels):
+        self.labels(*labels).observe(value)
+
+    def total(self) -> tuple:
+        """Суммарные (время, количество) по всем меткам"""
+        return (sum(child.sum for child in self._children.values()),
+                sum(child.count for child in self._children.values()))
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {child.sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {child.count}")
+        return lines
+
+
+class Gauge:
+    """Значение, вычисляемое при каждом запросе /metrics
+
+    Функция возвращает число или словарь {метки: число};
+    может быть корутиной
+    """
+
+    def __init__(self, name: str, documentation: str, func, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labelnames = labelnames
+
+    async def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.func()
+            if inspect.isawaitable(value):
+                value = await value
+        except Exception:
+            return lines
+
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, item in values.items():
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {item}")
+        return lines
+
+
+class Registry:
+    """Реестр метрик процесса"""
+
+    def __init__(self, prefix: str = "anon_bot"):
+        self.prefix = prefix
+        self._metrics = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(f"{self.prefix}_{name}", documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(f"{self.prefix}_{name}", documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, func, labelnames: tuple = ()) -> Gauge:
+        return self._add(Gauge(f"{self.prefix}_{name}", documentation, func, labelnames))
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            if isinstance(metric, Gauge):
+                lines.extend(await metric.render())
+            else:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+UPDATES = registry.counter("updates_total", "Обработанные обновления по типу содержимого", ("type",))
+UPDATE_ERRORS = registry.counter("update_errors_total", "Обновления, завершившиеся исключением", ("type",))
+UPDATE_LATENCY = registry.histogram("update_duration_seconds", "Полное время обработки обновления")
+HANDLER_LATENCY = registry.histogram("handler_duration_seconds", "Время обработчиков сообщений", ("handler",))
+DB_LATENCY = registry.histogram("db_duration_seconds", "Время операций с БД", ("operation",))
+TELEGRAM_LATENCY = registry.histogram("telegram_request_duration_seconds",
+                                      "Время запросов к Telegram Bot API", ("method",))
+TELEGRAM_ERRORS = registry.counter("telegram_request_errors_total",
+                                   "Ошибки запросов к Telegram Bot API", ("method",))
+MESSAGES_PRUNED = registry.counter("messages_pruned_total", "Сообщения, удаленные по сроку хранения", ("type",))
+DB_BYTES_RECLAIMED = registry.counter("db_bytes_reclaimed_total", "Байты, возвращенные incremental_vacuum")
+FLOOD_THROTTLED = registry.counter("flood_throttled_total", "Обновления, отброшенные антифлудом", ("scope",))
+DEDUP_DROPPED = registry.counter("dedup_dropped_total", "Повторы, не доставленные получателю", ("type",))
+LOG_ERRORS = registry.counter("log_errors_total", "Записи лога уровня ERROR и выше", ("logger",))
+UPDATES_RECOVERED = registry.counter("updates_recovered_total",
+                                     "Обновления, отправленные до запуска процесса (накопились за время простоя)")
+
+# Время запуска процесса: сообщения с более ранней датой ждали в очереди Telegram.
+# Модуль импортируется через несколько секунд после старта (вместе с aiogram),
+# поэтому webhook.py и run_local.py подставляют время, записанное до импортов
+PROCESS_STARTED_AT = time.time()
+
+
+def timed(histogram: Histogram, name: str = None):
+    """Декоратор: длительность вызова в гистограмму с меткой = имя функции"""
+
+    def decorator(func):
+        child = histogram.labels(name or func.__name__)
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - started)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+
+    return decorator
+
+
+class ErrorCountingHandler(logging.Handler):
+    """Считает записи уровня ERROR по логгерам (ошибки, перехваченные в обработчиках)"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record: logging.LogRecord):
+        LOG_ERRORS.inc(record.name)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: счетчик по типу содержимого и общее время"""
+
+    async def __call__(self, handler, event, data):
+        if event.message is not None:
+            content_type = event.message.content_type
+            update_type = getattr(content_type, "value", content_type)
+        else:
+            update_type = event.event_type
+
+        UPDATES.inc(update_type)
+        date = getattr(event.event, "date", None)
+        # Дата в Telegram - целые секунды: сравниваем с началом секунды запуска
+        if date is not None and date.timestamp() < int(PROCESS_STARTED_AT):
+            UPDATES_RECOVERED.inc()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            UPDATE_ERRORS.inc(update_type)
+            raise
+        finally:
+            UPDATE_LATENCY.observe(time.perf_counter() - started)
+
+
+def setup_metrics(dp):
+    """Подключение метрик к диспетчеру и корневому логгеру"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    logging.getLogger().addHandler(ErrorCountingHandler())
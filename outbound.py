@@ -0,0 +1,264 @@
+"""
+Планировщик исходящих запросов к Telegram
+Все send_* проходят через middleware сессии бота и ждут токен
+из глобального бакета и бакета конкретного чата
+"""
+
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import TELEGRAM_LATENCY, TELEGRAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений/сек всего и ~1 сообщение/сек в один чат
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 30))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", 1))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", 3))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 3))
+
+# Приоритеты: меньше - раньше
+PRIORITY_INTERACTIVE = 0  # ответы отправителю, кнопки, подтверждения
+PRIORITY_BULK = 1         # доставка анонимных сообщений получателю
+
+send_priority = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def bulk_priority():
+    """Запросы внутри блока идут с пониженным приоритетом"""
+    token = send_priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    """Бакет токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до следующего токена"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Пауза после RetryAfter: токены обнуляются до конца паузы"""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    def is_idle(self, now: float) -> bool:
+        return now >= self.paused_until and self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+class OutboundScheduler:
+    """Очередь ожидающих отправки с приоритетами и бакетами"""
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE,
+                 chat_rate: float = OUTBOUND_CHAT_RATE,
+                 chat_burst: float = OUTBOUND_CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._chat_buckets = {}
+        self._waiters = []
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+        # Метрики
+        self.granted = 0
+        self.retry_after_count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def setup(self, bot):
+        """Подключение планировщика к сессии бота"""
+        bot.session.middleware(OutboundMiddleware(self))
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id, priority: int = PRIORITY_INTERACTIVE):
+        """Ожидание разрешения на отправку в чат"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        self._waiters.append((priority, self._seq, chat_id, future, time.monotonic()))
+        self._wakeup.set()
+        await future
+
+    def pause(self, chat_id, seconds: float):
+        """Пауза бакета после RetryAfter (без chat_id - глобальная)"""
+        self.retry_after_count += 1
+        bucket = self.global_bucket if chat_id is None else self._chat_bucket(chat_id)
+        bucket.pause(seconds)
+        logger.warning(f"⚠️ RetryAfter: пауза {seconds} сек для {chat_id or 'всех чатов'}")
+
+    def _grant(self, now: float):
+        """Выдача токена первому по приоритету ожидающему с готовым бакетом чата"""
+        nearest = None
+        self._waiters.sort(key=lambda waiter: (waiter[0], waiter[1]))
+
+        for index, (priority, seq, chat_id, future, enqueued_at) in enumerate(self._waiters):
+            if future.done():
+                continue
+            chat_delay = self._chat_bucket(chat_id).delay(now)
+            if chat_delay == 0:
+                self.global_bucket.take(now)
+                self._chat_bucket(chat_id).take(now)
+                del self._waiters[index]
+
+                waited = now - enqueued_at
+                self.granted += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                future.set_result(None)
+                return 0.0
+            nearest = chat_delay if nearest is None else min(nearest, chat_delay)
+
+        return nearest
+
+    def _sweep(self, now: float):
+        # Отмененные ожидания и простаивающие бакеты чатов
+        self._waiters = [waiter for waiter in self._waiters if not waiter[3].done()]
+        if not self._waiters:
+            for chat_id in [c for c, b in self._chat_buckets.items() if b.is_idle(now)]:
+                del self._chat_buckets[chat_id]
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._sweep(now)
+
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            global_delay = self.global_bucket.delay(now)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            delay = self._grant(now)
+            if delay:
+                # Все чаты в очереди исчерпали лимит - ждем ближайший токен или новую заявку
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            elif delay is None:
+                await asyncio.sleep(0)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "granted": self.granted,
+            "retry_after": self.retry_after_count,
+            "avg_wait": self.total_wait / self.granted if self.granted else 0.0,
+            "max_wait": self.max_wait,
+            "chats": len(self._chat_buckets),
+        }
+
+    async def drain(self, timeout: float = None) -> bool:
+        """Ожидание выдачи разрешений всей очереди; False, если не успели за timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while any(not waiter[3].done() for waiter in self._waiters):
+            if deadline is not None and loop.time() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Оставшиеся в очереди получают ошибку, а не ждут вечно
+        for priority, seq, chat_id, future, enqueued_at in self._waiters:
+            if not future.done():
+                future.set_exception(RuntimeError("Планировщик исходящих запросов остановлен"))
+        self._waiters.clear()
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """Middleware сессии: лимиты на отправку и повтор после RetryAfter"""
+
+    def __init__(self, scheduler: OutboundScheduler, max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+
+    async def _timed_request(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            TELEGRAM_ERRORS.inc(name)
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, name)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            # getMe, setWebhook, answerCallbackQuery и т.п. не ограничиваются по чатам
+            if chat_id is not None:
+                await self.scheduler.acquire(chat_id, send_priority.get())
+            try:
+                return await self._timed_request(make_request, bot, method)
+            except TelegramRetryAfter as e:
+                # RetryAfter без чата - ограничение на весь бот: пауза глобального бакета
+                self.scheduler.pause(chat_id, e.retry_after)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                if chat_id is None:
+                    # Запрос без чата не ждет токена - паузу выдерживаем сами
+                    await asyncio.sleep(e.retry_after)
@@ -0,0 +1,158 @@
+"""
+Polling с параллельной обработкой разных чатов
+Обновления одного чата обрабатываются строго по порядку (KeyedWorkerPool).
+getUpdates с offset подтверждает все обновления до него, поэтому offset
+сдвигается только до первого необработанного: принятое, но не обработанное
+к остановке Telegram вернет после перезапуска.
+
+Предел: заглянуть дальше первого необработанного, не подтвердив его, нельзя,
+а getUpdates отдает не больше POLLING_BATCH_SIZE (у Telegram - до 100)
+обновлений. Пока одно обновление обрабатывается, остальные чаты получают
+не больше этого окна, поэтому долгие задачи (выгрузка /export) выполняются
+отдельно от обработчиков обновлений
+"""
+
+import os
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from workers import KeyedWorkerPool
+
+logger = logging.getLogger(__name__)
+
+POLLING_CONCURRENCY = int(os.getenv("POLLING_CONCURRENCY", 16))
+POLLING_QUEUE_SIZE = int(os.getenv("POLLING_QUEUE_SIZE", 500))
+POLLING_BATCH_SIZE = int(os.getenv("POLLING_BATCH_SIZE", 100))
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", 30))
+POLLING_DRAIN_TIMEOUT = float(os.getenv("POLLING_DRAIN_TIMEOUT", 20))
+POLLING_REPORT_INTERVAL = float(os.getenv("POLLING_REPORT_INTERVAL", 60))
+# Как часто проверять новые обновления, пока первое необработанное не сдвигается
+POLLING_RECHECK_INTERVAL = float(os.getenv("POLLING_RECHECK_INTERVAL", 1))
+
+
+def update_key(update: Update):
+    """Ключ очереди: ID чата, иначе ID пользователя"""
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    if user is not None:
+        return user.id
+    return update.update_id
+
+
+class ConcurrentPoller:
+    """getUpdates + пул обработки с порядком внутри чата"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot,
+                 concurrency: int = POLLING_CONCURRENCY,
+                 max_pending: int = POLLING_QUEUE_SIZE,
+                 batch_size: int = POLLING_BATCH_SIZE,
+                 poll_timeout: int = POLLING_TIMEOUT):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.pool = KeyedWorkerPool(concurrency=concurrency, max_pending=max_pending)
+        self.received = 0
+        # update_id принятых, но еще не обработанных обновлений
+        self._unfinished = set()
+        self._last_id = None
+        self._advanced = asyncio.Event()
+
+    def stats(self) -> dict:
+        return {"received": self.received, **self.pool.stats()}
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(POLLING_REPORT_INTERVAL)
+            stats = self.stats()
+            logger.info(f"📊 Polling: получено {stats['received']}, в обработке {stats['in_flight']}, "
+                        f"в очереди {stats['pending']}, чатов {stats['chats']}")
+
+    @property
+    def offset(self):
+        """Первое необработанное обновление: все до него можно подтверждать"""
+        if self._unfinished:
+            return min(self._unfinished)
+        return None if self._last_id is None else self._last_id + 1
+
+    async def _feed(self, update: Update):
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        finally:
+            head = update.update_id == min(self._unfinished)
+            self._unfinished.discard(update.update_id)
+            if head:
+                self._advanced.set()
+
+    async def _confirm_offset(self):
+        """Подтверждение обработанных обновлений: иначе после перезапуска придут повторно"""
+        offset = self.offset
+        if offset is None:
+            return
+        try:
+            await self.bot.get_updates(offset=offset, limit=1, timeout=0)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось подтвердить обработанные обновления: {e}")
+
+    async def run(self, allowed_updates=None):
+        """Цикл получения обновлений до отмены задачи"""
+        workflow_data = {"dispatcher": self.dispatcher, "bots": [self.bot], "bot": self.bot}
+        await self.dispatcher.emit_startup(**workflow_data)
+        reporter = asyncio.create_task(self._report_loop())
+        backoff = 1
+
+        logger.info(f"🔄 Polling: параллельность {self.pool.concurrency}, "
+                    f"пачка {self.batch_size}, таймаут {self.poll_timeout} сек")
+        try:
+            while True:
+                offset = self.offset
+                try:
+                    updates = await self.bot.get_updates(
+                        offset=offset,
+                        limit=self.batch_size,
+                        timeout=self.poll_timeout,
+                        allowed_updates=allowed_updates,
+                        request_timeout=self.poll_timeout + 10,
+                    )
+                    backoff = 1
+                except Exception as e:
+                    logger.error(f"❌ Ошибка getUpdates: {e}, повтор через {backoff} сек")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+                    continue
+
+                # offset стоит на первом необработанном, поэтому Telegram возвращает и уже
+                # принятые обновления: они пропускаются, а в обработке одновременно
+                # оказывается не больше пачки обновлений от первого необработанного (см. предел выше)
+                last_id = -1 if self._last_id is None else self._last_id
+                fresh = [update for update in updates if update.update_id > last_id]
+                for update in fresh:
+                    self._last_id = update.update_id
+                    self._unfinished.add(update.update_id)
+                    self.received += 1
+                    # Ждем место в очереди, чтобы не набирать обновления быстрее, чем успеваем
+                    await self.pool.submit_wait(update_key(update), lambda u=update: self._feed(u))
+
+                if len(fresh) < len(updates) and self.offset == offset:
+                    # Пачка начинается с необработанных - следующий запрос вернет их же.
+                    # Ждем, пока сдвинется первое, но не дольше POLLING_RECHECK_INTERVAL:
+                    # новые обновления в пределах окна не ждут долгое обновление
+                    self._advanced.clear()
+                    try:
+                        await asyncio.wait_for(self._advanced.wait(), POLLING_RECHECK_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            reporter.cancel()
+            if not await self.pool.drain(POLLING_DRAIN_TIMEOUT):
+                # Подтверждаются только обработанные: остальные Telegram вернет после перезапуска
+                logger.warning(f"⚠️ Не дождались обработки {self.pool.pending} обновлений")
+            await self._confirm_offset()
+            await self.dispatcher.emit_shutdown(**workflow_data)
+            logger.info(f"📊 Polling остановлен: {self.stats()}")
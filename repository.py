@@ -0,0 +1,206 @@
+"""
+Интерфейс хранилища бота и выбор реализации
+Обработчики работают только с Repository, реализация выбирается
+переменной STORAGE_BACKEND:
+
+- sqlite - storage.Storage (по умолчанию): файл БД, очередь отложенной записи,
+  сводная статистика и FTS5
+- memory - memory_storage.MemoryStorage: все в памяти процесса, для тестов
+  и бенчмарков; данные пропадают при перезапуске
+
+Поведение, общее для реализаций, проверяет storage_contract.py
+"""
+
+import os
+import re
+from abc import ABC, abstractmethod
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+
+# Границы совпадений во фрагментах поиска (заменяются на разметку после экранирования)
+SEARCH_MARK_START = "\x02"
+SEARCH_MARK_END = "\x03"
+
+# Фильтры /logs и выгрузки -> колонки messages
+LOG_FILTER_COLUMNS = {"link_code": "link_code", "sender_id": "sender_id", "content_type": "content_type"}
+
+
+def search_terms(text: str) -> list:
+    """Слова запроса: [(слово, по префиксу)]; ValueError для пустого запроса"""
+    terms = []
+    for word in (text or "").split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append((word, prefix))
+    if not terms:
+        raise ValueError(text)
+    return terms
+
+
+def build_match(text: str) -> str:
+    """Выражение MATCH FTS5: все слова обязательны, «слово*» - поиск по префиксу
+
+    Каждое слово берется в кавычки, поэтому синтаксис FTS5 (OR, NEAR, скобки)
+    в запросе не интерпретируется
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' + ("*" if prefix else "")
+                    for word, prefix in search_terms(text))
+
+
+# Слово для поиска без FTS5 - как в токенизаторе unicode61 (буквы и цифры)
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class Repository(ABC):
+    """Хранилище бота: пользователи, ссылки, история сообщений, логи и состояния FSM
+
+    Строки истории - кортежи в порядке колонок messages; методы обслуживания
+    с реализацией по умолчанию нужны только хранилищам с файлом на диске
+    """
+
+    # Жизненный цикл
+    @abstractmethod
+    async def init(self):
+        """Подготовка хранилища (для БД - подключение и миграции)"""
+
+    @abstractmethod
+    async def close(self):
+        """Запись отложенных данных и освобождение ресурсов"""
+
+    async def flush(self):
+        """Запись данных, ожидающих в очереди"""
+
+    @property
+    def write_queue_depth(self) -> int:
+        """Строки, ожидающие записи"""
+        return 0
+
+    @property
+    def link_cache_entries(self) -> int:
+        """Записи кэша владельцев ссылок"""
+        return 0
+
+    # Пользователи и ссылки
+    @abstractmethod
+    async def save_user(self, user_id: int, username: str, full_name: str):
+        """Сохранение пользователя"""
+
+    @abstractmethod
+    async def create_anon_link(self, user_id: int) -> str:
+        """Активная ссылка пользователя (создается при первом вызове)"""
+
+    @abstractmethod
+    async def get_link_owner(self, link_code: str):
+        """ID владельца активной ссылки или None"""
+
+    @abstractmethod
+    async def deactivate_link(self, link_code: str):
+        """Деактивация ссылки"""
+
+    @abstractmethod
+    async def rotate_link(self, user_id: int) -> str:
+        """Деактивация текущих ссылок пользователя и выдача новой"""
+
+    # История и логи
+    @abstractmethod
+    async def save_message_history(self, link_code: str, sender_id: int, sender_username: str,
+                                   content_type: str, content_info: str):
+        """Сохранение сообщения в историю"""
+
+    @abstractmethod
+    async def save_message_history_many(self, link_code: str, sender_id: int, sender_username: str,
+                                        items: list):
+        """Сохранение нескольких сообщений (альбома); items - [(content_type, content_info)]"""
+
+    @abstractmethod
+    async def get_message_history(self, user_id: int):
+        """Последние 50 сообщений по активной ссылке: [(username, content_type, content_info, timestamp)]"""
+
+    @abstractmethod
+    async def get_logs_page(self, filters: dict = None, cursor_id: int = None, direction: str = "older",
+                            limit: int = 20):
+        """Страница логов (новые сверху) и признак наличия следующей в направлении direction;
+        строки - (id, username, sender_id, content_type, content_info, link_code, timestamp)"""
+
+    @abstractmethod
+    def iter_messages(self, filters: dict = None, since: str = None, until: str = None,
+                      chunk_size: int = 1000):
+        """Генератор пачек истории от старых к новым для выгрузки (вызывается из отдельного потока);
+        строки - (id, timestamp, link_code, sender_id, sender_username, content_type, content_info)"""
+
+    @abstractmethod
+    async def get_stats(self, days: int = 7, top_links: int = 5) -> dict:
+        """Статистика для /stats: users, messages, last_24h, types, daily, top_links"""
+
+    @abstractmethod
+    async def search_messages(self, text: str, limit: int = 10, offset: int = 0):
+        """Поиск по тексту админа (см. search_terms): (строки, есть ли еще);
+        строки - (id, username, sender_id, content_type, фрагмент, link_code, timestamp)"""
+
+    async def fts_backfill(self, limit: int) -> int:
+        """Индексация пачки старой истории для поиска"""
+        return 0
+
+    async def fts_backfill_progress(self):
+        """(done, until) фоновой индексации"""
+        return 0, 0
+
+    # Состояния FSM
+    @abstractmethod
+    async def fsm_load(self, key: str):
+        """(state, data_json, updated_at) или None"""
+
+    @abstractmethod
+    async def fsm_save(self, key: str, state, data: str, updated_at: float):
+        """Сохранение состояния FSM"""
+
+    @abstractmethod
+    async def fsm_delete(self, key: str):
+        """Удаление состояния FSM"""
+
+    @abstractmethod
+    async def fsm_expire(self, before: float) -> int:
+        """Удаление состояний, не менявшихся с момента before"""
+
+    @abstractmethod
+    async def fsm_count(self) -> int:
+        """Количество сохраненных состояний"""
+
+    # Обслуживание истории
+    @abstractmethod
+    async def prune_messages(self, content_type, exclude: tuple, before: str, limit: int) -> int:
+        """Удаление до limit сообщений старше before: одного типа или всех, кроме exclude"""
+
+    @abstractmethod
+    async def compact_messages(self, after_id: int, before: str, max_length: int, limit: int) -> tuple:
+        """Обрезка длинных текстов до max_length символов среди следующих limit строк после after_id
+
+        Просматриваются только строки старше before (id растут вместе со временем).
+        Возвращает (последний просмотренный id, обрезано строк); id == after_id - дальше нет старых строк
+        """
+
+    async def prune_daily_users(self, before_day: str) -> int:
+        return 0
+
+    async def space_stats(self) -> dict:
+        """Размер хранилища и объем свободных страниц"""
+        return {"size_bytes": 0, "free_bytes": 0, "page_size": 1}
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        return 0
+
+    async def enable_incremental_vacuum(self) -> bool:
+        return False
+
+
+def create_repository(backend: str = None, **kwargs) -> Repository:
+    """Хранилище по имени реализации (по умолчанию - STORAGE_BACKEND)"""
+    backend = backend or STORAGE_BACKEND
+    if backend == "sqlite":
+        from storage import Storage
+        return Storage(**kwargs)
+    if backend == "memory":
+        from memory_storage import MemoryStorage
+        return MemoryStorage(**kwargs)
+    raise ValueError(f"Неизвестное хранилище: {backend}")
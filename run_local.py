@@ -4,6 +4,11 @@
 Используется для разработки и тестирования
 """
 
+import time
+
+# Время запуска - до импорта aiogram (см. metrics.PROCESS_STARTED_AT)
+STARTED_AT_TIME = time.time()
+
 import os
 import sys
 import logging
@@ -15,11 +20,10 @@ from aiogram.fsm.storage.memory import MemoryStorage
 # Добавляем текущую директорию в путь
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from logging_setup import setup_logging
+
+# Настройка логирования (запись через очередь в фоновом потоке)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -42,10 +46,13 @@ async def main():
     logger.info("🚀 Локальный запуск анонимного Telegram бота...")
 
     # Импортируем после загрузки переменных окружения
-    from anon_bot import dp, init_db, bot
+    from anon_bot import dp, init_db, close_db, bot, bot_identity, outbound, albums, duplicates
+    from polling import ConcurrentPoller, POLLING_DRAIN_TIMEOUT
+    import metrics
+    metrics.PROCESS_STARTED_AT = STARTED_AT_TIME
 
     # Инициализируем БД
-    if init_db():
+    if await init_db():
         logger.info("✅ База данных инициализирована")
     else:
         logger.error("❌ Ошибка инициализации БД")
@@ -55,6 +62,9 @@ async def main():
         await bot.set_my_commands([
             BotCommand(command="start", description="Запустить бота"),
             BotCommand(command="logs", description="Посмотреть логи (админ)"),
+            BotCommand(command="stats", description="Статистика (админ)"),
+            BotCommand(command="search", description="Поиск по истории (админ)"),
+            BotCommand(command="export", description="Выгрузка истории (админ)"),
         ])
         logger.info("✅ Команды бота установлены")
     except Exception as e:
@@ -62,7 +72,8 @@ async def main():
 
     # Получаем информацию о боте
     try:
-        bot_info = await bot.get_me()
+        bot_info = await bot_identity.refresh(bot)
+        bot_identity.start_refresh(bot)
         logger.info(f"🤖 Бот запущен: @{bot_info.username} (ID: {bot_info.id})")
 
         # Проверяем админа
@@ -86,14 +97,25 @@ async def main():
     logger.info("🔄 Запускаем polling... (Ctrl+C для остановки)")
 
     try:
-        # Удаляем вебхук если был установлен
-        await bot.delete_webhook(drop_pending_updates=True)
-
-        # Запускаем polling
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        # Удаляем вебхук если был установлен; накопившиеся обновления придут через getUpdates
+        webhook_info = await bot.get_webhook_info()
+        if webhook_info.pending_update_count:
+            logger.info(f"📥 Накопилось обновлений за время простоя: {webhook_info.pending_update_count}")
+        await bot.delete_webhook(drop_pending_updates=False)
+
+        # Запускаем polling: разные чаты параллельно, один чат - по порядку
+        poller = ConcurrentPoller(dp, bot)
+        await poller.run(allowed_updates=dp.resolve_used_update_types())
     except Exception as e:
         logger.error(f"❌ Ошибка при запуске polling: {e}")
     finally:
+        await bot_identity.stop()
+        await albums.stop()
+        await duplicates.stop()
+        if not await outbound.drain(POLLING_DRAIN_TIMEOUT):
+            logger.warning(f"⚠️ Не успели отправить {outbound.queue_depth} запросов")
+        await outbound.stop()
+        await close_db()
         await bot.session.close()
         logger.info("🛑 Бот остановлен")
 
@@ -0,0 +1,125 @@
+"""
+Полнотекстовый поиск по истории для админа (/search)
+Новые сообщения попадают в индекс messages_fts триггерами, а история,
+накопленная до миграции 6, индексируется в фоне небольшими пачками
+"""
+
+import os
+import time
+import asyncio
+import logging
+from html import escape
+from datetime import datetime
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from repository import SEARCH_MARK_START, SEARCH_MARK_END
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 10))
+FTS_BACKFILL_BATCH = int(os.getenv("FTS_BACKFILL_BATCH", 2000))
+FTS_BACKFILL_PAUSE = float(os.getenv("FTS_BACKFILL_PAUSE", 0.05))
+
+
+class SearchPage(CallbackData, prefix="srch"):
+    """Кнопка навигации по результатам; запрос целиком в callback_data (до 64 байт)"""
+    o: int        # смещение
+    q: str        # текст запроса
+
+
+def search_keyboard(query: str, offset: int, has_more: bool):
+    """Кнопки «Назад»/«Дальше» (None, если листать некуда или запрос не помещается)"""
+    buttons = []
+    try:
+        if offset > 0:
+            buttons.append(InlineKeyboardButton(
+                text="⬅️ Назад",
+                callback_data=SearchPage(o=max(0, offset - SEARCH_PAGE_SIZE), q=query).pack()))
+        if has_more:
+            buttons.append(InlineKeyboardButton(
+                text="Дальше ➡️",
+                callback_data=SearchPage(o=offset + SEARCH_PAGE_SIZE, q=query).pack()))
+    except ValueError:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+def highlight(snippet: str) -> str:
+    """Экранирование фрагмента и выделение совпадений жирным"""
+    return (escape(snippet or "")
+            .replace(SEARCH_MARK_START, "<b>")
+            .replace(SEARCH_MARK_END, "</b>"))
+
+
+def render_search_page(rows: list, query: str, offset: int, progress: tuple = None) -> str:
+    """HTML-текст страницы; rows - (id, username, sender_id, content_type, фрагмент, link_code, timestamp)"""
+    response = f"🔎 <b>Поиск:</b> {escape(query)}\n"
+    done, until = progress or (0, 0)
+    if done < until:
+        response += f"⏳ Старая история проиндексирована на {done * 100 // until}%\n"
+    response += "\n"
+
+    for number, (message_id, username, sender_id, content_type, snippet, link_code, timestamp) \
+            in enumerate(rows, start=offset + 1):
+        try:
+            time_display = datetime.fromisoformat(timestamp).strftime("%d.%m.%Y %H:%M")
+        except (TypeError, ValueError):
+            time_display = timestamp
+
+        username_display = f"@{escape(username)}" if username else f"ID:{sender_id}"
+        response += f"{number}. 🕒 {time_display} #{message_id} · {escape(content_type or '')}\n"
+        response += f"👤 {username_display} (ID: {sender_id}) 🔗 <code>{escape(link_code or '')}</code>\n"
+        response += f"💬 {highlight(snippet)}\n\n"
+
+    if not rows:
+        response += "📭 Ничего не найдено."
+    return response
+
+
+class SearchBackfill:
+    """Фоновая индексация истории, накопленной до появления поиска"""
+
+    def __init__(self, db, batch_size: int = FTS_BACKFILL_BATCH, pause: float = FTS_BACKFILL_PAUSE):
+        self.db = db
+        self.batch_size = batch_size
+        self.pause = pause
+        self.indexed = 0
+        self._task = None
+
+    async def run(self):
+        started = time.perf_counter()
+        done, until = await self.db.fts_backfill_progress()
+        if done >= until:
+            return
+
+        logger.info(f"🔎 Индексация истории для поиска: {until - done} сообщений")
+        while True:
+            count = await self.db.fts_backfill(self.batch_size)
+            self.indexed += count
+            if count < self.batch_size:
+                break
+            # Пауза освобождает поток БД для обработчиков и очереди записи
+            await asyncio.sleep(self.pause)
+        logger.info(f"🔎 Индексация истории завершена: {self.indexed} сообщений "
+                    f"({time.perf_counter() - started:.1f} сек)")
+
+    async def _run_safe(self):
+        try:
+            await self.run()
+        except Exception as e:
+            logger.error(f"❌ Ошибка индексации истории для поиска: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_safe())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,30 @@
+"""
+Текст /stats для админа по сводным таблицам хранилища
+"""
+
+from html import escape
+
+
+def render_stats(stats: dict) -> str:
+    """HTML-текст статистики из Repository.get_stats()"""
+    response = "📊 <b>Статистика бота</b>\n\n"
+    response += f"👥 Пользователей: <b>{stats['users']}</b>\n"
+    response += f"✉️ Сообщений всего: <b>{stats['messages']}</b>\n"
+    response += f"⏱ За последние 24 часа: <b>{stats['last_24h']}</b>\n"
+
+    if stats["daily"]:
+        response += "\n📅 <b>По дням:</b>\n"
+        for day, messages, active_users in stats["daily"]:
+            response += f"{day}: {messages} сообщ., {active_users} активных\n"
+
+    if stats["types"]:
+        response += "\n📁 <b>По типам:</b>\n"
+        for content_type, messages in stats["types"]:
+            response += f"{escape(content_type or '?')}: {messages}\n"
+
+    if stats["top_links"]:
+        response += "\n🔗 <b>Самые активные ссылки:</b>\n"
+        for link_code, messages, last_at in stats["top_links"]:
+            response += f"<code>{escape(link_code or '')}</code>: {messages} (последнее {escape((last_at or '')[:16])})\n"
+
+    return response
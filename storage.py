@@ -0,0 +1,854 @@
+"""
+Хранилище бота на SQLite
+Одно долгоживущее подключение, все блокирующие вызовы выполняются
+в отдельном потоке, чтобы не останавливать event loop aiogram
+"""
+
+import asyncio
+import os
+import time
+import sqlite3
+import shutil
+import secrets
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from cache import TTLCache, MISSING
+from metrics import DB_LATENCY
+from repository import Repository, LOG_FILTER_COLUMNS, SEARCH_MARK_START, SEARCH_MARK_END, build_match
+
+logger = logging.getLogger(__name__)
+
+# Настройки группового коммита (write-behind)
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 200))
+WRITE_BATCH_MS = int(os.getenv("WRITE_BATCH_MS", 50))
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", 10000))
+# Пачка, не записанная из-за временной ошибки (БД занята, нет места), повторяется
+# с паузой до WRITE_RETRY_MAX_DELAY сек; при остановке - не дольше WRITE_STOP_TIMEOUT сек
+# (вместе с SHUTDOWN_TIMEOUT вебхука укладывается в 30 сек, которые Render ждет после SIGTERM)
+WRITE_RETRY_MAX_DELAY = float(os.getenv("WRITE_RETRY_MAX_DELAY", 5))
+WRITE_STOP_TIMEOUT = float(os.getenv("WRITE_STOP_TIMEOUT", 5))
+
+# Настройки кэша владельцев ссылок
+LINK_CACHE_SIZE = int(os.getenv("LINK_CACHE_SIZE", 10000))
+LINK_CACHE_TTL = float(os.getenv("LINK_CACHE_TTL", 600))
+LINK_CACHE_NEGATIVE_TTL = float(os.getenv("LINK_CACHE_NEGATIVE_TTL", 60))
+
+
+# Миграции схемы: (версия, описание, SQL). Только добавлять новые в конец
+MIGRATIONS = [
+    (1, "Базовые таблицы", [
+        # Таблица пользователей
+        '''CREATE TABLE IF NOT EXISTS users
+           (user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            created_at TEXT)''',
+        # Таблица анонимных ссылок
+        '''CREATE TABLE IF NOT EXISTS anon_links
+           (link_code TEXT PRIMARY KEY,
+            user_id INTEGER,
+            created_at TEXT,
+            is_active INTEGER DEFAULT 1,
+            FOREIGN KEY(user_id) REFERENCES users(user_id))''',
+        # Таблица сообщений (для истории)
+        '''CREATE TABLE IF NOT EXISTS messages
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link_code TEXT,
+            sender_id INTEGER,
+            sender_username TEXT,
+            content_type TEXT,
+            content_info TEXT,
+            timestamp TEXT)''',
+    ]),
+    (2, "Индексы для ссылок пользователя, истории и /logs", [
+        # create_anon_link, get_message_history
+        "CREATE INDEX IF NOT EXISTS idx_anon_links_user_active ON anon_links(user_id, is_active)",
+        # get_message_history: WHERE link_code = ? ORDER BY timestamp DESC
+        "CREATE INDEX IF NOT EXISTS idx_messages_link_timestamp ON messages(link_code, timestamp)",
+        # /logs: ORDER BY timestamp DESC LIMIT 20
+        "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)",
+    ]),
+    (3, "Состояния FSM", [
+        '''CREATE TABLE IF NOT EXISTS fsm_states
+           (key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL)''',
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)",
+    ]),
+    (4, "Индексы для фильтров /logs", [
+        # (timestamp, id): id - rowid, он уже входит в каждую запись индекса
+        "CREATE INDEX IF NOT EXISTS idx_messages_sender_timestamp ON messages(sender_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_type_timestamp ON messages(content_type, timestamp)",
+    ]),
+    (5, "Сводная статистика (обновляется вместе с записью истории)", [
+        "CREATE TABLE IF NOT EXISTS stats_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS stats_types (content_type TEXT PRIMARY KEY, messages INTEGER NOT NULL)",
+        '''CREATE TABLE IF NOT EXISTS stats_links
+           (link_code TEXT PRIMARY KEY,
+            messages INTEGER NOT NULL,
+            last_at TEXT)''',
+        "CREATE INDEX IF NOT EXISTS idx_stats_links_messages ON stats_links(messages)",
+        "CREATE TABLE IF NOT EXISTS stats_hourly (hour TEXT PRIMARY KEY, messages INTEGER NOT NULL)",
+        '''CREATE TABLE IF NOT EXISTS stats_daily
+           (day TEXT PRIMARY KEY,
+            messages INTEGER NOT NULL DEFAULT 0,
+            active_users INTEGER NOT NULL DEFAULT 0)''',
+        # Кто уже посчитан активным за день (старые дни удаляет обслуживание)
+        '''CREATE TABLE IF NOT EXISTS stats_daily_users
+           (day TEXT, user_id INTEGER, PRIMARY KEY (day, user_id)) WITHOUT ROWID''',
+        # Заполнение по уже накопленной истории
+        "INSERT INTO stats_counters (name, value) SELECT 'users', COUNT(*) FROM users",
+        "INSERT INTO stats_counters (name, value) SELECT 'messages', COUNT(*) FROM messages",
+        "INSERT INTO stats_types SELECT content_type, COUNT(*) FROM messages GROUP BY content_type",
+        "INSERT INTO stats_links SELECT link_code, COUNT(*), MAX(timestamp) FROM messages GROUP BY link_code",
+        "INSERT INTO stats_hourly SELECT substr(timestamp, 1, 13), COUNT(*) FROM messages GROUP BY 1",
+        '''INSERT OR IGNORE INTO stats_daily_users
+           SELECT substr(timestamp, 1, 10), sender_id FROM messages
+           UNION SELECT substr(created_at, 1, 10), user_id FROM users''',
+        '''INSERT INTO stats_daily (day, active_users)
+           SELECT day, COUNT(*) FROM stats_daily_users GROUP BY day''',
+        '''INSERT INTO stats_daily (day, messages)
+           SELECT substr(timestamp, 1, 10), COUNT(*) FROM messages WHERE true GROUP BY 1
+           ON CONFLICT(day) DO UPDATE SET messages = excluded.messages''',
+    ]),
+    (6, "Полнотекстовый поиск по истории (FTS5)", [
+        # Внешнее содержимое: индекс хранит только токены, текст берется из messages
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5
+           (content_info, content='messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2')''',
+        # Уже накопленная история индексируется в фоне: проиндексированы id <= done и id > until
+        "CREATE TABLE IF NOT EXISTS fts_backfill (done INTEGER NOT NULL, until INTEGER NOT NULL)",
+        "INSERT INTO fts_backfill SELECT 0, COALESCE(MAX(id), 0) FROM messages",
+        '''CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+               INSERT INTO messages_fts (rowid, content_info) VALUES (new.id, new.content_info);
+           END''',
+        # Удаление и изменение (срок хранения, сжатие) - только для уже проиндексированных строк
+        '''CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+           WHEN old.id <= (SELECT done FROM fts_backfill) OR old.id > (SELECT until FROM fts_backfill) BEGIN
+               INSERT INTO messages_fts (messages_fts, rowid, content_info) VALUES ('delete', old.id, old.content_info);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content_info ON messages
+           WHEN old.id <= (SELECT done FROM fts_backfill) OR old.id > (SELECT until FROM fts_backfill) BEGIN
+               INSERT INTO messages_fts (messages_fts, rowid, content_info) VALUES ('delete', old.id, old.content_info);
+               INSERT INTO messages_fts (rowid, content_info) VALUES (new.id, new.content_info);
+           END''',
+    ]),
+]
+
+# Сколько самых новых совпадений ранжируется при поиске
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", 5000))
+
+
+# Путь к файлу БД (на Render - абсолютный, с созданием директории)
+def resolve_db_path() -> str:
+    """Определение пути к базе данных"""
+    db_path = os.getenv("DB_PATH", "anon_bot.db")
+
+    if 'RENDER' in os.environ or 'PORT' in os.environ:
+        db_path = os.path.join(os.getcwd(), db_path)
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+
+    return db_path
+
+
+class WriteLost(Exception):
+    """Строки очереди отложенной записи не записаны в БД"""
+
+
+class WriteBehindQueue:
+    """Очередь отложенной записи: строки копятся и коммитятся пачками
+
+    Пачка пишется, когда набралось batch_size строк или прошло batch_ms
+    миллисекунд с первой строки. Очередь ограничена: при переполнении
+    put() ждет, пока фоновая задача освободит место. При временной ошибке
+    SQLite пачка повторяется, а не выбрасывается; строки, которые записать
+    так и не удалось, попадают в лог целиком, и stop() сообщает о потере.
+    """
+
+    def __init__(self, write_batch, batch_size: int = WRITE_BATCH_SIZE,
+                 batch_ms: int = WRITE_BATCH_MS, max_size: int = WRITE_QUEUE_SIZE):
+        self._write_batch = write_batch
+        self.batch_size = batch_size
+        self.batch_delay = batch_ms / 1000
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._task = None
+        self._batch = None          # пачка, которая пишется (или ждет повтора)
+        self.batches_written = 0
+        self.rows_written = 0
+        self.retries = 0
+        self.rows_lost = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, kind: str, row: tuple):
+        """Постановка строки в очередь (ждет при переполнении)"""
+        self._ensure_started()
+        await self._queue.put((kind, row))
+
+    async def put_many(self, kind: str, rows: list):
+        """Постановка нескольких строк подряд: они попадают в одну пачку,
+        если в ней осталось место"""
+        self._ensure_started()
+        for row in rows:
+            await self._queue.put((kind, row))
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_delay
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _lose(self, rows: list, reason):
+        """Последний след незаписанных строк - лог"""
+        self.rows_lost += len(rows)
+        logger.error(f"❌ Не записаны в БД {len(rows)} строк ({reason}):")
+        for kind, row in rows:
+            logger.error(f"❌ {kind}: {row!r}")
+
+    async def _write(self, batch: list):
+        """Запись пачки; временные ошибки SQLite (БД занята, нет места) повторяются с паузой"""
+        delay = 0.1
+        while True:
+            try:
+                await self._write_batch(batch)
+                self.batches_written += 1
+                self.rows_written += len(batch)
+                return
+            except sqlite3.OperationalError as e:
+                self.retries += 1
+                logger.error(f"❌ Ошибка групповой записи ({len(batch)} строк): {e}, повтор через {delay:.1f} сек")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, WRITE_RETRY_MAX_DELAY)
+            except Exception as e:
+                # Ошибка в самих данных: повтор не поможет
+                self._lose(batch, e)
+                return
+
+    async def _run(self):
+        while True:
+            batch = self._batch = await self._collect()
+            try:
+                await self._write(batch)
+                # При отмене во время повтора пачка остается в _batch для stop()
+                self._batch = None
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def flush(self):
+        """Ожидание записи всего, что уже стоит в очереди"""
+        if self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def stop(self, timeout: float = WRITE_STOP_TIMEOUT):
+        """Запись остатка очереди и остановка фоновой задачи; WriteLost, если записать не удалось"""
+        lost_before = self.rows_lost
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        left = []
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            left = list(self._batch or [])
+        while not self._queue.empty():
+            left.append(self._queue.get_nowait())
+            self._queue.task_done()
+        if left:
+            self._lose(left, f"БД недоступна {timeout:.0f} сек при остановке")
+
+        if self.rows_lost > lost_before:
+            raise WriteLost(f"не записано строк: {self.rows_lost - lost_before}")
+
+
+class Storage(Repository):
+    """Хранилище с постоянным подключением и выделенным потоком для SQLite"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.writer = WriteBehindQueue(self._write_batch)
+        # link_code -> user_id (None - ссылка не найдена или неактивна)
+        self.link_owners = TTLCache(LINK_CACHE_SIZE, LINK_CACHE_TTL, LINK_CACHE_NEGATIVE_TTL)
+        # user_id -> активный link_code
+        self.user_links = TTLCache(LINK_CACHE_SIZE, LINK_CACHE_TTL)
+
+    @property
+    def write_queue_depth(self) -> int:
+        return self.writer.depth
+
+    @property
+    def link_cache_entries(self) -> int:
+        return len(self.link_owners)
+
+    # Выполнение блокирующей функции в потоке БД
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # Подключение создается один раз и живет до close()
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.db_path is None:
+                self.db_path = resolve_db_path()
+
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # Для новой БД действует сразу, существующую переводит enable_incremental_vacuum() (VACUUM_CONVERT)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._conn = conn
+            logger.info(f"🗃️ Подключение к БД открыто: {self.db_path}")
+        return self._conn
+
+    def _migrate(self, target: int = None) -> int:
+        """Применение миграций новее текущей версии схемы (PRAGMA user_version)"""
+        conn = self._connection()
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for version, description, statements in MIGRATIONS:
+            if version <= current or (target is not None and version > target):
+                continue
+
+            # Каждая миграция - отдельная транзакция вместе с номером версии
+            conn.execute("BEGIN")
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            current = version
+            logger.info(f"🗃️ Миграция {version} применена: {description}")
+
+        return current
+
+    def _write_batch_sync(self, users: list, messages: list):
+        conn = self._connection()
+        # Одна транзакция (и один fsync) на всю пачку
+        with conn:
+            new_users = 0
+            if users:
+                # Новые пользователи считаются до INSERT OR REPLACE
+                new_users = sum(1 for user_id in {row[0] for row in users}
+                                if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is None)
+                conn.executemany('''INSERT OR REPLACE INTO users
+                                    (user_id, username, full_name, created_at)
+                                    VALUES (?, ?, ?, ?)''', users)
+            if messages:
+                conn.executemany('''INSERT INTO messages
+                                    (link_code, sender_id, sender_username, content_type, content_info, timestamp)
+                                    VALUES (?, ?, ?, ?, ?, ?)''', messages)
+            self._update_rollups(conn, users, messages, new_users)
+
+    @staticmethod
+    def _update_rollups(conn, users: list, messages: list, new_users: int):
+        """Сводная статистика по пачке - в той же транзакции, что и сами строки"""
+        types, links, hours, day_messages = Counter(), Counter(), Counter(), Counter()
+        last_at = {}
+        active = {(row[3][:10], row[0]) for row in users}
+
+        for link_code, sender_id, _, content_type, _, timestamp in messages:
+            types[content_type] += 1
+            links[link_code] += 1
+            last_at[link_code] = max(last_at.get(link_code, timestamp), timestamp)
+            hours[timestamp[:13]] += 1
+            day_messages[timestamp[:10]] += 1
+            active.add((timestamp[:10], sender_id))
+
+        # Активный пользователь считается один раз за день
+        day_users = Counter(day for day, user_id in active
+                            if conn.execute("INSERT OR IGNORE INTO stats_daily_users (day, user_id) VALUES (?, ?)",
+                                            (day, user_id)).rowcount)
+
+        conn.executemany('''INSERT INTO stats_counters (name, value) VALUES (?, ?)
+                            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value''',
+                         [item for item in (("users", new_users), ("messages", len(messages))) if item[1]])
+        conn.executemany('''INSERT INTO stats_types (content_type, messages) VALUES (?, ?)
+                            ON CONFLICT(content_type) DO UPDATE SET messages = messages + excluded.messages''',
+                         types.items())
+        conn.executemany('''INSERT INTO stats_links (link_code, messages, last_at) VALUES (?, ?, ?)
+                            ON CONFLICT(link_code) DO UPDATE SET messages = messages + excluded.messages,
+                                                                 last_at = max(last_at, excluded.last_at)''',
+                         [(link_code, count, last_at[link_code]) for link_code, count in links.items()])
+        conn.executemany('''INSERT INTO stats_hourly (hour, messages) VALUES (?, ?)
+                            ON CONFLICT(hour) DO UPDATE SET messages = messages + excluded.messages''',
+                         hours.items())
+        conn.executemany('''INSERT INTO stats_daily (day, messages, active_users) VALUES (?, ?, ?)
+                            ON CONFLICT(day) DO UPDATE SET messages = messages + excluded.messages,
+                                                           active_users = active_users + excluded.active_users''',
+                         [(day, day_messages[day], day_users[day]) for day in set(day_messages) | set(day_users)])
+
+    async def _write_batch(self, batch: list):
+        users = [row for kind, row in batch if kind == "user"]
+        messages = [row for kind, row in batch if kind == "message"]
+        started = time.perf_counter()
+        try:
+            await self._run(self._write_batch_sync, users, messages)
+        finally:
+            DB_LATENCY.observe(time.perf_counter() - started, "write_batch")
+
+    def _create_anon_link(self, user_id: int) -> str:
+        conn = self._connection()
+        existing = conn.execute(
+            "SELECT link_code FROM anon_links WHERE user_id = ? AND is_active = 1", (user_id,)
+        ).fetchone()
+        if existing:
+            return existing[0]
+
+        link_code = secrets.token_urlsafe(12)
+        with conn:
+            conn.execute("INSERT INTO anon_links (link_code, user_id, created_at) VALUES (?, ?, ?)",
+                         (link_code, user_id, datetime.now().isoformat()))
+        return link_code
+
+    def _get_link_owner(self, link_code: str):
+        conn = self._connection()
+        result = conn.execute(
+            "SELECT user_id FROM anon_links WHERE link_code = ? AND is_active = 1", (link_code,)
+        ).fetchone()
+        return result[0] if result else None
+
+    def _deactivate_link(self, link_code: str):
+        conn = self._connection()
+        with conn:
+            owner = conn.execute("SELECT user_id FROM anon_links WHERE link_code = ?",
+                                 (link_code,)).fetchone()
+            conn.execute("UPDATE anon_links SET is_active = 0 WHERE link_code = ?", (link_code,))
+        return owner[0] if owner else None
+
+    def _rotate_link(self, user_id: int):
+        conn = self._connection()
+        with conn:
+            old_codes = [row[0] for row in conn.execute(
+                "SELECT link_code FROM anon_links WHERE user_id = ? AND is_active = 1", (user_id,))]
+            conn.execute("UPDATE anon_links SET is_active = 0 WHERE user_id = ? AND is_active = 1",
+                         (user_id,))
+            link_code = secrets.token_urlsafe(12)
+            conn.execute("INSERT INTO anon_links (link_code, user_id, created_at) VALUES (?, ?, ?)",
+                         (link_code, user_id, datetime.now().isoformat()))
+        return link_code, old_codes
+
+    def _fsm_load(self, key: str):
+        return self._connection().execute(
+            "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)
+        ).fetchone()
+
+    def _fsm_save(self, key: str, state, data: str, updated_at: float):
+        conn = self._connection()
+        with conn:
+            conn.execute('''INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at)
+                            VALUES (?, ?, ?, ?)''', (key, state, data, updated_at))
+
+    def _fsm_delete(self, key: str):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM fsm_states WHERE key = ?", (key,))
+
+    def _fsm_expire(self, before: float) -> int:
+        conn = self._connection()
+        with conn:
+            return conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (before,)).rowcount
+
+    def _fsm_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM fsm_states").fetchone()[0]
+
+    def _get_message_history(self, user_id: int):
+        conn = self._connection()
+        link_result = conn.execute(
+            "SELECT link_code FROM anon_links WHERE user_id = ? AND is_active = 1", (user_id,)
+        ).fetchone()
+        if not link_result:
+            return []
+
+        return conn.execute('''SELECT sender_username, content_type, content_info, timestamp
+                               FROM messages
+                               WHERE link_code = ?
+                               ORDER BY timestamp DESC LIMIT 50''', (link_result[0],)).fetchall()
+
+    def _get_logs_page(self, filters: dict, cursor_id, direction: str, limit: int):
+        """Страница истории по ключу (timestamp, id): поиск по индексу вместо OFFSET"""
+        conn = self._connection()
+        conditions, params = [], []
+        for name, value in filters.items():
+            conditions.append(f"{LOG_FILTER_COLUMNS[name]} = ?")
+            params.append(value)
+
+        if cursor_id is not None:
+            row = conn.execute("SELECT timestamp FROM messages WHERE id = ?", (cursor_id,)).fetchone()
+            op = "<" if direction == "older" else ">"
+            if row is not None:
+                conditions.append(f"(timestamp, id) {op} (?, ?)")
+                params.extend((row[0], cursor_id))
+            else:
+                # Строка курсора удалена обслуживанием - id растут вместе со временем записи
+                conditions.append(f"id {op} ?")
+                params.append(cursor_id)
+
+        order = "DESC" if direction == "older" else "ASC"
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = conn.execute(f"""SELECT id, sender_username, sender_id, content_type, content_info, link_code, timestamp
+                                FROM messages {where}
+                                ORDER BY timestamp {order}, id {order} LIMIT ?""",
+                            (*params, limit + 1)).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction != "older":
+            rows.reverse()
+        return rows, has_more
+
+    def _get_stats(self, today: str, since_hour: str, days: int, top_links: int) -> dict:
+        """Статистика из сводных таблиц: каждое чтение - поиск по ключу или короткий диапазон"""
+        conn = self._connection()
+        counters = dict(conn.execute("SELECT name, value FROM stats_counters").fetchall())
+        return {
+            "users": counters.get("users", 0),
+            "messages": counters.get("messages", 0),
+            "types": conn.execute("SELECT content_type, messages FROM stats_types ORDER BY messages DESC").fetchall(),
+            "daily": conn.execute("SELECT day, messages, active_users FROM stats_daily WHERE day <= ? "
+                                  "ORDER BY day DESC LIMIT ?", (today, days)).fetchall(),
+            "last_24h": conn.execute("SELECT COALESCE(SUM(messages), 0) FROM stats_hourly WHERE hour >= ?",
+                                     (since_hour,)).fetchone()[0],
+            "top_links": conn.execute("SELECT link_code, messages, last_at FROM stats_links "
+                                      "ORDER BY messages DESC LIMIT ?", (top_links,)).fetchall(),
+        }
+
+    def _search_messages(self, query: str, limit: int, offset: int):
+        """Поиск по FTS5 с сортировкой по релевантности (bm25): (строки, есть ли еще)
+
+        bm25 считается только для SEARCH_CANDIDATES самых новых совпадений:
+        частое слово иначе заставило бы ранжировать значительную часть таблицы.
+        Строки: (id, username, sender_id, content_type, фрагмент, link_code, timestamp);
+        совпадения во фрагменте обрамлены SEARCH_MARK_START/SEARCH_MARK_END
+        """
+        conn = self._connection()
+        # Отдельным запросом: как подзапрос граница вычисляется заново для каждой строки
+        bound = conn.execute("""SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?
+                                ORDER BY rowid DESC LIMIT 1 OFFSET ?""",
+                             (query, SEARCH_CANDIDATES - 1)).fetchone()
+        rows = conn.execute("""SELECT m.id, m.sender_username, m.sender_id, m.content_type,
+                                      snippet(messages_fts, 0, ?, ?, '…', 12), m.link_code, m.timestamp
+                               FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                               WHERE messages_fts MATCH ? AND messages_fts.rowid >= ?
+                               ORDER BY rank LIMIT ? OFFSET ?""",
+                            (SEARCH_MARK_START, SEARCH_MARK_END, query, bound[0] if bound else 0,
+                             limit + 1, offset)).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    def _fts_backfill(self, limit: int) -> int:
+        """Индексация следующей пачки старой истории; возвращает число строк"""
+        conn = self._connection()
+        done, until = conn.execute("SELECT done, until FROM fts_backfill").fetchone()
+        if done >= until:
+            return 0
+
+        with conn:
+            upper, count = conn.execute("""SELECT MAX(id), COUNT(*) FROM
+                                           (SELECT id FROM messages WHERE id > ? AND id <= ? ORDER BY id LIMIT ?)""",
+                                        (done, until, limit)).fetchone()
+            # Пачка неполная - до until строк больше нет (часть удалена)
+            upper = upper if count == limit else until
+            conn.execute("""INSERT INTO messages_fts (rowid, content_info)
+                            SELECT id, content_info FROM messages WHERE id > ? AND id <= ?""", (done, upper))
+            conn.execute("UPDATE fts_backfill SET done = ?", (upper,))
+        return count
+
+    def _fts_backfill_progress(self):
+        return self._connection().execute("SELECT done, until FROM fts_backfill").fetchone()
+
+    def _prune_daily_users(self, before_day: str) -> int:
+        conn = self._connection()
+        with conn:
+            return conn.execute("DELETE FROM stats_daily_users WHERE day < ?", (before_day,)).rowcount
+
+    def _prune_messages(self, content_type, exclude: tuple, before: str, limit: int) -> int:
+        """Удаление до limit сообщений старше before: одного типа или всех, кроме exclude"""
+        conn = self._connection()
+        if content_type is not None:
+            condition, params = "content_type = ?", (content_type,)
+        else:
+            condition = f"content_type NOT IN ({', '.join('?' * len(exclude))})" if exclude else "1"
+            params = tuple(exclude)
+        with conn:
+            return conn.execute(f"""DELETE FROM messages WHERE id IN
+                                    (SELECT id FROM messages WHERE timestamp < ? AND {condition} LIMIT ?)""",
+                                (before, *params, limit)).rowcount
+
+    def _compact_messages(self, after_id: int, before: str, max_length: int, limit: int) -> tuple:
+        """Обрезка длинных текстов в следующих limit строках после after_id (диапазон по первичному ключу)"""
+        conn = self._connection()
+        rows = conn.execute("SELECT id, timestamp FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                            (after_id, limit)).fetchall()
+        last_id = after_id
+        for message_id, timestamp in rows:
+            if timestamp >= before:
+                break
+            last_id = message_id
+        if last_id == after_id:
+            return after_id, 0
+
+        with conn:
+            changed = conn.execute('''UPDATE messages SET content_info = substr(content_info, 1, ?)
+                                      WHERE id > ? AND id <= ? AND content_type = 'text'
+                                        AND length(content_info) > ?''',
+                                   (max_length, after_id, last_id, max_length)).rowcount
+        return last_id, changed
+
+    def _space_stats(self) -> dict:
+        conn = self._connection()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+            "page_size": page_size,
+            "size_bytes": conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+            "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+            # Свободное место на диске: полному VACUUM нужна копия БД
+            "disk_free_bytes": shutil.disk_usage(os.path.dirname(os.path.abspath(self.db_path))).free,
+        }
+
+    def _incremental_vacuum(self, pages: int) -> int:
+        """Возврат до pages свободных страниц файловой системе; возвращает остаток свободных"""
+        conn = self._connection()
+        # execute() делает один шаг (одну страницу), executescript выполняет прагму целиком
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def _enable_incremental_vacuum(self) -> bool:
+        conn = self._connection()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        # Смена режима у существующей БД требует полного VACUUM (вне транзакции):
+        # он переписывает файл целиком и занимает поток БД до конца
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+
+    def iter_messages(self, filters: dict = None, since: str = None, until: str = None,
+                      chunk_size: int = 1000):
+        """Потоковое чтение истории пачками по chunk_size строк (от старых к новым)
+
+        Генератор открывает собственное подключение только для чтения и
+        вызывается из отдельного потока: долгая выгрузка не занимает поток БД,
+        а WAL дает ей согласованный снимок, не блокируя запись.
+        """
+        conditions, params = [], []
+        for name, value in (filters or {}).items():
+            conditions.append(f"{LOG_FILTER_COLUMNS[name]} = ?")
+            params.append(value)
+        if since:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            conditions.append("timestamp < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        conn = sqlite3.connect(f"file:{self.db_path or resolve_db_path()}?mode=ro", uri=True)
+        try:
+            conn.execute("PRAGMA busy_timeout=5000")
+            cursor = conn.execute(f"""SELECT id, timestamp, link_code, sender_id, sender_username,
+                                             content_type, content_info
+                                      FROM messages {where} ORDER BY timestamp, id""", params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # Асинхронный интерфейс
+    async def init(self):
+        """Открытие подключения, установка PRAGMA и применение миграций"""
+        await self._run(self._migrate)
+
+    async def migrate(self, target: int = None) -> int:
+        """Применение миграций до версии target (по умолчанию - всех)"""
+        return await self._run(self._migrate, target)
+
+    async def schema_version(self) -> int:
+        """Текущая версия схемы"""
+        return await self._run(lambda: self._connection().execute("PRAGMA user_version").fetchone()[0])
+
+    async def save_user(self, user_id: int, username: str, full_name: str):
+        """Сохранение пользователя (через очередь отложенной записи)"""
+        await self.writer.put("user", (user_id, username or '', full_name, datetime.now().isoformat()))
+
+    async def create_anon_link(self, user_id: int) -> str:
+        """Получение активной ссылки пользователя или создание новой (с кэшем)"""
+        link_code = self.user_links.get(user_id)
+        if link_code is not MISSING:
+            return link_code
+
+        link_code = await self._run(self._create_anon_link, user_id)
+        self.user_links.set(user_id, link_code)
+        # Код мог попасть в отрицательный кэш до создания
+        self.link_owners.set(link_code, user_id)
+        return link_code
+
+    async def get_link_owner(self, link_code: str):
+        """Получение ID владельца активной ссылки (с кэшем)"""
+        owner = self.link_owners.get(link_code)
+        if owner is not MISSING:
+            return owner
+
+        owner = await self._run(self._get_link_owner, link_code)
+        self.link_owners.set(link_code, owner)
+        return owner
+
+    async def deactivate_link(self, link_code: str):
+        """Деактивация ссылки"""
+        owner = await self._run(self._deactivate_link, link_code)
+        self.link_owners.invalidate(link_code)
+        if owner is not None:
+            self.user_links.invalidate(owner)
+
+    async def rotate_link(self, user_id: int) -> str:
+        """Деактивация текущих ссылок пользователя и выдача новой"""
+        link_code, old_codes = await self._run(self._rotate_link, user_id)
+        for old_code in old_codes:
+            self.link_owners.invalidate(old_code)
+        self.link_owners.set(link_code, user_id)
+        self.user_links.set(user_id, link_code)
+        return link_code
+
+    async def save_message_history(self, link_code: str, sender_id: int, sender_username: str,
+                                   content_type: str, content_info: str):
+        """Сохранение сообщения в историю (через очередь отложенной записи)"""
+        await self.writer.put("message", (link_code, sender_id, sender_username or '', content_type,
+                                          content_info, datetime.now().isoformat()))
+
+    async def save_message_history_many(self, link_code: str, sender_id: int, sender_username: str,
+                                        items: list):
+        """Сохранение нескольких сообщений (альбома) одной пачкой; items - [(content_type, content_info)]"""
+        timestamp = datetime.now().isoformat()
+        await self.writer.put_many("message", [
+            (link_code, sender_id, sender_username or '', content_type, content_info, timestamp)
+            for content_type, content_info in items
+        ])
+
+    async def flush(self):
+        """Запись всех строк, ожидающих в очереди"""
+        await self.writer.flush()
+
+    async def fsm_load(self, key: str):
+        """Состояние FSM: (state, data_json, updated_at) или None"""
+        return await self._run(self._fsm_load, key)
+
+    async def fsm_save(self, key: str, state, data: str, updated_at: float):
+        """Сохранение состояния FSM"""
+        await self._run(self._fsm_save, key, state, data, updated_at)
+
+    async def fsm_delete(self, key: str):
+        """Удаление состояния FSM"""
+        await self._run(self._fsm_delete, key)
+
+    async def fsm_expire(self, before: float) -> int:
+        """Удаление состояний FSM, не менявшихся с момента before"""
+        return await self._run(self._fsm_expire, before)
+
+    async def fsm_count(self) -> int:
+        """Количество сохраненных состояний FSM"""
+        return await self._run(self._fsm_count)
+
+    async def get_message_history(self, user_id: int):
+        """Последние 50 сообщений по активной ссылке пользователя"""
+        await self.writer.flush()
+        return await self._run(self._get_message_history, user_id)
+
+    async def get_logs_page(self, filters: dict = None, cursor_id: int = None, direction: str = "older",
+                            limit: int = 20):
+        """Страница сообщений для админа (новые сверху) и признак наличия следующей
+        в направлении direction ("older" - старее cursor_id, "newer" - новее)"""
+        await self.writer.flush()
+        return await self._run(self._get_logs_page, filters or {}, cursor_id, direction, limit)
+
+    async def get_stats(self, days: int = 7, top_links: int = 5) -> dict:
+        """Сводная статистика для /stats (время не зависит от размера истории)"""
+        await self.writer.flush()
+        now = datetime.now()
+        # Текущий час и 23 предыдущих (ключи stats_hourly - "YYYY-MM-DDTHH")
+        since_hour = (now - timedelta(hours=23)).isoformat()[:13]
+        return await self._run(self._get_stats, now.date().isoformat(), since_hour, days, top_links)
+
+    async def search_messages(self, text: str, limit: int = 10, offset: int = 0):
+        """Полнотекстовый поиск по FTS5 (ранжирование bm25)"""
+        await self.writer.flush()
+        return await self._run(self._search_messages, build_match(text), limit, offset)
+
+    async def fts_backfill(self, limit: int) -> int:
+        """Индексация пачки истории, накопленной до появления поиска"""
+        return await self._run(self._fts_backfill, limit)
+
+    async def fts_backfill_progress(self):
+        """(done, until): проиндексирована старая история с id <= done из until"""
+        return await self._run(self._fts_backfill_progress)
+
+    async def prune_daily_users(self, before_day: str) -> int:
+        """Удаление отметок активности за дни раньше before_day"""
+        return await self._run(self._prune_daily_users, before_day)
+
+    async def prune_messages(self, content_type, exclude: tuple, before: str, limit: int) -> int:
+        """Удаление одной пачки устаревших сообщений"""
+        return await self._run(self._prune_messages, content_type, exclude, before, limit)
+
+    async def compact_messages(self, after_id: int, before: str, max_length: int, limit: int) -> tuple:
+        """Обрезка длинных текстов в одной пачке строк после after_id"""
+        return await self._run(self._compact_messages, after_id, before, max_length, limit)
+
+    async def space_stats(self) -> dict:
+        """Размер БД и объем свободных страниц"""
+        return await self._run(self._space_stats)
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """Один шаг incremental_vacuum"""
+        return await self._run(self._incremental_vacuum, pages)
+
+    async def enable_incremental_vacuum(self) -> bool:
+        """Перевод БД в auto_vacuum=INCREMENTAL полным VACUUM (True - БД переведена)"""
+        return await self._run(self._enable_incremental_vacuum)
+
+    async def close(self):
+        """Запись остатка очереди и закрытие подключения (WriteLost, если часть строк потеряна)"""
+        try:
+            await self.writer.stop()
+        finally:
+            await self._run(self._close)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Общий контракт реализаций Repository: каждая проверка получает новое
+пустое хранилище и должна пройти на всех реализациях одинаково
+
+Запуск: python storage_contract.py                  (все реализации)
+        python storage_contract.py --backend memory
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from repository import Repository, SEARCH_MARK_START, SEARCH_MARK_END, create_repository
+
+BACKENDS = ("memory", "sqlite")
+FAR_FUTURE = "9999-12-31"
+
+CHECKS = []
+
+
+def check(func):
+    CHECKS.append(func)
+    return func
+
+
+@check
+async def links_lifecycle(db: Repository):
+    code = await db.create_anon_link(1)
+    assert await db.create_anon_link(1) == code, "повторный вызов должен вернуть ту же ссылку"
+    assert await db.get_link_owner(code) == 1
+    assert await db.get_link_owner("missing") is None
+
+    new_code = await db.rotate_link(1)
+    assert new_code != code
+    assert await db.get_link_owner(code) is None, "старая ссылка после rotate_link неактивна"
+    assert await db.get_link_owner(new_code) == 1
+    assert await db.create_anon_link(1) == new_code
+
+    await db.deactivate_link(new_code)
+    assert await db.get_link_owner(new_code) is None
+    third = await db.create_anon_link(1)
+    assert third not in (code, new_code)
+
+
+@check
+async def message_history(db: Repository):
+    code = await db.create_anon_link(10)
+    other = await db.create_anon_link(11)
+    for i in range(55):
+        await db.save_message_history(code, 100 + i, f"user{i}" if i % 2 else None, "text", f"m{i}")
+    await db.save_message_history(other, 1, "x", "text", "чужое")
+
+    history = await db.get_message_history(10)
+    assert len(history) == 50, len(history)
+    assert all(len(row) == 4 for row in history)
+    assert [row[2] for row in history[:2]] == ["m54", "m53"], history[:2]
+    assert history[0][0] == "", "пустой username сохраняется как ''"
+    assert await db.get_message_history(999) == []
+
+
+@check
+async def album_history(db: Repository):
+    code = await db.create_anon_link(5)
+    await db.save_message_history_many(code, 7, "u", [("photo", "p1"), ("video", "v1")])
+    rows, _ = await db.get_logs_page()
+    assert sorted(row[3] for row in rows) == ["photo", "video"]
+    assert len({row[6] for row in rows}) == 1, "части альбома с одним временем"
+
+
+@check
+async def logs_keyset_pages(db: Repository):
+    for i in range(25):
+        await db.save_message_history("L1" if i % 2 else "L2", i % 3, "u", "photo" if i % 5 == 0 else "text", f"m{i}")
+
+    seen, cursor, pages = [], None, []
+    while True:
+        rows, has_more = await db.get_logs_page({}, cursor, "older", 10)
+        pages.append(rows)
+        seen += [row[0] for row in rows]
+        if not has_more:
+            break
+        cursor = rows[-1][0]
+    assert len(seen) == 25 and len(set(seen)) == 25, seen
+    assert seen == sorted(seen, reverse=True), "новые сверху"
+    assert [len(page) for page in pages] == [10, 10, 5]
+
+    # Назад со второй страницы - снова первая
+    rows, has_more = await db.get_logs_page({}, pages[1][0][0], "newer", 10)
+    assert [row[0] for row in rows] == [row[0] for row in pages[0]] and not has_more
+
+    rows, _ = await db.get_logs_page({"link_code": "L1", "content_type": "text"}, None, "older", 100)
+    assert rows and all(row[5] == "L1" and row[3] == "text" for row in rows)
+    rows, _ = await db.get_logs_page({"sender_id": 2}, None, "older", 100)
+    assert rows and all(row[2] == 2 for row in rows)
+
+
+@check
+async def logs_cursor_pruned(db: Repository):
+    for i in range(5):
+        await db.save_message_history("L", 1, "u", "text", f"m{i}")
+    rows, _ = await db.get_logs_page({}, None, "older", 5)
+    middle = rows[2][0]
+    assert await db.prune_messages(None, (), FAR_FUTURE, 100) == 5
+    await db.save_message_history("L", 1, "u", "text", "new")
+    rows, _ = await db.get_logs_page({}, middle, "newer", 5)
+    assert [row[4] for row in rows] == ["new"], "курсор удаленной строки сравнивается по id"
+
+
+@check
+async def export_chunks(db: Repository):
+    for i in range(7):
+        await db.save_message_history("A" if i < 5 else "B", i, "u", "text", f"m{i}")
+    await db.flush()
+
+    chunks = list(db.iter_messages({"link_code": "A"}, None, None, 2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    rows = [row for chunk in chunks for row in chunk]
+    assert [row[6] for row in rows] == [f"m{i}" for i in range(5)], "от старых к новым"
+    assert len(rows[0]) == 7 and rows[0][2] == "A"
+    assert list(db.iter_messages(None, FAR_FUTURE, None, 10)) == []
+    assert sum(map(len, db.iter_messages(None, None, FAR_FUTURE, 10))) == 7
+
+
+@check
+async def stats_rollups(db: Repository):
+    await db.save_user(1, "a", "A")
+    await db.save_user(2, "b", "B")
+    await db.save_user(1, "a2", "A")
+    for i in range(6):
+        await db.save_message_history("L1" if i < 4 else "L2", 3, "c", "text" if i % 2 else "photo", "x")
+
+    stats = await db.get_stats()
+    assert stats["users"] == 2 and stats["messages"] == 6, stats
+    assert dict(stats["types"]) == {"text": 3, "photo": 3}
+    assert stats["last_24h"] == 6
+    assert stats["top_links"][0][:2] == ("L1", 4)
+    day, messages, active_users = stats["daily"][0]
+    assert (messages, active_users) == (6, 3), stats["daily"]
+
+    # Статистика - за все время, удаление истории ее не уменьшает
+    await db.prune_messages(None, (), FAR_FUTURE, 100)
+    assert (await db.get_stats())["messages"] == 6
+
+    # Очистка списков активных за день не меняет уже посчитанное число активных
+    assert await db.prune_daily_users(FAR_FUTURE) == 3
+    assert (await db.get_stats())["daily"][0] == (day, 6, 3), "prune_daily_users не должен обнулять день"
+
+
+@check
+async def search(db: Repository):
+    await db.save_message_history("L", 1, "u", "text", "Привет, мир! Встреча завтра")
+    await db.save_message_history("L", 2, "u", "text", "привет всем")
+    await db.save_message_history("L", 3, "u", "text", "приветствую OR NEAR(")
+    await db.save_message_history("L", 4, "u", "text", "ничего общего")
+
+    rows, has_more = await db.search_messages("привет", 10, 0)
+    assert sorted(row[2] for row in rows) == [1, 2] and not has_more, rows
+    rows, _ = await db.search_messages("ПРИВЕТ встреча", 10, 0)
+    assert [row[2] for row in rows] == [1]
+    assert f"{SEARCH_MARK_START}Привет{SEARCH_MARK_END}" in rows[0][4], rows[0][4]
+    rows, _ = await db.search_messages("прив*", 10, 0)
+    assert sorted(row[2] for row in rows) == [1, 2, 3]
+    rows, _ = await db.search_messages('OR NEAR(', 10, 0)
+    assert [row[2] for row in rows] == [3], "синтаксис FTS5 в запросе не интерпретируется"
+
+    first, has_more = await db.search_messages("прив*", 2, 0)
+    second, more = await db.search_messages("прив*", 2, 2)
+    assert has_more and not more and len(first) == 2 and len(second) == 1
+    assert not {row[0] for row in first} & {row[0] for row in second}
+
+    try:
+        await db.search_messages("  ", 10, 0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("пустой запрос - ValueError")
+
+
+@check
+async def fsm_states(db: Repository):
+    assert await db.fsm_load("k1") is None
+    await db.fsm_save("k1", "S:a", '{"x": 1}', 100.0)
+    await db.fsm_save("k2", None, "{}", 200.0)
+    await db.fsm_save("k1", "S:b", '{"x": 2}', 150.0)
+    assert tuple(await db.fsm_load("k1")) == ("S:b", '{"x": 2}', 150.0)
+    assert await db.fsm_count() == 2
+    assert await db.fsm_expire(160.0) == 1
+    assert await db.fsm_load("k1") is None
+    await db.fsm_delete("k2")
+    assert await db.fsm_count() == 0
+
+
+@check
+async def maintenance(db: Repository):
+    for i in range(6):
+        await db.save_message_history("L", 1, "u", ("sticker", "text", "photo")[i % 3], "длинный текст " * 5)
+    # Обслуживание видит только записанные строки
+    await db.flush()
+
+    assert await db.prune_messages("sticker", (), FAR_FUTURE, 1) == 1, "limit соблюдается"
+    assert await db.prune_messages("sticker", (), FAR_FUTURE, 10) == 1
+    assert await db.prune_messages(None, ("text",), FAR_FUTURE, 10) == 2, "все, кроме exclude"
+    assert await db.prune_messages(None, (), "2000-01-01", 10) == 0, "новые сообщения не трогаются"
+
+    assert await db.compact_messages(0, "2000-01-01", 10, 10) == (0, 0), "новые сообщения не трогаются"
+    # Курсор: каждая пачка продолжает с последнего просмотренного id
+    first_id, changed = await db.compact_messages(0, FAR_FUTURE, 10, 1)
+    assert changed == 1
+    last_id, changed = await db.compact_messages(first_id, FAR_FUTURE, 10, 10)
+    assert last_id > first_id and changed == 1
+    assert await db.compact_messages(last_id, FAR_FUTURE, 10, 10) == (last_id, 0)
+    rows, _ = await db.get_logs_page()
+    assert [len(row[4]) for row in rows] == [10, 10]
+
+
+async def run_backend(backend: str) -> int:
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for number, func in enumerate(CHECKS):
+            kwargs = {"db_path": os.path.join(tmp, f"contract{number}.db")} if backend == "sqlite" else {}
+            db = create_repository(backend, **kwargs)
+            await db.init()
+            try:
+                await func(db)
+                print(f"✅ {backend}: {func.__name__}")
+            except Exception:
+                failed += 1
+                print(f"❌ {backend}: {func.__name__}\n{traceback.format_exc()}")
+            finally:
+                await db.close()
+    return failed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Проверка контракта хранилищ")
+    parser.add_argument("--backend", choices=BACKENDS, default=None, help="одна реализация (по умолчанию - все)")
+    args = parser.parse_args()
+
+    failed = 0
+    for backend in ([args.backend] if args.backend else BACKENDS):
+        failed += await run_backend(backend)
+    print(f"\nПроверок не пройдено: {failed}" if failed else "\nВсе проверки пройдены")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
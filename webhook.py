@@ -1,14 +1,23 @@
+import time
+
+# Отсчет фаз запуска - до остальных импортов
+STARTED_AT = time.perf_counter()
+STARTED_AT_TIME = time.time()
+
 import os
-import logging
 import sys
+import asyncio
+import logging
+import importlib
+from datetime import datetime
+from contextlib import contextmanager
 from aiohttp import web
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
-from aiogram.types import BotCommand
 
-from anon_bot import dp, bot, init_db
+from logging_setup import setup_logging
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# aiogram и anon_bot здесь не импортируются: сборка моделей aiogram занимает
+# несколько секунд, поэтому они загружаются в фоне после открытия порта
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Получение хоста Render
@@ -19,118 +28,332 @@ WEBHOOK_URL = f"https://{WEBHOOK_HOST}{WEBHOOK_PATH}" if WEBHOOK_HOST else None
 # Порт из переменной окружения Render
 PORT = int(os.getenv("PORT", 10000))
 
+# Режим вебхука: fast_ack - ответ сразу, обработка в ограниченном пуле с порядком по чату,
+# simple - ответ сразу, каждое обновление в своей задаче aiogram без ограничений: после
+# простоя накопившиеся обновления обрабатываются все разом, поэтому по умолчанию fast_ack
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "fast_ack")
+# Сколько запрос вебхука ждет готовности бота, прежде чем получить 503 (Telegram повторит)
+STARTUP_TIMEOUT = float(os.getenv("STARTUP_TIMEOUT", 30))
+# Предел одновременных запросов Telegram к вебхуку: темп разбора накопившихся
+# обновлений после запуска (~3 запроса к Bot API на сообщение, лимит - 30/сек)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 10))
+# Время на обработку принятых обновлений и отправку очередей при остановке
+# (Render ждет после SIGTERM 30 сек)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 25))
 
-# Health check
-async def health_check(request):
-    return web.Response(text="OK", status=200)
+BOT_COMMANDS = [
+    ("start", "Запустить бота"),
+    ("logs", "Посмотреть логи (админ)"),
+    ("stats", "Статистика (админ)"),
+    ("search", "Поиск по истории (админ)"),
+    ("export", "Выгрузка истории (админ)"),
+]
 
 
-# Главная страница
-async def home_page(request):
-    return web.Response(
-        text="🤖 Анонимный Telegram бот работает!\n\n"
-             "Этот бот позволяет отправлять анонимные сообщения.\n"
-             "Используйте Telegram для взаимодействия с ботом.",
-        status=200
-    )
+def import_bot():
+    """Импорт бота и aiogram (вызывается в отдельном потоке, event loop продолжает отвечать)"""
+    return importlib.import_module("anon_bot"), importlib.import_module("webhook_handler")
 
 
-# Startup
-async def on_startup(app):
-    try:
-        # Инициализируем БД
-        if init_db():
-            logger.info("✅ База данных готова")
-        else:
-            logger.error("❌ Не удалось инициализировать БД")
-
-        # Устанавливаем команды бота
-        await bot.set_my_commands([
-            BotCommand(command="start", description="Запустить бота"),
-            BotCommand(command="logs", description="Посмотреть логи (админ)"),
-        ])
-        logger.info("✅ Команды бота установлены")
-
-        # Устанавливаем вебхук
-        if WEBHOOK_URL:
-            await bot.set_webhook(WEBHOOK_URL, drop_pending_updates=True)
-            logger.info(f"✅ Вебхук установлен: {WEBHOOK_URL}")
-        else:
+class BotStartup:
+    """Запуск бота после открытия порта
+
+    Сразу после старта сервера доступен /health, а запросы вебхука ждут
+    готовности: импорт, БД, диспетчер. Команды, вебхук, get_me и уведомление
+    админу не нужны для обработки обновлений и выполняются затем параллельно.
+    При остановке принятое дорабатывается, а вебхук остается установленным
+    """
+
+    def __init__(self, mode: str = WEBHOOK_MODE):
+        self.mode = mode
+        self.ready = asyncio.Event()
+        self.configured = asyncio.Event()
+        self.phases = {}        # фаза -> длительность, сек
+        self.milestones = {}    # этап -> секунды от запуска процесса
+        self.anon_bot = None
+        self.handler = None
+        self.registry = None
+        self.backlog = None     # pending_update_count при запуске
+        self._workflow_data = None
+        self._task = None
+        self._deadline = 0.0
+
+    def mark(self, milestone: str):
+        self.milestones[milestone] = time.perf_counter() - STARTED_AT
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    async def wait_ready(self, timeout: float = None) -> bool:
+        """True - бот готов обрабатывать вебхук"""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.handler is not None
+
+    async def on_startup(self, app: web.Application):
+        # Не ждем: aiohttp откроет порт только после возврата из on_startup
+        self.mark("startup")
+        self._task = asyncio.create_task(self._run(app))
+
+    async def _run(self, app: web.Application):
+        try:
+            await self._prepare(app)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при запуске: {e}", exc_info=True)
+        finally:
+            self.ready.set()
+
+        try:
+            if self.handler is not None:
+                await self._configure()
+        finally:
+            self.configured.set()
+
+    async def _prepare(self, app: web.Application):
+        """Все, без чего нельзя обработать обновление"""
+        with self.phase("import"):
+            anon_bot, handlers = await asyncio.to_thread(import_bot)
+        self.anon_bot = anon_bot
+        import metrics
+        metrics.PROCESS_STARTED_AT = STARTED_AT_TIME
+        registry = self.registry = metrics.registry
+        registry.gauge("startup_phase_seconds", "Длительность фаз запуска",
+                       lambda: {(name,): seconds for name, seconds in self.phases.items()}, ("phase",))
+        registry.gauge("startup_seconds", "Этапы запуска от старта процесса",
+                       lambda: {(name,): seconds for name, seconds in self.milestones.items()}, ("milestone",))
+        registry.gauge("startup_backlog", "Обновления, ожидавшие в Telegram при запуске", lambda: self.backlog or 0)
+
+        with self.phase("db"):
+            if await anon_bot.init_db():
+                logger.info("✅ База данных готова")
+            else:
+                logger.error("❌ Не удалось инициализировать БД")
+
+        with self.phase("dispatcher"):
+            dp, bot = anon_bot.dp, anon_bot.bot
+            if self.mode == "fast_ack":
+                handler = handlers.FastAckRequestHandler(dispatcher=dp, bot=bot)
+                pool = handler.pool
+                registry.gauge("webhook_pending", "Обновления в очереди вебхука", lambda: pool.pending)
+                registry.gauge("webhook_in_flight", "Обновления в обработке", lambda: pool.in_flight)
+            else:
+                handler = handlers.SimpleRequestHandler(dispatcher=dp, bot=bot)
+
+            # То же, что aiogram setup_application: события startup/shutdown диспетчера
+            self._workflow_data = {"app": app, "dispatcher": dp, **dp.workflow_data, "bot": bot}
+            await dp.emit_startup(**self._workflow_data)
+
+        self.handler = handler
+        self.mark("ready")
+        logger.info(f"✅ Бот готов к приему обновлений через {self.milestones['ready']:.2f} сек после запуска")
+
+    async def _configure(self):
+        """Запросы к Bot API, не нужные для обработки обновлений, - параллельно"""
+        await asyncio.gather(self._set_commands(), self._sync_webhook(), self._identify())
+        await self._notify_admin()
+        self.mark("configured")
+        logger.info("⏱ Фазы запуска: " + ", ".join(
+            f"{name} {seconds:.2f}" for name, seconds in self.phases.items()) + " сек")
+
+    async def _set_commands(self):
+        from aiogram.types import BotCommand
+        with self.phase("commands"):
+            try:
+                await self.anon_bot.bot.set_my_commands([
+                    BotCommand(command=command, description=description) for command, description in BOT_COMMANDS
+                ])
+                logger.info("✅ Команды бота установлены")
+            except Exception as e:
+                logger.error(f"❌ Не удалось установить команды: {e}")
+
+    async def _sync_webhook(self):
+        """Сверка настроек вебхука; накопленные обновления не сбрасываются
+
+        Вебхук не удаляется при остановке: то, что пришло за время деплоя
+        или сна, Telegram доставит сейчас - не больше WEBHOOK_MAX_CONNECTIONS
+        запросов одновременно
+        """
+        if not WEBHOOK_URL:
             logger.warning("⚠️ RENDER_EXTERNAL_HOSTNAME не установлен")
+            return
+        bot, dp = self.anon_bot.bot, self.anon_bot.dp
+        allowed_updates = dp.resolve_used_update_types()
+        with self.phase("webhook"):
+            try:
+                info = await bot.get_webhook_info()
+                self.backlog = info.pending_update_count
+                if self.backlog:
+                    logger.info(f"📥 Накопилось обновлений за время простоя: {self.backlog}")
+
+                if (info.url != WEBHOOK_URL or info.max_connections != WEBHOOK_MAX_CONNECTIONS
+                        or set(info.allowed_updates or ()) != set(allowed_updates)):
+                    await bot.set_webhook(WEBHOOK_URL, max_connections=WEBHOOK_MAX_CONNECTIONS,
+                                          allowed_updates=allowed_updates, drop_pending_updates=False)
+                    logger.info(f"✅ Вебхук установлен: {WEBHOOK_URL}")
+                else:
+                    logger.info(f"✅ Вебхук уже установлен: {WEBHOOK_URL}")
+            except Exception as e:
+                logger.error(f"❌ Не удалось установить вебхук: {e}")
 
-        bot_info = await bot.get_me()
-        logger.info(f"🤖 Бот запущен: @{bot_info.username} (ID: {bot_info.id})")
+    async def _identify(self):
+        bot, bot_identity = self.anon_bot.bot, self.anon_bot.bot_identity
+        # Данные бота дальше обновляются в фоне; при ошибке обработчики запросят их сами
+        bot_identity.start_refresh(bot)
+        with self.phase("get_me"):
+            try:
+                bot_info = await bot_identity.refresh(bot)
+                logger.info(f"🤖 Бот запущен: @{bot_info.username} (ID: {bot_info.id})")
+            except Exception as e:
+                logger.error(f"❌ Ошибка получения информации о боте: {e}")
 
-        # Уведомление админу
+    async def _notify_admin(self):
         admin_id = os.getenv("ADMIN_ID")
-        if admin_id and admin_id.strip():
+        if not admin_id or not admin_id.strip():
+            return
+        with self.phase("admin_notice"):
             try:
-                await bot.send_message(
+                await self.anon_bot.bot.send_message(
                     chat_id=int(admin_id),
                     text=f"✅ Бот запущен!\n"
-                         f"🤖 @{bot_info.username}\n"
+                         f"🤖 @{self.anon_bot.bot_identity.username}\n"
                          f"🌐 Режим: {'Webhook' if WEBHOOK_URL else 'Polling'}\n"
-                         f"🕒 {__import__('datetime').datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                         f"🕒 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                         f"⏱ Готов через {self.milestones['ready']:.1f} сек\n"
+                         f"📥 Накопилось обновлений: {self.backlog or 0}"
                 )
                 logger.info(f"📨 Уведомление отправлено админу ID: {admin_id}")
             except Exception as e:
                 logger.warning(f"⚠️ Не удалось отправить админу: {e}")
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка при запуске: {e}", exc_info=True)
+    async def on_shutdown(self, app: web.Application):
+        # Порт уже закрыт: новые обновления Telegram доставит после перезапуска,
+        # принятые дорабатываются - aiohttp ждет их до on_cleanup
+        self._deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        logger.info(f"🛑 Остановка бота (до {SHUTDOWN_TIMEOUT:.0f} сек на обработку принятого)...")
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
 
+    def _remaining(self) -> float:
+        return max(0.0, self._deadline - time.monotonic())
 
-# Shutdown
-async def on_shutdown(app):
-    logger.info("🛑 Остановка бота...")
-    try:
-        if WEBHOOK_URL:
-            await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("✅ Бот остановлен")
-    except Exception as e:
-        logger.error(f"❌ Ошибка при остановке: {e}")
+    async def on_cleanup(self, app: web.Application):
+        """Дорабатываем очереди в пределах SHUTDOWN_TIMEOUT и закрываем БД (вебхук остается)"""
+        anon_bot = self.anon_bot
+        if anon_bot is None:
+            logger.info("✅ Бот остановлен до завершения запуска")
+            return
 
+        try:
+            # simple: Telegram уже получил 200, обновления обрабатываются в фоновых задачах aiogram
+            tasks = set(getattr(self.handler, "_background_feed_update_tasks", ()))
+            if tasks:
+                _, pending = await asyncio.wait(tasks, timeout=self._remaining())
+                if pending:
+                    logger.warning(f"⚠️ Не успели обработать {len(pending)} принятых обновлений")
+            pool = getattr(self.handler, "pool", None)
+            if pool is not None and not await pool.drain(self._remaining()):
+                logger.warning(f"⚠️ Не успели обработать {pool.pending} принятых обновлений")
+            if self.handler is not None:
+                await anon_bot.dp.emit_shutdown(**self._workflow_data)
+            await anon_bot.bot_identity.stop()
+            # Собранные альбомы и уведомления о повторах уходят до остановки планировщика
+            await asyncio.wait_for(asyncio.gather(anon_bot.albums.stop(), anon_bot.duplicates.stop()),
+                                   self._remaining())
+            if not await anon_bot.outbound.drain(self._remaining()):
+                logger.warning(f"⚠️ Не успели отправить {anon_bot.outbound.queue_depth} запросов")
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Время на остановку истекло")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при остановке: {e}")
+        finally:
+            await anon_bot.outbound.stop()
+            # Очередь отложенной записи дописывается всегда
+            await anon_bot.close_db()
+            await anon_bot.bot.session.close()
+            logger.info("✅ Бот остановлен")
 
-# Основная функция
-def main():
-    logger.info("🚀 Запуск анонимного Telegram бота...")
+    # Вебхук: запрос, пришедший во время запуска, ждет готовности бота
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        if not await self.wait_ready(STARTUP_TIMEOUT):
+            return web.Response(text="Service Unavailable", status=503, headers={"Retry-After": "1"})
+        return await self.handler.handle(request)
 
-    # Проверка токена
-    if not os.getenv("BOT_TOKEN"):
-        logger.error("❌ BOT_TOKEN не найден! Установите переменную окружения BOT_TOKEN")
-        sys.exit(1)
+    # Метрики в формате Prometheus (появляются после импорта бота)
+    async def metrics_page(self, request: web.Request) -> web.Response:
+        if self.registry is None:
+            return web.Response(text="# starting\n", status=503, content_type="text/plain", charset="utf-8")
+        return web.Response(text=await self.registry.render(), content_type="text/plain", charset="utf-8")
 
-    # Создаем приложение
+
+BOT_STARTUP = web.AppKey("bot_startup", BotStartup)
+
+
+# Health check
+async def health_check(request):
+    return web.Response(text="OK", status=200)
+
+
+# Главная страница
+async def home_page(request):
+    return web.Response(
+        text="🤖 Анонимный Telegram бот работает!\n\n"
+             "Этот бот позволяет отправлять анонимные сообщения.\n"
+             "Используйте Telegram для взаимодействия с ботом.",
+        status=200
+    )
+
+
+# Создание приложения (используется и в bench_webhook.py)
+def create_app(mode: str = WEBHOOK_MODE) -> web.Application:
     app = web.Application()
+    startup = app[BOT_STARTUP] = BotStartup(mode)
 
     # Роуты
     app.router.add_get("/health", health_check)
     app.router.add_get("/", home_page)
+    app.router.add_get("/metrics", startup.metrics_page)
+    app.router.add_post(WEBHOOK_PATH, startup.handle_webhook)
 
-    # Вебхук
-    webhook_handler = SimpleRequestHandler(
-        dispatcher=dp,
-        bot=bot,
-    )
-    webhook_handler.register(app, path=WEBHOOK_PATH)
+    # Startup/shutdown
+    app.on_startup.append(startup.on_startup)
+    app.on_shutdown.append(startup.on_shutdown)
+    app.on_cleanup.append(startup.on_cleanup)
+    return app
 
-    # Настройка приложения
-    setup_application(app, dp, bot=bot)
 
-    # Startup/shutdown
-    app.on_startup.append(on_startup)
-    app.on_shutdown.append(on_shutdown)
+# Основная функция
+def main():
+    logger.info("🚀 Запуск анонимного Telegram бота...")
+
+    # Проверка токена
+    if not os.getenv("BOT_TOKEN"):
+        logger.error("❌ BOT_TOKEN не найден! Установите переменную окружения BOT_TOKEN")
+        sys.exit(1)
+
+    # Создаем приложение
+    app = create_app()
 
     # Запуск сервера
     logger.info(f"🌐 Сервер запускается на порту {PORT}")
-    logger.info(f"🔧 Режим: {'Webhook' if WEBHOOK_URL else 'Polling'}")
+    logger.info(f"🔧 Режим: {'Webhook' if WEBHOOK_URL else 'Polling'} ({WEBHOOK_MODE})")
 
     try:
-        web.run_app(app, host="0.0.0.0", port=PORT)
+        web.run_app(app, host="0.0.0.0", port=PORT, shutdown_timeout=SHUTDOWN_TIMEOUT)
     except Exception as e:
         logger.error(f"❌ Ошибка запуска сервера: {e}")
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
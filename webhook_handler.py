@@ -0,0 +1,46 @@
+"""
+Обработчик вебхука с мгновенным ответом (WEBHOOK_MODE=fast_ack)
+Импортируется webhook.py в фоне вместе с aiogram, после открытия порта
+"""
+
+import os
+import logging
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from workers import KeyedWorkerPool, PoolFull, update_chat_key
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 16))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+
+
+class FastAckRequestHandler(SimpleRequestHandler):
+    """Вебхук с мгновенным ответом 200 и обработкой в ограниченном пуле
+
+    Обновления одного чата обрабатываются по порядку, поэтому переходы
+    FSM в process_any_message не перемешиваются. При переполнении очереди
+    Telegram получает 429 и повторит доставку позже. Пул при остановке
+    дорабатывает webhook.BotStartup.on_cleanup в пределах SHUTDOWN_TIMEOUT.
+    """
+
+    def __init__(self, dispatcher, bot, concurrency: int = WEBHOOK_CONCURRENCY,
+                 max_pending: int = WEBHOOK_QUEUE_SIZE, **data):
+        super().__init__(dispatcher=dispatcher, bot=bot, **data)
+        self.pool = KeyedWorkerPool(concurrency=concurrency, max_pending=max_pending)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            self.pool.submit(update_chat_key(update),
+                             lambda: self._background_feed_update(bot=bot, update=update))
+        except PoolFull:
+            logger.warning("⚠️ Очередь обновлений переполнена, Telegram повторит доставку")
+            return web.Response(text="Too Many Requests", status=429, headers={"Retry-After": "1"})
+
+        return web.json_response({}, dumps=bot.session.json_dumps)
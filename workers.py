@@ -0,0 +1,113 @@
+"""
+Пул обработки обновлений с сохранением порядка внутри одного чата
+Разные чаты обрабатываются параллельно (не больше concurrency одновременно),
+обновления одного чата - строго по очереди, чтобы не было гонок в FSM
+"""
+
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class PoolFull(Exception):
+    """Очередь пула переполнена"""
+
+
+class KeyedWorkerPool:
+    """Пул задач с очередью на каждый ключ (чат) и общим лимитом параллельности"""
+
+    def __init__(self, concurrency: int = 16, max_pending: int = 1000):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues = {}
+        self._tasks = set()
+        self._changed = asyncio.Event()
+        self.pending = 0
+        self.in_flight = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def submit(self, key, job):
+        """Постановка задачи (фабрики корутины) в очередь ключа; PoolFull при переполнении"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PoolFull()
+
+        self.pending += 1
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(job)
+            return
+
+        queue = self._queues[key] = deque([job])
+        task = asyncio.create_task(self._run_key(key, queue))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def submit_wait(self, key, job):
+        """Постановка задачи с ожиданием свободного места"""
+        while self.pending >= self.max_pending:
+            self._changed.clear()
+            await self._changed.wait()
+        self.submit(key, job)
+
+    async def _run_key(self, key, queue: deque):
+        while queue:
+            job = queue.popleft()
+            async with self._semaphore:
+                self.in_flight += 1
+                try:
+                    await job()
+                    self.processed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"❌ Ошибка обработки обновления (ключ {key}): {e}", exc_info=True)
+                finally:
+                    self.in_flight -= 1
+                    self.pending -= 1
+                    self._changed.set()
+        del self._queues[key]
+
+    async def drain(self, timeout: float = None) -> bool:
+        """Ожидание завершения всех задач; False, если не успели за timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        while self.pending:
+            self._changed.clear()
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "in_flight": self.in_flight,
+            "chats": len(self._queues),
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+
+def update_chat_key(update: dict):
+    """Ключ очереди для сырого обновления: ID чата, иначе ID пользователя"""
+    for field, payload in update.items():
+        if not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user and "id" in user:
+            return user["id"]
+    return update.get("update_id")